@@ -27,15 +27,23 @@ CREATE TABLE diaries (
     diary_date DATE NOT NULL,
     content TEXT NOT NULL,
     image_s3_key TEXT,
+    image_variants JSONB,
     mood TEXT,
     style_preset VARCHAR(50),
     generation_options JSONB,
+    generation_plan JSONB,
     created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
     updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
     CONSTRAINT unique_user_date UNIQUE (user_id, diary_date)
 );
 
 CREATE INDEX idx_diaries_user ON diaries(user_id);
+--keyset pagination (목록 커서)
+CREATE INDEX idx_diaries_user_date_id ON diaries(user_id, diary_date DESC, id DESC);
+CREATE INDEX idx_diaries_user_created_id ON diaries(user_id, created_at DESC, id DESC);
+--본문 검색용 (trigram, 한글 포함)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_diaries_content_trgm ON diaries USING gin (content gin_trgm_ops);
 --일기 분할 저장 테이블
 CREATE TABLE diary_chunks (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -57,15 +65,15 @@ CREATE INDEX idx_chunks_user ON diary_chunks(user_id);
 CREATE INDEX idx_chunks_diary ON diary_chunks(diary_id);
 
 --search table
+-- embedding_vector: JSON copy written by the ORM (works without pgvector)
+-- embedding: same vector as pgvector type, sized to EMBEDDING_DIMENSIONS (Titan v2, default 256)
 CREATE TABLE diary_chunk_embeddings (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     chunk_id UUID NOT NULL REFERENCES diary_chunks(id) ON DELETE CASCADE,
-    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    embedding VECTOR(1536) NOT NULL,
-    embedding_model TEXT NOT NULL,
-    embedding_version TEXT NOT NULL,
-    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-    CONSTRAINT unique_chunk_model UNIQUE (chunk_id, embedding_model, embedding_version)
+    user_id UUID,
+    embedding_vector JSON NOT NULL,
+    embedding VECTOR(256),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 --HNSW 인덱스 
 CREATE INDEX idx_embeddings_vector
@@ -73,4 +81,29 @@ ON diary_chunk_embeddings
 USING hnsw (embedding vector_cosine_ops);
 
 --사용자 스코프 필터링용
-CREATE INDEX idx_embeddings_user ON diary_chunk_embeddings(user_id);
\ No newline at end of file
+CREATE INDEX idx_embeddings_user ON diary_chunk_embeddings(user_id);
+--generation job queue (JOB_BACKEND=postgres)
+CREATE TABLE generation_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    artifact_id UUID,
+    status VARCHAR(32) NOT NULL DEFAULT 'QUEUED',
+    step TEXT,
+    progress REAL DEFAULT 0,
+    error TEXT,
+    payload JSONB NOT NULL,
+    idempotency_key VARCHAR(128),
+    dedupe_key VARCHAR(64),
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    locked_by VARCHAR(64),
+    locked_until TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_generation_jobs_claim ON generation_jobs(status, created_at);
+CREATE INDEX idx_generation_jobs_user ON generation_jobs(user_id);
+CREATE UNIQUE INDEX uq_generation_jobs_idempotency ON generation_jobs(user_id, idempotency_key);
+CREATE UNIQUE INDEX uq_generation_jobs_inflight ON generation_jobs(user_id, dedupe_key)
+WHERE status NOT IN ('DONE', 'SUCCEEDED', 'FAILED');
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from .job_backend import JOB_BACKEND
+
+
+# Jobs waiting for a worker (not yet running) before new submissions get a 429
+GENERATION_QUEUE_MAX = int(os.getenv("GENERATION_QUEUE_MAX", "32"))
+# Queued + running jobs one user may have at the same time
+GENERATION_MAX_PER_USER = int(os.getenv("GENERATION_MAX_PER_USER", "2"))
+# Seed for the Retry-After estimate until real job durations are measured
+GENERATION_AVG_JOB_SECONDS = float(os.getenv("GENERATION_AVG_JOB_SECONDS", "60"))
+RETRY_AFTER_MAX_SECONDS = int(os.getenv("GENERATION_RETRY_AFTER_MAX_SECONDS", "300"))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int, queue_depth: int, user_active: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+        self.user_active = user_active
+
+    def detail(self) -> Dict[str, Any]:
+        return {
+            "message": self.reason,
+            "retryAfter": self.retry_after,
+            "queueDepth": self.queue_depth,
+            "activeJobs": self.user_active,
+        }
+
+
+@dataclass
+class Admission:
+    queue_position: int
+    estimated_wait_seconds: int
+
+
+class AdmissionStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_user_limit = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "queue_max": GENERATION_QUEUE_MAX,
+            "max_per_user": GENERATION_MAX_PER_USER,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_user_limit": self.rejected_user_limit,
+        }
+
+
+ADMISSION_STATS = AdmissionStats()
+
+
+def estimate_wait_seconds(jobs_ahead: int, workers: int, avg_job_seconds: float) -> int:
+    rounds = math.ceil((jobs_ahead + 1) / max(workers, 1))
+    return max(1, min(RETRY_AFTER_MAX_SECONDS, int(rounds * avg_job_seconds)))
+
+
+async def admit(user_id: str, workers: int, avg_job_seconds: float) -> Admission:
+    """
+    Admission control for POST /api/diary/generate, checked before anything is
+    written: rejects when the shared queue is full or the user already has
+    GENERATION_MAX_PER_USER jobs in flight. With several replicas the check and
+    the enqueue aren't atomic, so the limits are soft by a few jobs.
+    """
+    queued, user_active = await JOB_BACKEND.counts(user_id)
+    avg = avg_job_seconds or GENERATION_AVG_JOB_SECONDS
+
+    if user_active >= GENERATION_MAX_PER_USER:
+        ADMISSION_STATS.rejected_user_limit += 1
+        raise AdmissionRejected(
+            "You already have comics being generated. Please wait for them to finish.",
+            retry_after=max(1, min(RETRY_AFTER_MAX_SECONDS, int(avg))),
+            queue_depth=queued,
+            user_active=user_active,
+        )
+    if queued >= GENERATION_QUEUE_MAX:
+        ADMISSION_STATS.rejected_queue_full += 1
+        raise AdmissionRejected(
+            "The generation queue is full. Please try again shortly.",
+            # A slot frees up only once the jobs ahead have drained through the workers
+            retry_after=estimate_wait_seconds(queued, workers, avg),
+            queue_depth=queued,
+            user_active=user_active,
+        )
+
+    ADMISSION_STATS.admitted += 1
+    return Admission(queue_position=queued + 1, estimated_wait_seconds=estimate_wait_seconds(queued, workers, avg))
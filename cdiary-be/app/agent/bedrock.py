@@ -5,12 +5,21 @@ import json
 import os
 import uuid
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 import random
 import traceback
-import boto3
 from botocore.exceptions import ClientError
 from . import prompts
+from .clients import get_client
+from .rate_limit import BEDROCK_LIMITERS
+from app.utils.cache import TTLCache
+from . import text_cache
+from .text_cache import TEXT_CACHE, TEXT_CACHE_ENABLED
+from .render_cache import (
+    RenderCache, render_digest,
+    RENDER_CACHE_ENABLED, RENDER_CACHE_INDEX_SIZE, RENDER_CACHE_VERIFY_SECONDS,
+    RENDER_CACHE_EXPIRATION_DAYS,
+)
 
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
@@ -18,48 +27,170 @@ AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 NOVA_TEXT_MODEL_ID = os.getenv("NOVA_TEXT_MODEL_ID", "amazon.nova-lite-v1:0")
 NOVA_IMAGE_MODEL_ID = os.getenv("NOVA_IMAGE_MODEL_ID", "amazon.nova-canvas-v1:0")
 
+# maxTokens when a caller doesn't pass its own budget (see graph.text_token_budget)
+TEXT_MAX_TOKENS = int(os.getenv("TEXT_MAX_TOKENS", "2000"))
+
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0")
+# Titan v2 supports 256/512/1024; the pgvector column is sized from this
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "256"))
+
 S3_BUCKET = os.getenv("S3_BUCKET", "cartoon-diary")
 S3_PREFIX = os.getenv("S3_PREFIX", "temp").strip("/")
 S3_PUBLIC = os.getenv("S3_PUBLIC", "false").lower() == "true"
 S3_PRESIGN_EXPIRE_SECONDS = int(os.getenv("S3_PRESIGN_EXPIRE_SECONDS", "3600"))
+# Cached presigned URLs are handed out until this many seconds before they expire
+S3_PRESIGN_SAFETY_MARGIN_SECONDS = int(os.getenv(
+    "S3_PRESIGN_SAFETY_MARGIN_SECONDS", str(min(300, S3_PRESIGN_EXPIRE_SECONDS // 4))
+))
+S3_PRESIGN_CACHE_SIZE = int(os.getenv("S3_PRESIGN_CACHE_SIZE", "20000"))
+
+PRESIGN_CACHE = TTLCache(max_entries=S3_PRESIGN_CACHE_SIZE)
+
+# generate_text_to_image / generate_image_variation always target Canvas in us-east-1
+CANVAS_MODEL_ID = "amazon.nova-canvas-v1:0"
 
+RENDER_CACHE = RenderCache(
+    prefix=S3_PREFIX,
+    index_size=RENDER_CACHE_INDEX_SIZE,
+    verify_seconds=RENDER_CACHE_VERIFY_SECONDS,
+    expiration_days=RENDER_CACHE_EXPIRATION_DAYS,
+)
 
-def _bedrock_runtime():
-    return boto3.client("bedrock-runtime", region_name=AWS_REGION)
+
+def _bedrock_runtime(region_name: Optional[str] = None):
+    return get_client("bedrock-runtime", region_name=region_name or AWS_REGION)
 
  
 def _s3():
-    return boto3.client("s3", region_name=AWS_REGION)
+    return get_client("s3", region_name=AWS_REGION)
 
 
-def invoke_text_model(prompt: str, temperature: float = 0.3) -> str:
+def _invoke_model(client, model_id: str, body: str) -> Dict[str, Any]:
     """
-    Nova Text Model Invocation
+    invoke_model through the per-model rate limiter (token bucket + adaptive
+    concurrency), with jittered retries on throttling. All Bedrock calls go here.
     """
-    br = _bedrock_runtime()
-    body = {
+    return BEDROCK_LIMITERS.call(model_id, lambda: client.invoke_model(
+        modelId=model_id,
+        body=body,
+        accept="application/json",
+        contentType="application/json",
+    ))
+
+
+def _text_body(prompt: str, temperature: float, max_tokens: Optional[int]) -> Dict[str, Any]:
+    return {
         "messages": [{"role": "user", "content": [{"text": prompt}]}],
         "inferenceConfig": {
             "temperature": temperature,
-            "maxTokens": 2000,
+            "maxTokens": max_tokens or TEXT_MAX_TOKENS,
         },
     }
-    
+
+
+class TextTruncated(ValueError):
+    """The completion stopped at maxTokens (see invoke_text_model's allow_truncated)."""
+
+
+def invoke_text_model(prompt: str, temperature: float = 0.3, use_cache: bool = True,
+                      max_tokens: Optional[int] = None, retry_truncated: bool = False,
+                      allow_truncated: bool = True) -> str:
+    """
+    Nova Text Model Invocation
+    Identical requests (model, prompt, temperature, maxTokens) are served from
+    TEXT_CACHE; pass use_cache=False to force a fresh sample.
+    max_tokens caps the completion (default TEXT_MAX_TOKENS); a smaller budget
+    lets Bedrock reserve less output capacity per call. With retry_truncated,
+    a completion cut off by that budget is requested once more with
+    TEXT_MAX_TOKENS (for JSON output, which is useless when truncated); with
+    allow_truncated=False a completion that is still cut off raises TextTruncated.
+    """
+    body = _text_body(prompt, temperature, max_tokens)
+
+    cache_key = None
+    if TEXT_CACHE_ENABLED:
+        if use_cache:
+            cache_key = text_cache.make_key(NOVA_TEXT_MODEL_ID, body)
+            cached = TEXT_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+        else:
+            TEXT_CACHE.bypassed += 1
+
+    br = _bedrock_runtime()
     try:
-        resp = br.invoke_model(
-            modelId=NOVA_TEXT_MODEL_ID,
-            body=json.dumps(body),
-            accept="application/json",
-            contentType="application/json",
-        )
+        resp = _invoke_model(br, NOVA_TEXT_MODEL_ID, json.dumps(body))
         data = json.loads(resp["body"].read())
         
         # Standard Nova response parsing
-        return data["output"]["message"]["content"][0]["text"]
+        text = data["output"]["message"]["content"][0]["text"]
+        truncated = data.get("stopReason") == "max_tokens"
+        if truncated:
+            print(f"WARNING: Text completion hit maxTokens={body['inferenceConfig']['maxTokens']}; output is truncated", flush=True)
         
     except Exception:
         raise
 
+    if truncated and retry_truncated and body["inferenceConfig"]["maxTokens"] < TEXT_MAX_TOKENS:
+        print(f"Retrying truncated completion with maxTokens={TEXT_MAX_TOKENS}", flush=True)
+        return invoke_text_model(prompt, temperature, use_cache, max_tokens=TEXT_MAX_TOKENS,
+                                 allow_truncated=allow_truncated)
+    if truncated and not allow_truncated:
+        raise TextTruncated(f"completion hit maxTokens={body['inferenceConfig']['maxTokens']}")
+
+    # Fresh samples still refresh the cache for the next regular caller;
+    # truncated ones aren't kept so a retry gets a new completion
+    if TEXT_CACHE_ENABLED and not truncated:
+        TEXT_CACHE.set(cache_key or text_cache.make_key(NOVA_TEXT_MODEL_ID, body), text)
+    return text
+
+def stream_text_model(prompt: str, temperature: float = 0.3, use_cache: bool = True,
+                      max_tokens: Optional[int] = None) -> Iterator[str]:
+    """
+    Nova text through invoke_model_with_response_stream: yields text deltas as
+    the model decodes them, so callers can act on a partial completion. Same
+    request body, TEXT_CACHE and rate limiter as invoke_text_model; a cache
+    hit is yielded as a single delta.
+    """
+    body = _text_body(prompt, temperature, max_tokens)
+    cache_key = text_cache.make_key(NOVA_TEXT_MODEL_ID, body) if TEXT_CACHE_ENABLED else None
+    if cache_key is not None:
+        if use_cache:
+            cached = TEXT_CACHE.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        else:
+            TEXT_CACHE.bypassed += 1
+
+    br = _bedrock_runtime()
+    parts: List[str] = []
+    stop_reason = None
+    events = BEDROCK_LIMITERS.stream(NOVA_TEXT_MODEL_ID, lambda: br.invoke_model_with_response_stream(
+        modelId=NOVA_TEXT_MODEL_ID,
+        body=json.dumps(body),
+        accept="application/json",
+        contentType="application/json",
+    )["body"])
+    for event in events:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        data = json.loads(chunk["bytes"])
+        delta = data.get("contentBlockDelta", {}).get("delta", {}).get("text")
+        if delta:
+            parts.append(delta)
+            yield delta
+        if "messageStop" in data:
+            stop_reason = data["messageStop"].get("stopReason")
+
+    truncated = stop_reason == "max_tokens"
+    if truncated:
+        print(f"WARNING: Text completion hit maxTokens={body['inferenceConfig']['maxTokens']}; output is truncated", flush=True)
+    elif cache_key is not None:
+        TEXT_CACHE.set(cache_key, "".join(parts))
+
+
 def invoke_visual_qa(prompt: str, image_bytes: bytes, temperature: float = 0.1) -> str:
     """
     Nova Multimodal Model Invocation for QA
@@ -93,12 +224,7 @@ def invoke_visual_qa(prompt: str, image_bytes: bytes, temperature: float = 0.1)
     }
     
     try:
-        resp = br.invoke_model(
-            modelId=NOVA_TEXT_MODEL_ID, 
-            body=json.dumps(body),
-            accept="application/json",
-            contentType="application/json",
-        )
+        resp = _invoke_model(br, NOVA_TEXT_MODEL_ID, json.dumps(body))
         data = json.loads(resp["body"].read())
         return data["output"]["message"]["content"][0]["text"]
         
@@ -114,16 +240,11 @@ def get_embedding(text: str) -> List[float]:
         br = _bedrock_runtime()
         body = {
             "inputText": text,
-            "dimensions": 256,
+            "dimensions": EMBEDDING_DIMENSIONS,
             "normalize": True
         }
         print(f"DEBUG: Invoking Titan Embeddings with text: {text[:50]}...", flush=True)
-        resp = br.invoke_model(
-            modelId="amazon.titan-embed-text-v2:0",
-            body=json.dumps(body),
-            accept="application/json",
-            contentType="application/json"
-        )
+        resp = _invoke_model(br, EMBEDDING_MODEL_ID, json.dumps(body))
         result = json.loads(resp["body"].read())
         emb = result.get("embedding", [])
         print(f"DEBUG: Successfully generated embedding of length {len(emb)}", flush=True)
@@ -169,13 +290,11 @@ class ImageInvokeResult:
     img_bytes: Optional[bytes] = None
 
 
-def generate_text_to_image(cut_prompt: str, seed: int = 42) -> tuple[Dict[str, Any], bytes]:
+def build_text_to_image_body(cut_prompt: str, seed: int = 42) -> Dict[str, Any]:
     """
-    Generate image using Text-to-Image (Cut 1)
+    Nova Canvas TEXT_IMAGE request body. Deterministic for a given prompt/seed,
+    which is what makes RENDER_CACHE possible.
     """
-    client = boto3.client(service_name="bedrock-runtime", region_name="us-east-1")
-    model_id = "amazon.nova-canvas-v1:0"
-    
     # 4-Panel Strip Constraints
     text = prompts.IMAGE_GEN_STYLE_PREFIX + prompts.IMAGE_GEN_CLEANUP_INSTRUCTIONS + cut_prompt
     negative = prompts.IMAGE_GEN_NEGATIVE_PROMPT
@@ -185,7 +304,7 @@ def generate_text_to_image(cut_prompt: str, seed: int = 42) -> tuple[Dict[str, A
         print(f"WARNING: Truncating prompt for Bedrock (Length: {len(text)})", flush=True)
         text = text[:1024]
 
-    body = {
+    return {
         "taskType": "TEXT_IMAGE",
         "textToImageParams": {
             "text": text,
@@ -200,15 +319,22 @@ def generate_text_to_image(cut_prompt: str, seed: int = 42) -> tuple[Dict[str, A
             "seed": seed
         }
     }
+
+
+def generate_text_to_image(cut_prompt: str, seed: int = 42, body: Optional[Dict[str, Any]] = None) -> tuple[Dict[str, Any], bytes]:
+    """
+    Generate image using Text-to-Image (Cut 1)
+    """
+    client = _bedrock_runtime(region_name="us-east-1")
+    model_id = CANVAS_MODEL_ID
+
+    if body is None:
+        body = build_text_to_image_body(cut_prompt, seed=seed)
+    text = body["textToImageParams"]["text"]
     print("cut_prompt==="+cut_prompt)
     print(f"Invoking {model_id} (TEXT_IMAGE) with Body='{text}'...")
 
-    response = client.invoke_model(
-        modelId=model_id,
-        body=json.dumps(body),
-        accept="application/json",
-        contentType="application/json"
-    )
+    response = _invoke_model(client, model_id, json.dumps(body))
     
     raw = json.loads(response["body"].read())
     b64_list = _extract_base64_candidates(raw)
@@ -223,8 +349,8 @@ def generate_image_variation(cut_prompt: str, ref_image: bytes, seed: int = 42)
     """
     Generate image using Image Variation (Cuts 2-4)
     """
-    client = boto3.client(service_name="bedrock-runtime", region_name="us-east-1")
-    model_id = "amazon.nova-canvas-v1:0"
+    client = _bedrock_runtime(region_name="us-east-1")
+    model_id = CANVAS_MODEL_ID
     
     # Text prompt is still used in variation to guide the content
     b64_img = base64.b64encode(ref_image).decode("utf-8")
@@ -252,12 +378,7 @@ def generate_image_variation(cut_prompt: str, ref_image: bytes, seed: int = 42)
     print(f"Invoking {model_id} (IMAGE_VARIATION)...")
     print({cut_prompt})
 
-    response = client.invoke_model(
-        modelId=model_id,
-        body=json.dumps(body),
-        accept="application/json",
-        contentType="application/json"
-    )
+    response = _invoke_model(client, model_id, json.dumps(body))
         
     raw = json.loads(response["body"].read())
     b64_list = _extract_base64_candidates(raw)
@@ -273,10 +394,16 @@ def invoke_image_model_to_s3(
     job_id: str,
     cut_index: int,
     ref_image: Optional[bytes] = None,
-    seed: int = 42
+    seed: int = 42,
+    use_cache: bool = True
 ) -> ImageInvokeResult:
     """
     Bedrock Image Model -> S3
+    The returned s3_key is always the job's own copy (save_cut_image's key), which
+    diaries keep. Identical TEXT_IMAGE requests are served from RENDER_CACHE: the
+    cached object is copied server-side (no Bedrock call, no upload) and
+    img_bytes is None. use_cache=False always renders (the result is still
+    stored for later identical requests).
     """
     
     
@@ -284,9 +411,45 @@ def invoke_image_model_to_s3(
     #     raw, img_bytes = generate_text_to_image(cut_prompt, seed=seed)
     # else:
     #     raw, img_bytes = generate_image_variation(cut_prompt, ref_image, seed=seed)
-    raw, img_bytes = generate_text_to_image(cut_prompt, seed=seed)
-    # Save image (S3 or Local) using helper
-    s3_key, url = save_cut_image(job_id, cut_index, img_bytes)
+    body = build_text_to_image_body(cut_prompt, seed=seed)
+
+    if RENDER_CACHE_ENABLED and S3_BUCKET:
+        digest = render_digest(CANVAS_MODEL_ID, body)
+        s3_key = None
+        if use_cache:
+            s3_key = RENDER_CACHE.lookup(_s3(), S3_BUCKET, digest)
+        else:
+            RENDER_CACHE.bypassed += 1
+        if s3_key:
+            # renders/ may expire (lifecycle rule); the diary gets its own copy
+            cut_key = cut_image_key(job_id, cut_index)
+            try:
+                copy_s3_object(S3_BUCKET, s3_key, cut_key)
+            except ClientError as e:
+                print(f"[{job_id}] Render cache copy of {s3_key} failed ({e}), rendering again", flush=True)
+                RENDER_CACHE.evict(digest)
+            else:
+                print(f"[{job_id}] Cut {cut_index} served from render cache ({digest[:12]})", flush=True)
+                return ImageInvokeResult(
+                    s3_key=cut_key,
+                    s3_uri=f"s3://{S3_BUCKET}/{cut_key}",
+                    url=make_access_url(S3_BUCKET, cut_key),
+                    raw={"cached": True, "digest": digest},
+                    img_bytes=None
+                )
+
+        raw, img_bytes = generate_text_to_image(cut_prompt, seed=seed, body=body)
+        s3_key, url = save_cut_image(job_id, cut_index, img_bytes)
+        # Also under the content address so the next identical request finds it
+        try:
+            copy_s3_object(S3_BUCKET, s3_key, RENDER_CACHE.key_for(digest))
+            RENDER_CACHE.record(digest, RENDER_CACHE.key_for(digest))
+        except ClientError as e:
+            print(f"WARNING: Could not add {s3_key} to the render cache: {e}", flush=True)
+    else:
+        raw, img_bytes = generate_text_to_image(cut_prompt, seed=seed, body=body)
+        # Save image (S3 or Local) using helper
+        s3_key, url = save_cut_image(job_id, cut_index, img_bytes)
 
     return ImageInvokeResult(
         s3_key=s3_key,
@@ -297,14 +460,17 @@ def invoke_image_model_to_s3(
     )
 
 
+def cut_image_key(job_id: str, cut_index: int) -> str:
+    """Durable per-job key of a rendered panel (diary chunks point here)."""
+    return f"{S3_PREFIX}/jobs/{job_id}/cut-{cut_index:02d}-{uuid.uuid4().hex}.png"
+
+
 def save_cut_image(job_id: str, cut_index: int, img_bytes: bytes) -> tuple[str, str]:
     """
     Saves image bytes to S3 or local disk.
     Returns (s3_key, url)
     """
-    ext = "png"
-    file_id = uuid.uuid4().hex
-    s3_key = f"{S3_PREFIX}/jobs/{job_id}/cut-{cut_index:02d}-{file_id}.{ext}"
+    s3_key = cut_image_key(job_id, cut_index)
     
     if S3_BUCKET:
         upload_bytes_to_s3(S3_BUCKET, s3_key, img_bytes, "image/png")
@@ -356,18 +522,49 @@ def upload_bytes_to_s3(bucket, key, data, content_type):
         extra_args["ACL"] = "public-read"
     
     s3.put_object(Bucket=bucket, Key=key, Body=data, **extra_args)
+    # Overwritten keys (e.g. profile.png) must get a fresh URL so browsers refetch
+    PRESIGN_CACHE.pop((bucket, key))
+
+
+def copy_s3_object(bucket, src_key, dst_key):
+    """Server-side copy within the bucket (no download / upload through us)."""
+    extra_args = {"ACL": "public-read"} if S3_PUBLIC else {}
+    _s3().copy_object(Bucket=bucket, Key=dst_key, CopySource={"Bucket": bucket, "Key": src_key}, **extra_args)
+    PRESIGN_CACHE.pop((bucket, dst_key))
 
 
 def make_access_url(bucket, key):
     if S3_PUBLIC:
         return f"https://{bucket}.s3.amazonaws.com/{key}"
     
-    s3 = _s3()
-    return s3.generate_presigned_url(
+    url = PRESIGN_CACHE.get((bucket, key))
+    if url is None:
+        url = _presign(bucket, key)
+    return url
+
+
+def make_access_urls(bucket, keys) -> Dict[str, str]:
+    """
+    Bulk variant of make_access_url for list endpoints: {key: url}.
+    Keys are de-duplicated and only cache misses are signed.
+    """
+    urls: Dict[str, str] = {}
+    for key in keys:
+        if not key or key in urls:
+            continue
+        urls[key] = make_access_url(bucket, key)
+    return urls
+
+
+def _presign(bucket, key):
+    url = _s3().generate_presigned_url(
         "get_object",
         Params={"Bucket": bucket, "Key": key},
         ExpiresIn=S3_PRESIGN_EXPIRE_SECONDS
     )
+    # Reuse the same URL (and the browser's cached image) until shortly before it expires
+    PRESIGN_CACHE.set((bucket, key), url, ttl_seconds=max(1, S3_PRESIGN_EXPIRE_SECONDS - S3_PRESIGN_SAFETY_MARGIN_SECONDS))
+    return url
 
 
 def _extract_base64_candidates(raw: Any) -> List[str]:
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+PANEL_BLOB_BUDGET_MB = int(os.getenv("PANEL_BLOB_BUDGET_MB", "256"))
+
+
+class JobBlobStore:
+    """
+    Per-job, in-process handoff of panel bytes from the graph to the composer.
+
+    The graph already holds every rendered PNG; keeping them here lets
+    execute_job compose the strip without re-downloading from S3. Whole jobs are
+    evicted oldest-first when the byte budget is exceeded, so callers must treat
+    a miss as normal and fall back to S3 (e.g. after a restart).
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._jobs: "OrderedDict[str, Dict[str, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_jobs = 0
+
+    def put(self, job_id: str, key: str, data: bytes) -> None:
+        if not data or len(data) > self.budget_bytes:
+            return
+        with self._lock:
+            blobs = self._jobs.setdefault(job_id, {})
+            old = blobs.get(key)
+            if old is not None:
+                self._bytes -= len(old)
+            blobs[key] = data
+            self._bytes += len(data)
+            self._jobs.move_to_end(job_id)
+
+            while self._bytes > self.budget_bytes and len(self._jobs) > 1:
+                _, evicted = self._jobs.popitem(last=False)
+                self._bytes -= sum(len(b) for b in evicted.values())
+                self.evicted_jobs += 1
+
+    def get(self, job_id: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._jobs.get(job_id, {}).get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return data
+
+    def release(self, job_id: str) -> None:
+        with self._lock:
+            blobs = self._jobs.pop(job_id, None)
+            if blobs:
+                self._bytes -= sum(len(b) for b in blobs.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted_jobs": self.evicted_jobs,
+            }
+
+
+PANEL_BLOBS = JobBlobStore(PANEL_BLOB_BUDGET_MB * 1024 * 1024)
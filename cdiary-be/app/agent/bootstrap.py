@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from app.database import engine, Base, AsyncSessionLocal
+from app.models.models import Diary, DiaryChunk, GenerationJob
+from .bedrock import RENDER_CACHE, S3_BUCKET, _s3, copy_s3_object, cut_image_key, make_access_url
+from .checkpoint import CHECKPOINTS
+from .clients import warm_clients
+from .lexical_search import ensure_lexical_schema
+from .render_cache import RENDER_CACHE_EXPIRATION_DAYS, RENDER_CACHE_MANAGE_LIFECYCLE
+from .vector_search import ensure_pgvector_schema
+
+
+async def _add_column_if_missing(conn, table: str, column_ddl: str) -> bool:
+    """
+    ALTER TABLE ... ADD COLUMN inside a savepoint, so an "already exists" error
+    doesn't abort the surrounding startup transaction (Postgres).
+    """
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl}"))
+        return True
+    except Exception:
+        # Column likely already exists
+        return False
+
+
+async def ensure_schema() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        
+        # Safely add content_embedding column if it doesn't exist for vector search
+        if await _add_column_if_missing(conn, "diaries", "content_embedding JSON"):
+            print("Added content_embedding column to diaries table.", flush=True)
+
+        # Edited diaries used to get JSON 'null' instead of SQL NULL, which the
+        # backfill (content_embedding IS NULL) never picks up
+        reset = await conn.execute(text(
+            "UPDATE diaries SET content_embedding = NULL WHERE CAST(content_embedding AS TEXT) = 'null'"
+        ))
+        if reset.rowcount:
+            print(f"Reset {reset.rowcount} JSON-null content embeddings to NULL.", flush=True)
+
+        # Derivative (thumbnail/preview/webp) keys for the composed strip
+        if await _add_column_if_missing(conn, "diaries", "image_variants JSON"):
+            print("Added image_variants column to diaries table.", flush=True)
+
+        # Storyboard + image prompts of the last generation (single-panel regeneration)
+        if await _add_column_if_missing(conn, "diaries", "generation_plan JSON"):
+            print("Added generation_plan column to diaries table.", flush=True)
+
+        # Idempotency / single-flight keys for generation_jobs
+        await _add_column_if_missing(conn, "generation_jobs", "idempotency_key VARCHAR(128)")
+        await _add_column_if_missing(conn, "generation_jobs", "dedupe_key VARCHAR(64)")
+        await _add_column_if_missing(conn, "generation_jobs", "failed_cuts JSON")
+
+        # Composite indexes for keyset pagination and the job queue (create_all skips existing tables)
+        for idx in list(Diary.__table__.indexes) + list(GenerationJob.__table__.indexes):
+            await conn.run_sync(lambda sync_conn, idx=idx: idx.create(sync_conn, checkfirst=True))
+
+        # Database-side ANN search when pgvector is installed
+        await ensure_pgvector_schema(conn)
+
+        # Trigram index for the lexical search / fallback path
+        await ensure_lexical_schema(conn)
+
+
+async def relocate_cached_panels() -> int:
+    """
+    Diary chunks saved while panels were stored only under the render cache
+    prefix get their own copy (jobs/ key, like every new panel) before the
+    renders/ lifecycle rule expires them.
+    """
+    prefix = f"{RENDER_CACHE.prefix}/renders/"
+    moved = 0
+    async with AsyncSessionLocal() as db:
+        stmt = select(DiaryChunk).where(DiaryChunk.metadata_["image_s3_key"].as_string().like(prefix + "%"))
+        for chunk in (await db.execute(stmt)).scalars().all():
+            old_key = chunk.metadata_["image_s3_key"]
+            new_key = cut_image_key(f"diary-{chunk.diary_id}", chunk.chunk_index)
+            try:
+                await asyncio.to_thread(copy_s3_object, S3_BUCKET, old_key, new_key)
+            except Exception as e:
+                print(f"WARNING: Could not copy panel {old_key} out of the render cache: {e}", flush=True)
+                continue
+            # JSON column: assign a new object so the change is detected
+            chunk.metadata_ = {**chunk.metadata_, "image_s3_key": new_key, "image_url": make_access_url(S3_BUCKET, new_key)}
+            moved += 1
+        await db.commit()
+    if moved:
+        print(f"Copied {moved} diary panels out of the render cache prefix.", flush=True)
+    return moved
+
+
+async def init_process() -> None:
+    """
+    Startup shared by the API (main.py) and a standalone consumer
+    (python -m app.agent.consumer): both write embeddings, so both need the
+    pgvector state that ensure_pgvector_schema detects.
+    """
+    await ensure_schema()
+
+    # Build shared AWS clients up front so the first job doesn't pay for it
+    warm_clients()
+
+    # renders/ is only a cache once it expires; diaries must not point into it
+    if RENDER_CACHE_EXPIRATION_DAYS and S3_BUCKET:
+        await relocate_cached_panels()
+
+    # Expiration rule for the content-addressed renders (RENDER_CACHE_EXPIRATION_DAYS)
+    if RENDER_CACHE_MANAGE_LIFECYCLE and S3_BUCKET:
+        await asyncio.to_thread(RENDER_CACHE.ensure_lifecycle, _s3(), S3_BUCKET)
+
+    # Graph checkpoint store (tables for the postgres saver) before the first job
+    await asyncio.to_thread(CHECKPOINTS.setup)
+    CHECKPOINTS.start()
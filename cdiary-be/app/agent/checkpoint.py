@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, Optional
+
+from app.database import DB_HOST, DB_USER, DB_PASS, DB_NAME, DB_PORT
+
+
+# Where the generation graph persists its state after every node:
+# "sqlite" (local file, default), "postgres" (shared, for several replicas /
+# consumers), "memory" (process only) or "none" (no checkpointing)
+GRAPH_CHECKPOINTER = os.getenv("GRAPH_CHECKPOINTER", "sqlite").lower()
+GRAPH_CHECKPOINT_SQLITE_PATH = os.getenv("GRAPH_CHECKPOINT_SQLITE_PATH", "./graph_checkpoints.sqlite")
+GRAPH_CHECKPOINT_POSTGRES_URL = os.getenv(
+    "GRAPH_CHECKPOINT_POSTGRES_URL",
+    f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=require",
+)
+GRAPH_CHECKPOINT_POOL_SIZE = int(os.getenv("GRAPH_CHECKPOINT_POOL_SIZE", "4"))
+# Failed jobs keep their checkpoints for resume; threads untouched for this long
+# are purged (0 = keep forever)
+GRAPH_CHECKPOINT_TTL_HOURS = float(os.getenv("GRAPH_CHECKPOINT_TTL_HOURS", "72"))
+GRAPH_CHECKPOINT_PURGE_INTERVAL_SECONDS = int(os.getenv("GRAPH_CHECKPOINT_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+def thread_config(job_id: str) -> Dict[str, Any]:
+    """One checkpoint thread per generation job."""
+    return {"configurable": {"thread_id": job_id}}
+
+
+def _memory_saver():
+    from langgraph.checkpoint.memory import MemorySaver
+    return MemorySaver()
+
+
+def _sqlite_saver():
+    # pip install langgraph-checkpoint-sqlite
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    # Nodes run on the graph pool's threads; SqliteSaver serializes access itself
+    conn = sqlite3.connect(GRAPH_CHECKPOINT_SQLITE_PATH, check_same_thread=False)
+    return SqliteSaver(conn)
+
+
+def _postgres_saver():
+    # pip install langgraph-checkpoint-postgres psycopg[binary,pool]
+    from langgraph.checkpoint.postgres import PostgresSaver
+    from psycopg_pool import ConnectionPool
+    pool = ConnectionPool(
+        GRAPH_CHECKPOINT_POSTGRES_URL,
+        max_size=GRAPH_CHECKPOINT_POOL_SIZE,
+        kwargs={"autocommit": True, "prepare_threshold": 0},
+        open=False,
+    )
+    return PostgresSaver(pool), pool
+
+
+class GraphCheckpoints:
+    """
+    Owns the LangGraph checkpointer. The saver is created lazily (first job or
+    setup() at startup); when the configured backend is not installed or not
+    reachable, checkpointing is disabled and jobs run without it, as before.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._saver = None
+        self._pool = None
+        self._ready = kind == "none"
+        self._lock = threading.Lock()
+        self._purger: Optional[asyncio.Task] = None
+        self.resumed = 0
+        self.reused_final_state = 0
+        self.deleted_threads = 0
+        self.purged_threads = 0
+
+    def _create(self) -> None:
+        try:
+            if self.kind == "postgres":
+                self._saver, self._pool = _postgres_saver()
+                self._pool.open(wait=True)
+                self._saver.setup()
+            elif self.kind == "sqlite":
+                self._saver = _sqlite_saver()
+            elif self.kind == "memory":
+                self._saver = _memory_saver()
+            else:
+                print(f"WARNING: Unknown GRAPH_CHECKPOINTER={self.kind!r}, checkpointing disabled", flush=True)
+        except ImportError as e:
+            print(f"WARNING: {self.kind} checkpointer unavailable ({e}), using in-memory checkpoints", flush=True)
+            self._saver = _memory_saver()
+        except Exception as e:
+            print(f"WARNING: Failed to set up {self.kind} checkpointer, checkpointing disabled: {e}", flush=True)
+            self._saver = None
+
+    def setup(self) -> None:
+        """Creates the saver (and its tables). Safe to call more than once."""
+        if self._ready:
+            return
+        with self._lock:
+            if not self._ready:
+                self._create()
+                self._ready = True
+
+    @property
+    def saver(self):
+        self.setup()
+        return self._saver
+
+    def delete(self, job_id: str) -> None:
+        """Drops a finished job's checkpoints; failed jobs keep theirs for resume."""
+        saver = self._saver
+        delete_thread = getattr(saver, "delete_thread", None)
+        if delete_thread is None:
+            return
+        try:
+            delete_thread(job_id)
+            self.deleted_threads += 1
+        except Exception as e:
+            print(f"WARNING: Failed to delete checkpoints of job {job_id}: {e}", flush=True)
+
+    def purge_expired(self) -> int:
+        """
+        Deletes threads whose newest checkpoint is older than
+        GRAPH_CHECKPOINT_TTL_HOURS, i.e. failed jobs nobody resumed.
+        """
+        saver = self._saver
+        if saver is None or GRAPH_CHECKPOINT_TTL_HOURS <= 0 or not hasattr(saver, "delete_thread"):
+            return 0
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=GRAPH_CHECKPOINT_TTL_HOURS)
+
+        purged = 0
+        for thread_id, checkpoint_id in self._latest_checkpoint_ids().items():
+            ts = _uuid6_time(checkpoint_id)
+            if ts is not None and ts < cutoff:
+                try:
+                    saver.delete_thread(thread_id)
+                    purged += 1
+                except Exception as e:
+                    print(f"WARNING: Failed to purge checkpoints of job {thread_id}: {e}", flush=True)
+        self.purged_threads += purged
+        return purged
+
+    def _latest_checkpoint_ids(self) -> Dict[str, str]:
+        """
+        thread_id -> newest checkpoint_id, without loading checkpoint payloads.
+        Checkpoint ids are UUIDv6, which sort by (and encode) creation time.
+        """
+        saver = self._saver
+        sql = "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+        if self._pool is not None:
+            with self._pool.connection() as conn:
+                rows = conn.execute(sql).fetchall()
+        elif hasattr(saver, "conn") and hasattr(saver, "lock"):
+            # SqliteSaver: share its connection and lock
+            with saver.lock:
+                rows = saver.conn.execute(sql).fetchall()
+        else:
+            # MemorySaver: thread_id -> namespace -> checkpoint_id -> ...
+            storage = getattr(saver, "storage", {})
+            rows = [
+                (thread_id, max(cid for ns in namespaces.values() for cid in ns))
+                for thread_id, namespaces in list(storage.items())
+                if any(namespaces.values())
+            ]
+        return {str(thread_id): str(checkpoint_id) for thread_id, checkpoint_id in rows if checkpoint_id}
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(GRAPH_CHECKPOINT_PURGE_INTERVAL_SECONDS)
+            try:
+                purged = await asyncio.to_thread(self.purge_expired)
+                if purged:
+                    print(f"Purged checkpoints of {purged} expired job(s)", flush=True)
+            except Exception as e:
+                print(f"WARNING: Checkpoint purge failed: {e}", flush=True)
+
+    def start(self) -> None:
+        if self._purger is None and GRAPH_CHECKPOINT_TTL_HOURS > 0:
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    def close(self) -> None:
+        if self._purger is not None:
+            self._purger.cancel()
+            self._purger = None
+        if self._pool is not None:
+            self._pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self._saver).__name__ if self._saver is not None else None,
+            "configured": self.kind,
+            "resumed": self.resumed,
+            "reused_final_state": self.reused_final_state,
+            "deleted_threads": self.deleted_threads,
+            "purged_threads": self.purged_threads,
+            "ttl_hours": GRAPH_CHECKPOINT_TTL_HOURS,
+        }
+
+
+_UUID_EPOCH = datetime.datetime(1582, 10, 15, tzinfo=datetime.timezone.utc)
+
+
+def _uuid6_time(checkpoint_id: str) -> Optional[datetime.datetime]:
+    """Creation time encoded in a UUIDv6 checkpoint id (None for other ids)."""
+    try:
+        u = uuid.UUID(checkpoint_id)
+    except ValueError:
+        return None
+    if u.version != 6:
+        return None
+    high = u.int >> 64
+    ticks = ((high >> 32) << 28) | (((high >> 16) & 0xFFFF) << 12) | (high & 0x0FFF)
+    return _UUID_EPOCH + datetime.timedelta(microseconds=ticks // 10)
+
+
+CHECKPOINTS = GraphCheckpoints(GRAPH_CHECKPOINTER)
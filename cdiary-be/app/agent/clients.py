@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+
+AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+
+# Connection pool sizes per service. Bedrock calls are long (seconds) so the pool
+# mostly bounds concurrent generations; S3 calls are short but numerous
+# (presign, put, get per panel).
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "32"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "64"))
+DEFAULT_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "10"))
+
+BEDROCK_READ_TIMEOUT = int(os.getenv("BEDROCK_READ_TIMEOUT", "120"))
+# Throttles are retried by app/agent/rate_limit.py (which also adapts the
+# concurrency); SDK-level retries on top would multiply attempts, so keep them off
+BEDROCK_SDK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_SDK_MAX_ATTEMPTS", "1"))
+S3_READ_TIMEOUT = int(os.getenv("S3_READ_TIMEOUT", "30"))
+
+# Services warmed at startup (comma separated)
+WARM_CLIENTS = [s.strip() for s in os.getenv("WARM_CLIENTS", "bedrock-runtime,s3").split(",") if s.strip()]
+
+
+def _config_for(service: str) -> Config:
+    if service == "bedrock-runtime":
+        return Config(
+            max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+            connect_timeout=10,
+            read_timeout=BEDROCK_READ_TIMEOUT,
+            tcp_keepalive=True,
+            retries={"max_attempts": BEDROCK_SDK_MAX_ATTEMPTS, "mode": "standard"},
+        )
+    if service == "s3":
+        return Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=5,
+            read_timeout=S3_READ_TIMEOUT,
+            tcp_keepalive=True,
+            retries={"max_attempts": 3, "mode": "standard"},
+        )
+    return Config(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, tcp_keepalive=True)
+
+
+class _PoolStats:
+    """
+    In-flight request accounting for one (service, region) client.
+    botocore doesn't expose urllib3 pool usage, so we count calls between
+    `before-call` and `after-call`/`after-call-error` instead.
+    """
+
+    def __init__(self, max_pool: int):
+        self.max_pool = max_pool
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.saturated_calls = 0  # calls started while every pool slot was busy
+        self._lock = threading.Lock()
+
+    def on_before_call(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            if self.in_flight >= self.max_pool:
+                self.saturated_calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def on_after_call(self, **kwargs):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def on_after_call_error(self, **kwargs):
+        with self._lock:
+            self.errors += 1
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_pool_connections": self.max_pool,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "utilization": round(self.in_flight / self.max_pool, 3) if self.max_pool else 0.0,
+                "calls": self.calls,
+                "errors": self.errors,
+                "saturated_calls": self.saturated_calls,
+            }
+
+
+_clients: Dict[Tuple[str, str], Any] = {}
+_stats: Dict[Tuple[str, str], _PoolStats] = {}
+_lock = threading.Lock()
+
+
+def get_client(service: str, region_name: Optional[str] = None):
+    """
+    Returns the shared, long-lived boto3 client for (service, region).
+    boto3 clients are thread-safe once created, so every call site can reuse one
+    instance and its pooled (keep-alive) connections.
+    """
+    region = region_name or AWS_REGION
+    key = (service, region)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            config = _config_for(service)
+            # Sessions are not thread-safe; create a dedicated one under the lock
+            client = boto3.session.Session().client(service, region_name=region, config=config)
+
+            stats = _PoolStats(config.max_pool_connections)
+            events = client.meta.events
+            events.register("before-call.*.*", stats.on_before_call)
+            events.register("after-call.*.*", stats.on_after_call)
+            events.register("after-call-error.*.*", stats.on_after_call_error)
+
+            _stats[key] = stats
+            _clients[key] = client
+    return client
+
+
+def warm_clients() -> None:
+    """
+    Builds the default clients (credential resolution, endpoint setup) at startup so
+    the first generation request doesn't pay for it.
+    """
+    for service in WARM_CLIENTS:
+        try:
+            get_client(service)
+            print(f"Warmed {service} client ({AWS_REGION})", flush=True)
+        except Exception as e:
+            print(f"WARNING: Failed to warm {service} client: {e}", flush=True)
+
+
+def client_stats() -> Dict[str, Any]:
+    return {f"{service}@{region}": stats.snapshot() for (service, region), stats in _stats.items()}
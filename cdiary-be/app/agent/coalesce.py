@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.utils.cache import TTLCache
+from .job_backend import JOB_BACKEND, DuplicateJob
+from .store import JOB_REGISTRY, TERMINAL_STATUSES
+
+
+# How long an Idempotency-Key keeps returning the same job
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used for a different request."""
+
+
+def dedupe_key(diary_date: datetime.date, payload: Dict[str, Any]) -> str:
+    """
+    Identifies "the same submission" for one user: the diary date plus a hash
+    of everything that shapes the result (text, mood, style, options).
+    """
+    fields = {k: payload.get(k) for k in ("diaryText", "mood", "stylePreset", "protagonistName", "options")}
+    if payload.get("useCache") is False:
+        # A fresh sample is a different submission than a plain retry of the same diary
+        fields["useCache"] = False
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return f"{diary_date.isoformat()}:{digest[:32]}"
+
+
+class SubmissionCoalescer:
+    """
+    Single-flight for POST /api/diary/generate.
+
+    A submission is answered with an existing job when
+    - its Idempotency-Key was seen before (any status, for IDEMPOTENCY_TTL_SECONDS), or
+    - a job with the same dedupe key (user, date, content hash) is still unfinished.
+
+    Lookups go through this process first (including submissions that are still
+    being set up), then through the durable job backend so other replicas'
+    jobs are found too. A race between replicas is settled by the backend's
+    unique indexes (DuplicateJob).
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._recent = TTLCache(max_entries=IDEMPOTENCY_CACHE_SIZE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS)
+        self.started = 0
+        self.coalesced = 0
+        self.idempotent_replays = 0
+
+    @staticmethod
+    def _keys(user_id: str, idempotency_key: Optional[str], dedupe: str) -> Tuple[Optional[str], str]:
+        idem = f"idem:{user_id}:{idempotency_key}" if idempotency_key else None
+        return idem, f"dedupe:{user_id}:{dedupe}"
+
+    def _lookup_local(self, idem: Optional[str], dedupe_full: str, dedupe: str) -> Optional[Dict[str, Any]]:
+        if idem is not None:
+            hit = self._recent.get(idem)
+            if hit is not None:
+                if hit["dedupeKey"] != dedupe:
+                    raise IdempotencyConflict()
+                self.idempotent_replays += 1
+                return hit
+        hit = self._recent.get(dedupe_full)
+        if hit is not None:
+            record = JOB_REGISTRY.get(hit["jobId"])
+            if record is not None and record.status not in TERMINAL_STATUSES:
+                self.coalesced += 1
+                return hit
+        return None
+
+    async def _lookup_backend(self, user_id: str, idempotency_key: Optional[str], dedupe: str) -> Optional[Dict[str, Any]]:
+        if not JOB_BACKEND.durable:
+            return None
+        found = await JOB_BACKEND.find(user_id, idempotency_key, dedupe)
+        if found is None:
+            return None
+        if idempotency_key and found["idempotencyKey"] == idempotency_key:
+            if found["dedupeKey"] != dedupe:
+                raise IdempotencyConflict()
+            self.idempotent_replays += 1
+        else:
+            self.coalesced += 1
+        return {"jobId": found["jobId"], "artifactId": found["artifactId"], "dedupeKey": found["dedupeKey"]}
+
+    async def submit(
+        self,
+        user_id: str,
+        idempotency_key: Optional[str],
+        dedupe: str,
+        start: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns (response, coalesced). `start` creates and enqueues the job and
+        returns a response containing jobId and artifactId.
+        """
+        idem, dedupe_full = self._keys(user_id, idempotency_key, dedupe)
+        keys: List[str] = [k for k in (idem, dedupe_full) if k]
+
+        # Same submission currently being set up by another request in this process
+        for key in keys:
+            pending = self._pending.get(key)
+            if pending is not None:
+                result = await asyncio.shield(pending)
+                if key == idem and result.get("dedupeKey") != dedupe:
+                    raise IdempotencyConflict()
+                self.coalesced += 1
+                return result, True
+
+        existing = self._lookup_local(idem, dedupe_full, dedupe) or await self._lookup_backend(user_id, idempotency_key, dedupe)
+        if existing is not None:
+            return existing, True
+
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._pending[key] = future
+        try:
+            try:
+                result = await start()
+            except DuplicateJob as dup:
+                # Another replica won the race for the same submission
+                self.coalesced += 1
+                result, coalesced = {"jobId": dup.job_id, "artifactId": dup.artifact_id}, True
+            else:
+                self.started += 1
+                coalesced = False
+            result = {**result, "dedupeKey": dedupe}
+            for key in keys:
+                self._recent.set(key, result)
+            future.set_result(result)
+            return result, coalesced
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            for key in keys:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "idempotent_replays": self.idempotent_replays,
+            "in_progress": len(set(map(id, self._pending.values()))),
+            "remembered_keys": len(self._recent),
+        }
+
+
+SUBMISSIONS = SubmissionCoalescer()
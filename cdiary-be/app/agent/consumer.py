@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import os
+import time
+import traceback
+from typing import Any, Dict, Optional, Set
+
+from app.routers.jobs import create_job
+from .admission import GENERATION_AVG_JOB_SECONDS
+from .bootstrap import init_process
+from .checkpoint import CHECKPOINTS
+from .job_backend import JOB_BACKEND, JOB_VISIBILITY_TIMEOUT_SECONDS, ClaimedJob, make_worker_id
+from .models import DiaryEntryRequest
+from .store import JOB_REGISTRY
+from .worker import execute_job
+
+
+# Jobs one consumer runs at the same time
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# Run a consumer inside the API process. Set to 0 on API replicas when
+# dedicated consumers (python -m app.agent.consumer) are deployed.
+JOB_CONSUMER_EMBEDDED = os.getenv("JOB_CONSUMER_EMBEDDED", "1") == "1"
+
+# Smoothing for the moving averages of queue wait / run time
+_EWMA_ALPHA = 0.2
+
+
+class _Timing:
+    def __init__(self, initial: float = 0.0):
+        self.count = 0
+        self.ewma = initial
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        if self.count == 1 and not self.ewma:
+            self.ewma = seconds
+        else:
+            self.ewma = _EWMA_ALPHA * seconds + (1 - _EWMA_ALPHA) * self.ewma
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "avg_seconds": round(self.ewma, 3), "max_seconds": round(self.max, 3)}
+
+
+class JobConsumer:
+    """
+    Claims jobs from JOB_BACKEND and runs execute_job for each, holding the
+    lease with periodic heartbeats until the job finishes.
+    """
+
+    def __init__(self, backend=JOB_BACKEND, concurrency: int = JOB_WORKER_CONCURRENCY):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.worker_id = make_worker_id()
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.crashed = 0
+        self.wait_time = _Timing()
+        self.run_time = _Timing(GENERATION_AVG_JOB_SECONDS)
+
+    @property
+    def avg_job_seconds(self) -> float:
+        return self.run_time.ewma
+
+    async def run(self) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        print(f"Job consumer {self.worker_id} started (concurrency={self.concurrency})", flush=True)
+        while True:
+            await slots.acquire()
+            try:
+                job = await self.backend.claim(self.worker_id)
+            except Exception as e:
+                slots.release()
+                print(f"WARNING: Job claim failed: {e}", flush=True)
+                await asyncio.sleep(5)
+                continue
+            if job is None:
+                slots.release()
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: (self._tasks.discard(t), slots.release()))
+
+    async def _run_job(self, job: ClaimedJob) -> None:
+        if job.job_id not in JOB_REGISTRY:
+            # Claimed on another replica than the one that accepted the request
+            create_job(job.job_id, user_id=job.user_id, artifact_id=job.artifact_id)
+        if job.enqueued_at is not None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            self.wait_time.add(max(0.0, (now - job.enqueued_at).total_seconds()))
+        self._running.add(job.job_id)
+        heartbeat = asyncio.create_task(self._heartbeat(job.job_id))
+        started = time.monotonic()
+        try:
+            request = DiaryEntryRequest(**job.payload)
+            await execute_job(job.job_id, job.user_id, request, job.artifact_id)
+            self.completed += 1
+            self.run_time.add(time.monotonic() - started)
+        except Exception:
+            # execute_job reports its own failures; this only catches bad payloads
+            traceback.print_exc()
+            self.crashed += 1
+        finally:
+            heartbeat.cancel()
+            self._running.discard(job.job_id)
+            try:
+                await self.backend.release(job.job_id, self.worker_id)
+            except Exception as e:
+                # The lease expires on its own and the job is retried
+                print(f"WARNING: Failed to release job {job.job_id}: {e}", flush=True)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        interval = max(JOB_VISIBILITY_TIMEOUT_SECONDS / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.backend.heartbeat(job_id, self.worker_id):
+                    print(f"WARNING: Lost lease on job {job_id}", flush=True)
+                    return
+            except Exception as e:
+                print(f"WARNING: Heartbeat failed for job {job_id}: {e}", flush=True)
+
+    def start(self) -> None:
+        self.backend.start()
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        # Cancelled jobs release their lease (non-terminal), so another consumer resumes them
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backend.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "running": len(self._running),
+            "completed": self.completed,
+            "crashed": self.crashed,
+            "queue_wait": self.wait_time.as_dict(),
+            "run_time": self.run_time.as_dict(),
+            **self.backend.stats(),
+        }
+
+
+JOB_CONSUMER = JobConsumer()
+
+
+async def _main() -> None:
+    if not JOB_BACKEND.durable:
+        raise SystemExit("A standalone consumer needs a shared backend: set JOB_BACKEND=postgres")
+    # Same schema / pgvector detection / clients / checkpointer as the API process
+    await init_process()
+    JOB_CONSUMER.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await JOB_CONSUMER.stop()
+        CHECKPOINTS.close()
+
+
+if __name__ == "__main__":
+    # Dedicated worker process: python -m app.agent.consumer
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
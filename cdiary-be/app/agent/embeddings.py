@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import hashlib
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+from app.database import AsyncSessionLocal
+from app.models.models import Diary, DiaryChunk, DiaryChunkEmbedding
+from .bedrock import get_embedding
+from .vector_index import VECTOR_INDEX
+from .vector_search import sync_vectors
+from .search_cache import SEARCH_RESULTS
+
+
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_COMMIT_BATCH = int(os.getenv("EMBEDDING_COMMIT_BATCH", "32"))
+
+# Users with a processor currently running, and users that got new pending
+# chunks meanwhile (so the running processor makes one more pass).
+_active_users: set = set()
+_rerun_users: set = set()
+_active_backfills: set = set()
+# Strong references to fire-and-forget tasks; the loop only keeps weak ones
+_background_tasks: set = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """Schedule an embedding job without awaiting it, keeping the task alive until done."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def process_pending_embeddings(user_id: str):
+    """
+    Background task to process pending diary chunk embeddings.
+
+    Chunks with identical content are embedded once (execute_job writes the
+    same diary text into every panel chunk). Titan calls run in threads under
+    EMBEDDING_CONCURRENCY, and results are written in short sessions of
+    EMBEDDING_COMMIT_BATCH chunks, so no session stays open while waiting on
+    Bedrock.
+    """
+    uid = uuid.UUID(user_id) if isinstance(user_id, str) else user_id
+    key = str(uid)
+    if key in _active_users:
+        _rerun_users.add(key)
+        return
+
+    _active_users.add(key)
+    try:
+        while True:
+            _rerun_users.discard(key)
+            await _process_once(uid)
+            if key not in _rerun_users:
+                break
+    finally:
+        _active_users.discard(key)
+
+
+async def _process_once(uid: uuid.UUID) -> None:
+    async with AsyncSessionLocal() as db:
+        stmt = select(DiaryChunk.id, DiaryChunk.content).where(
+            (DiaryChunk.user_id == uid) &
+            (DiaryChunk.embedding_status == 'pending')
+        )
+        rows = (await db.execute(stmt)).all()
+
+    if not rows:
+        return
+
+    # content hash -> chunk ids sharing that text
+    groups: Dict[str, List[uuid.UUID]] = {}
+    texts: Dict[str, str] = {}
+    for chunk_id, content in rows:
+        h = content_hash(content)
+        groups.setdefault(h, []).append(chunk_id)
+        texts[h] = content
+
+    print(f"DEBUG: Embedding {len(rows)} pending chunks ({len(groups)} unique texts) for user {uid}", flush=True)
+
+    sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    async def embed(h: str) -> Tuple[str, Optional[List[float]]]:
+        async with sem:
+            try:
+                return h, await asyncio.to_thread(get_embedding, texts[h])
+            except Exception as e:
+                print(f"DEBUG: Error processing embedding for {len(groups[h])} chunk(s): {e}", flush=True)
+                return h, None
+
+    batch: List[Tuple[List[uuid.UUID], Optional[List[float]]]] = []
+    for fut in asyncio.as_completed([embed(h) for h in groups]):
+        h, vector = await fut
+        batch.append((groups[h], vector))
+        if sum(len(ids) for ids, _ in batch) >= EMBEDDING_COMMIT_BATCH:
+            await _write_batch(uid, batch)
+            batch = []
+
+    if batch:
+        await _write_batch(uid, batch)
+
+
+async def _write_batch(uid: uuid.UUID, batch: List[Tuple[List[uuid.UUID], Optional[List[float]]]]) -> None:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    completed: List[uuid.UUID] = []
+    failed: List[uuid.UUID] = []
+
+    async with AsyncSessionLocal() as db:
+        # Chunks may have been deleted meanwhile (diary regenerated or removed)
+        all_ids = [chunk_id for chunk_ids, _ in batch for chunk_id in chunk_ids]
+        existing = dict((await db.execute(
+            select(DiaryChunk.id, DiaryChunk.diary_id).where(DiaryChunk.id.in_(all_ids))
+        )).all())
+
+        index_rows = []
+        for chunk_ids, vector in batch:
+            chunk_ids = [c for c in chunk_ids if c in existing]
+            if not vector:
+                failed.extend(chunk_ids)
+                continue
+            for chunk_id in chunk_ids:
+                db.add(DiaryChunkEmbedding(chunk_id=chunk_id, user_id=uid, embedding_vector=vector))
+                index_rows.append((str(chunk_id), str(existing[chunk_id]), vector))
+            completed.extend(chunk_ids)
+
+        if completed:
+            await db.flush()
+            await sync_vectors(db, completed)
+            await db.execute(
+                update(DiaryChunk)
+                .where(DiaryChunk.id.in_(completed))
+                .values(embedding_status='completed', last_embedded_at=now)
+            )
+        if failed:
+            await db.execute(
+                update(DiaryChunk)
+                .where(DiaryChunk.id.in_(failed))
+                .values(embedding_status='failed')
+            )
+        await db.commit()
+
+    if index_rows:
+        VECTOR_INDEX.add_embeddings(str(uid), index_rows)
+        SEARCH_RESULTS.invalidate_user(str(uid))
+
+
+async def backfill_diary_embeddings(user_id: str):
+    """
+    Background task filling Diary.content_embedding (used by GET /api/artifacts?query=)
+    for a user's diaries that don't have one yet. Same dedupe/concurrency/batching
+    rules as process_pending_embeddings; the request path never embeds diary content.
+    """
+    uid = uuid.UUID(user_id) if isinstance(user_id, str) else user_id
+    key = str(uid)
+    if key in _active_backfills:
+        return
+
+    _active_backfills.add(key)
+    try:
+        async with AsyncSessionLocal() as db:
+            stmt = select(Diary.id, Diary.content).where(
+                (Diary.user_id == uid) & (Diary.content_embedding.is_(None))
+            )
+            rows = (await db.execute(stmt)).all()
+
+        groups: Dict[str, List[uuid.UUID]] = {}
+        texts: Dict[str, str] = {}
+        for diary_id, content in rows:
+            if not content:
+                continue
+            h = content_hash(content)
+            groups.setdefault(h, []).append(diary_id)
+            texts[h] = content
+
+        if not groups:
+            return
+        print(f"DEBUG: Backfilling content embeddings for {len(rows)} diaries of user {uid}", flush=True)
+
+        sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+        async def embed(h: str) -> Tuple[str, Optional[List[float]]]:
+            async with sem:
+                try:
+                    return h, await asyncio.to_thread(get_embedding, texts[h])
+                except Exception as e:
+                    print(f"DEBUG: Failed to embed {len(groups[h])} diary(s): {e}", flush=True)
+                    return h, None
+
+        batch: List[Tuple[List[uuid.UUID], List[float], str]] = []
+        for fut in asyncio.as_completed([embed(h) for h in groups]):
+            h, vector = await fut
+            if vector:
+                batch.append((groups[h], vector, h))
+            if len(batch) >= EMBEDDING_COMMIT_BATCH:
+                await _write_diary_batch(uid, batch, texts)
+                batch = []
+        if batch:
+            await _write_diary_batch(uid, batch, texts)
+    finally:
+        _active_backfills.discard(key)
+
+
+async def _write_diary_batch(uid: uuid.UUID, batch, texts: Dict[str, str]) -> None:
+    async with AsyncSessionLocal() as db:
+        for diary_ids, vector, h in batch:
+            # Only if the content is still what we embedded (it may have been edited meanwhile)
+            await db.execute(
+                update(Diary)
+                .where(Diary.id.in_(diary_ids) & (Diary.content == texts[h]) & Diary.content_embedding.is_(None))
+                .values(content_embedding=vector)
+            )
+        await db.commit()
+    SEARCH_RESULTS.invalidate_user(str(uid))
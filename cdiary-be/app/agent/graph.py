@@ -1,19 +1,69 @@
 from __future__ import annotations
+import asyncio
 import json
 import uuid
-from typing import List, Dict
-import boto3
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import List, Dict, Optional, Tuple
 from langgraph.graph import StateGraph, END
 from .models import (
     OrchestrationState, Storyboard, StoryboardCut,
     ImagePrompt, CutImage, QAResult
 )
-from .bedrock import invoke_text_model, invoke_image_model_to_s3, save_cut_image, invoke_visual_qa, S3_BUCKET
+from .bedrock import invoke_text_model, stream_text_model, invoke_image_model_to_s3, save_cut_image, invoke_visual_qa, S3_BUCKET, TEXT_MAX_TOKENS, RENDER_CACHE, _s3
 from app.routers.jobs import update_job
 import io
 from PIL import Image
 import random
 from . import prompts
+from .blob_store import PANEL_BLOBS
+from .checkpoint import CHECKPOINTS, thread_config
+from app.utils.json_stream import StreamingArrayParser
+
+# "parallel": render all cuts concurrently (default, no reference chaining)
+# "sequential": render one by one, chaining the previous panel as reference image
+IMAGE_GEN_MODE = os.getenv("IMAGE_GEN_MODE", "parallel").lower()
+IMAGE_GEN_CONCURRENCY = int(os.getenv("IMAGE_GEN_CONCURRENCY", "4"))
+
+# "concurrent": one text call per cut, fanned out (default)
+# "batch": a single text call returning all prompts as a JSON array
+# "sequential": one text call per cut, in order
+PROMPT_BUILD_MODE = os.getenv("PROMPT_BUILD_MODE", "concurrent").lower()
+PROMPT_BUILD_CONCURRENCY = int(os.getenv("PROMPT_BUILD_CONCURRENCY", "4"))
+
+# "two_step": plan_storyboard, then build_prompts (default)
+# "single": one text call returning the storyboard and the image prompts together
+PLANNER_MODE = os.getenv("PLANNER_MODE", "two_step").lower()
+
+# Stream the planner's completion and start prompt building / rendering of each
+# cut as soon as its JSON object is complete (parallel rendering only)
+PLANNER_STREAMING = os.getenv("PLANNER_STREAMING", "false").lower() == "true"
+
+# maxTokens per text call, as (base, per cut). Sized from typical outputs: a
+# storyboard cut is ~120 tokens of JSON, an image prompt ~100-150 tokens.
+TEXT_TOKEN_BUDGETS = {
+    "plan_storyboard": (150, 200),
+    "plan_with_prompts": (200, 400),
+    "build_prompt": (300, 0),
+    "build_prompts_batch": (100, 250),
+    "revise_prompt": (300, 0),
+}
+
+# Nova Canvas seed when the user profile has none
+DEFAULT_SEED = 42
+
+# Profile reference image of each running job, by job_id. Not part of
+# OrchestrationState so it isn't checkpointed; execute_job loads it on every run.
+_PROFILE_IMAGES: Dict[str, bytes] = {}
+
+# Threads running job graphs (one per running job, see JOB_WORKER_CONCURRENCY)
+GRAPH_WORKERS = int(os.getenv("GRAPH_WORKERS", os.getenv("JOB_WORKER_CONCURRENCY", "4")))
+GRAPH_EXECUTOR = ThreadPoolExecutor(max_workers=GRAPH_WORKERS, thread_name_prefix="graph")
+
+def _profile_image(state: OrchestrationState) -> Optional[bytes]:
+    return _PROFILE_IMAGES.get(state.job_id)
+
 
 def _set_progress(state: OrchestrationState, progress: int, status: str | None = None, error: str | None = None):
     payload = {"progress": progress}
@@ -24,6 +74,21 @@ def _set_progress(state: OrchestrationState, progress: int, status: str | None =
     update_job(state.job_id, **payload)
 
 
+def text_token_budget(node: str, num_cuts: int = 1) -> int:
+    base, per_cut = TEXT_TOKEN_BUDGETS[node]
+    return min(TEXT_MAX_TOKENS, base + per_cut * num_cuts)
+
+
+def _parse_storyboard(state: OrchestrationState, data: dict) -> Storyboard:
+    sb = Storyboard(**data)
+
+    # Safety: Truncate cuts to the requested num_cuts if LLM returned more
+    if len(sb.cuts) > state.num_cuts:
+        print(f"WARNING: LLM returned {len(sb.cuts)} cuts, truncating to requested {state.num_cuts}")
+        sb.cuts = sb.cuts[:state.num_cuts]
+    return sb
+
+
 def plan_storyboard(state: OrchestrationState) -> OrchestrationState:
     _set_progress(state, 10, status="RUNNING")
 
@@ -32,19 +97,13 @@ def plan_storyboard(state: OrchestrationState) -> OrchestrationState:
         profile_prompt=state.profile_prompt or "A person",
         diary=state.diary
     )
-    raw = invoke_text_model(prompt, temperature=0.2)
+    raw = invoke_text_model(prompt, temperature=0.2, max_tokens=text_token_budget("plan_storyboard", state.num_cuts), use_cache=state.use_cache)
 
     # 안전하게 JSON 파싱 시도 (모델이 종종 앞/뒤 말 붙임)
     json_str = _extract_json(raw)
     data = json.loads(json_str)
 
-    sb = Storyboard(**data)
-    
-    # Safety: Truncate cuts to the requested num_cuts if LLM returned more
-    if len(sb.cuts) > state.num_cuts:
-        print(f"WARNING: LLM returned {len(sb.cuts)} cuts, truncating to requested {state.num_cuts}")
-        sb.cuts = sb.cuts[:state.num_cuts]
-
+    sb = _parse_storyboard(state, data)
     state.storyboard = sb
 
     update_job(state.job_id, storyboard=sb)
@@ -52,23 +111,74 @@ def plan_storyboard(state: OrchestrationState) -> OrchestrationState:
     return state
 
 
+def _build_prompt_for_cut(state: OrchestrationState, cut: StoryboardCut) -> ImagePrompt:
+    prompt = prompts.BUILD_IMAGE_PROMPT_TEMPLATE.format(
+        style_guide=state.style_guide,
+        character_appearance=state.storyboard.character_appearance or "A generic person",
+        summary=cut.summary,
+        emotion=cut.emotion,
+        scene=cut.scene,
+        dialogue=cut.dialogue,
+        camera=cut.camera
+    )
+    p = invoke_text_model(prompt, temperature=0.3, max_tokens=text_token_budget("build_prompt"), use_cache=state.use_cache).strip()
+    return ImagePrompt(cut_index=cut.cut_index, prompt=p)
+
+
+def _build_prompts_concurrent(state: OrchestrationState, cuts: List[StoryboardCut]) -> List[ImagePrompt]:
+    if not cuts:
+        return []
+    workers = max(1, min(PROMPT_BUILD_CONCURRENCY, len(cuts)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"prompt-{state.job_id[:8]}") as pool:
+        # map() keeps the storyboard order
+        return list(pool.map(lambda c: _build_prompt_for_cut(state, c), cuts))
+
+
+def _build_prompts_batch(state: OrchestrationState, cuts: List[StoryboardCut]) -> Dict[int, ImagePrompt]:
+    """
+    One text call for all cuts. Returns whatever could be parsed, keyed by cut_index;
+    the caller builds the missing ones per cut.
+    """
+    cuts_json = json.dumps([c.model_dump() for c in cuts], ensure_ascii=False)
+    prompt = prompts.BUILD_IMAGE_PROMPTS_BATCH_TEMPLATE.format(
+        style_guide=state.style_guide,
+        character_appearance=state.storyboard.character_appearance or "A generic person",
+        cuts_json=cuts_json
+    )
+    wanted = {c.cut_index for c in cuts}
+    try:
+        raw = invoke_text_model(prompt, temperature=0.3, max_tokens=text_token_budget("build_prompts_batch", len(cuts)), use_cache=state.use_cache)
+        items = json.loads(_extract_json_array(raw))
+        parsed = [ImagePrompt(**item) for item in items]
+    except Exception as e:
+        print(f"[{state.job_id}] Batched prompt build failed, falling back to per-cut calls: {e}", flush=True)
+        return {}
+
+    result = {}
+    for ip in parsed:
+        ip.prompt = ip.prompt.strip()
+        if ip.cut_index in wanted and ip.prompt:
+            result[ip.cut_index] = ip
+    return result
+
+
 def build_prompts(state: OrchestrationState) -> OrchestrationState:
     assert state.storyboard is not None
     _set_progress(state, 35)
 
-    image_prompts: List[ImagePrompt] = []
-    for cut in state.storyboard.cuts:
-        prompt = prompts.BUILD_IMAGE_PROMPT_TEMPLATE.format(
-            style_guide=state.style_guide,
-            character_appearance=state.storyboard.character_appearance or "A generic person",
-            summary=cut.summary,
-            emotion=cut.emotion,
-            scene=cut.scene,
-            dialogue=cut.dialogue,
-            camera=cut.camera
-        )
-        p = invoke_text_model(prompt, temperature=0.3).strip()
-        image_prompts.append(ImagePrompt(cut_index=cut.cut_index, prompt=p))
+    cuts = state.storyboard.cuts
+    if PROMPT_BUILD_MODE == "batch":
+        by_index = _build_prompts_batch(state, cuts)
+        missing = [c for c in cuts if c.cut_index not in by_index]
+        if missing and by_index:
+            print(f"[{state.job_id}] Batch response missed cuts {[c.cut_index for c in missing]}, building them per cut", flush=True)
+        for ip in _build_prompts_concurrent(state, missing):
+            by_index[ip.cut_index] = ip
+        image_prompts = [by_index[c.cut_index] for c in cuts]
+    elif PROMPT_BUILD_MODE == "sequential":
+        image_prompts = [_build_prompt_for_cut(state, c) for c in cuts]
+    else:
+        image_prompts = _build_prompts_concurrent(state, cuts)
 
     state.prompts = image_prompts
     update_job(state.job_id, prompts=image_prompts)
@@ -76,78 +186,306 @@ def build_prompts(state: OrchestrationState) -> OrchestrationState:
     return state
 
 
-def generate_images(state: OrchestrationState) -> OrchestrationState:
-    _set_progress(state, 60)
+def build_cut_prompt(prompt: str, character_appearance: Optional[str], style_guide: str) -> str:
+    """Final Nova Canvas text for one cut (also used by single-panel regeneration)."""
+    # Prepend character description for individual generation
+    char_desc = character_appearance or "A generic person"
 
-    # Convert prompts to dict for easy access
-    pmap = {p.cut_index: p.prompt for p in state.prompts}
-    
-    generated_images: List[CutImage] = []
-    
-    print(f"Generating {len(state.prompts)}-panel strip for consistency...")
-    
-    # Sort prompts by index to ensure Cut 1 is generated first
-    sorted_prompts = sorted(state.prompts, key=lambda p: p.cut_index)
-    
-    ref_bytes = None
-    
-    # Generate individually (or for retries)
-    for p in sorted_prompts:
-        # If we already generated this cut, skip
-        if any(img.cut_index == p.cut_index for img in generated_images):
+    # Ensure lengths are reasonable before combining (Nova limit is 1024)
+    # We target ~950 just to be safe with prefixes/style guides
+    safe_p = prompt[:600] if len(prompt) > 600 else prompt
+    safe_char = char_desc[:200] if len(char_desc) > 200 else char_desc
+
+    full_prompt = (
+        f"Scene: {safe_p}\n"
+        f"Main character: {safe_char}\n"
+        f"Style: {style_guide}\n"
+        f"CRITICAL: Refer to the character in the reference image for appearance, but strictly follow the Scene description for camera angle and composition."
+    )
+    # Final safety measure
+    if len(full_prompt) > 1000:
+         full_prompt = full_prompt[:1000]
+    return full_prompt
+
+
+def plan_with_prompts(state: OrchestrationState) -> OrchestrationState:
+    """
+    PLANNER_MODE=single: storyboard and image prompts from one text call
+    (instead of 1 + N). Cuts that come back without a usable prompt are built
+    per cut, as in build_prompts' batch mode. A plan that is cut off at
+    TEXT_MAX_TOKENS (many cuts) or doesn't parse falls back to the two-step
+    plan_storyboard + build_prompts.
+    """
+    _set_progress(state, 10, status="RUNNING")
+
+    prompt = prompts.PLAN_WITH_PROMPTS_TEMPLATE.format(
+        num_cuts=state.num_cuts,
+        profile_prompt=state.profile_prompt or "A person",
+        diary=state.diary,
+        style_guide=state.style_guide
+    )
+    try:
+        raw = invoke_text_model(prompt, temperature=0.2, max_tokens=text_token_budget("plan_with_prompts", state.num_cuts),
+                                use_cache=state.use_cache, retry_truncated=True, allow_truncated=False)
+        data = json.loads(_extract_json(raw))
+        sb = _parse_storyboard(state, data)
+    except (TypeError, ValueError) as e:
+        # JSONDecodeError, TextTruncated and pydantic's ValidationError are ValueErrors;
+        # TypeError: the JSON wasn't an object
+        print(f"[{state.job_id}] Single-call plan unusable ({e}), planning in two steps", flush=True)
+        return build_prompts(plan_storyboard(state))
+
+    state.storyboard = sb
+    update_job(state.job_id, storyboard=sb)
+    _set_progress(state, 35)
+
+    by_index: Dict[int, ImagePrompt] = {}
+    for item in data.get("cuts") or []:
+        if not isinstance(item, dict):
             continue
-            
-        # Prepend character description for individual generation
-        char_desc = state.storyboard.character_appearance or "A generic person"
-        
-        # Ensure lengths are reasonable before combining (Nova limit is 1024)
-        # We target ~950 just to be safe with prefixes/style guides
-        safe_p = p.prompt[:600] if len(p.prompt) > 600 else p.prompt
-        safe_char = char_desc[:200] if len(char_desc) > 200 else char_desc
-
-        full_prompt = (
-            f"Scene: {safe_p}\n"
-            f"Main character: {safe_char}\n"
-            f"Style: {state.style_guide}\n"
-            f"CRITICAL: Refer to the character in the reference image for appearance, but strictly follow the Scene description for camera angle and composition."
-        )
-        # Final safety measure
-        if len(full_prompt) > 1000:
-             full_prompt = full_prompt[:1000]
+        text = item.get("image_prompt")
+        try:
+            # The model sometimes writes "cut_index": "2"; storyboard cuts are ints
+            cut_index = int(item.get("cut_index"))
+        except (TypeError, ValueError):
+            continue
+        if isinstance(text, str) and text.strip():
+            by_index[cut_index] = ImagePrompt(cut_index=cut_index, prompt=text.strip())
+    missing = [c for c in sb.cuts if c.cut_index not in by_index]
+    if missing:
+        print(f"[{state.job_id}] Planner response missed prompts for cuts {[c.cut_index for c in missing]}, building them per cut", flush=True)
+    for ip in _build_prompts_concurrent(state, missing):
+        by_index[ip.cut_index] = ip
+
+    state.prompts = [by_index[c.cut_index] for c in sb.cuts]
+    update_job(state.job_id, prompts=state.prompts)
+    _set_progress(state, 45)
+    return state
+
+
+def _build_cut_prompt(state: OrchestrationState, p: ImagePrompt) -> str:
+    return build_cut_prompt(p.prompt, state.storyboard.character_appearance, state.style_guide)
+
+
+def _render_cut(state: OrchestrationState, p: ImagePrompt, ref_bytes: Optional[bytes], source: str):
+    # Use the profile seed for all panels if available for consistency
+    current_seed = state.seed if state.seed is not None else DEFAULT_SEED
+
+    out = invoke_image_model_to_s3(
+        cut_prompt=_build_cut_prompt(state, p),
+        job_id=state.job_id,
+        cut_index=p.cut_index,
+        ref_image=ref_bytes,
+        seed=current_seed,
+        use_cache=state.use_cache
+    )
+    image = CutImage(
+        cut_index=p.cut_index,
+        image_url=out.url,
+        meta={"source": source, "s3_key": out.s3_key}
+    )
+    # Hand the bytes to the composer in memory (worker falls back to S3 on a miss)
+    if out.img_bytes:
+        PANEL_BLOBS.put(state.job_id, out.s3_key, out.img_bytes)
+    return image, out.img_bytes
+
+
+def _generate_sequential(state: OrchestrationState, pending: List[ImagePrompt], failed: Dict[int, str]) -> List[CutImage]:
+    """
+    Renders cuts one by one so each panel can use the previous one as reference.
+    """
+    generated: List[CutImage] = []
+    ref_bytes = None
+
+    for p in pending:
         # Reference Strategy:
         # 1. First cut uses profile image (if exists)
         # 2. Subsequent cuts use the *previous* panel image for consistency
-        if p.cut_index == 1 and state.profile_image:
-             ref_bytes = state.profile_image
-             
-        # Use ref_image if available
-        # Determine seed: use profile_seed if it's the first cut, otherwise 42 or random? 
-        # Actually user wants to use the seed for consistency. 
-        # Let's use the profile_seed for all panels if available, or just the first?
-        # Usually seed + same character desc + reference image works best.
-        current_seed = state.seed if state.seed is not None else 42
-        
-        out = invoke_image_model_to_s3(
-            cut_prompt=full_prompt, 
-            job_id=state.job_id, 
-            cut_index=p.cut_index,
-            ref_image=ref_bytes,
-            seed=current_seed
-        )
-        
+        if p.cut_index == 1 and _profile_image(state):
+             ref_bytes = _profile_image(state)
+
+        try:
+            image, img_bytes = _render_cut(state, p, ref_bytes, "bedrock_single")
+        except Exception as e:
+            print(f"[{state.job_id}] Cut {p.cut_index} failed: {e}", flush=True)
+            failed[p.cut_index] = str(e)
+            continue
+
         # Update ref_bytes for the NEXT panel to be THIS panel's bytes
-        if out.img_bytes:
-            ref_bytes = out.img_bytes
-        
-        generated_images.append(CutImage(
-            cut_index=p.cut_index, 
-            image_url=out.url, 
-            meta={"source": "bedrock_single", "s3_key": out.s3_key}
-        ))
+        if img_bytes:
+            ref_bytes = img_bytes
+        generated.append(image)
+
+    return generated
+
+
+def _generate_parallel(state: OrchestrationState, pending: List[ImagePrompt], failed: Dict[int, str]) -> List[CutImage]:
+    """
+    Renders cuts concurrently (bounded by IMAGE_GEN_CONCURRENCY).
+    No panel-to-panel reference chaining; only the profile image is shared.
+    """
+    generated: List[CutImage] = []
+    workers = max(1, min(IMAGE_GEN_CONCURRENCY, len(pending)))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"cut-{state.job_id[:8]}") as pool:
+        futures = {
+            pool.submit(_render_cut, state, p, _profile_image(state), "bedrock_parallel"): p.cut_index
+            for p in pending
+        }
+        for fut in as_completed(futures):
+            cut_index = futures[fut]
+            try:
+                image, _ = fut.result()
+                generated.append(image)
+            except Exception as e:
+                print(f"[{state.job_id}] Cut {cut_index} failed: {e}", flush=True)
+                failed[cut_index] = str(e)
+
+    return generated
+
+
+def generate_images(state: OrchestrationState) -> OrchestrationState:
+    _set_progress(state, 60)
+
+    print(f"Generating {len(state.prompts)}-panel strip ({IMAGE_GEN_MODE})...")
+
+    # Sort prompts by index to ensure Cut 1 is generated first
+    sorted_prompts = sorted(state.prompts, key=lambda p: p.cut_index)
+
+    # If we already generated a cut (retries/resume), skip it
+    done_idx = {img.cut_index for img in state.images}
+    pending = [p for p in sorted_prompts if p.cut_index not in done_idx]
+
+    failed: Dict[int, str] = {}
+    if IMAGE_GEN_MODE == "sequential":
+        generated = _generate_sequential(state, pending, failed)
+    else:
+        generated = _generate_parallel(state, pending, failed)
+
+    generated_images = sorted(list(state.images) + generated, key=lambda img: img.cut_index)
+    if not generated_images and failed:
+        raise RuntimeError(f"All cuts failed to render: {failed}")
 
     state.images = generated_images
-    update_job(state.job_id, images=generated_images)
+    update_job(state.job_id, images=generated_images, failed_cuts=failed or None)
+
+    _set_progress(state, 75)
+    return state
+
+
+def _planner_prompt(state: OrchestrationState) -> Tuple[str, str]:
+    """(template text, token budget node) for the configured PLANNER_MODE."""
+    if PLANNER_MODE == "single":
+        return prompts.PLAN_WITH_PROMPTS_TEMPLATE.format(
+            num_cuts=state.num_cuts,
+            profile_prompt=state.profile_prompt or "A person",
+            diary=state.diary,
+            style_guide=state.style_guide
+        ), "plan_with_prompts"
+    return prompts.PLAN_STORYBOARD_PROMPT_TEMPLATE.format(
+        num_cuts=state.num_cuts,
+        profile_prompt=state.profile_prompt or "A person",
+        diary=state.diary
+    ), "plan_storyboard"
+
+
+def _prompt_and_render(state: OrchestrationState, cut: StoryboardCut, image_prompt: Optional[str]):
+    """One cut's pipeline: its image prompt (from the planner or a text call), then the render."""
+    if isinstance(image_prompt, str) and image_prompt.strip():
+        ip = ImagePrompt(cut_index=cut.cut_index, prompt=image_prompt.strip())
+    else:
+        ip = _build_prompt_for_cut(state, cut)
+    try:
+        image, _ = _render_cut(state, ip, _profile_image(state), "bedrock_stream")
+    except Exception as e:
+        return ip, None, str(e)
+    return ip, image, None
+
 
+def stream_plan_and_render(state: OrchestrationState) -> OrchestrationState:
+    """
+    PLANNER_STREAMING: plan_storyboard / build_prompts / generate_images in one
+    node. The planner completion is streamed and parsed incrementally; each cut
+    is handed to the render pool as soon as its JSON object closes, so image
+    generation overlaps with decoding of the remaining cuts. The full text is
+    still validated into a Storyboard at the end, and cuts the stream didn't
+    yield (unparsable, or before the character description was known) start then.
+    """
+    _set_progress(state, 10, status="RUNNING")
+    prompt, budget = _planner_prompt(state)
+    parser = StreamingArrayParser("cuts")
+    items: Dict[int, dict] = {}
+    futures: Dict[int, Future] = {}
+    started = time.monotonic()
+
+    workers = max(1, min(IMAGE_GEN_CONCURRENCY, state.num_cuts))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"stream-{state.job_id[:8]}")
+
+    def start(cut: StoryboardCut) -> None:
+        if not futures:
+            _set_progress(state, 60)
+        print(f"[{state.job_id}] Cut {cut.cut_index} planned after {time.monotonic() - started:.1f}s, rendering", flush=True)
+        futures[cut.cut_index] = pool.submit(_prompt_and_render, state, cut, items.get(cut.cut_index, {}).get("image_prompt"))
+
+    try:
+        for delta in stream_text_model(prompt, temperature=0.2, max_tokens=text_token_budget(budget, state.num_cuts), use_cache=state.use_cache):
+            for item in parser.feed(delta):
+                try:
+                    cut = StoryboardCut(**item)
+                except Exception:
+                    continue
+                if cut.cut_index in items or len(items) >= state.num_cuts:
+                    continue
+                items[cut.cut_index] = item
+                if state.storyboard is None and parser.header and parser.header.get("character_appearance"):
+                    # Provisional storyboard so prompt building sees the character
+                    state.storyboard = Storyboard(cuts=[], character_appearance=parser.header["character_appearance"])
+                if state.storyboard is not None:
+                    start(cut)
+
+        data = json.loads(_extract_json(parser.text))
+        sb = _parse_storyboard(state, data)
+        state.storyboard = sb
+        update_job(state.job_id, storyboard=sb)
+        if futures:
+            print(f"[{state.job_id}] {len(futures)}/{len(sb.cuts)} cuts were rendering before the storyboard completed", flush=True)
+
+        for item in data.get("cuts") or []:
+            try:
+                items.setdefault(StoryboardCut(**item).cut_index, item)
+            except Exception:
+                continue
+        for cut in sb.cuts:
+            if cut.cut_index not in futures:
+                start(cut)
+
+        image_prompts: List[ImagePrompt] = []
+        generated: List[CutImage] = []
+        failed: Dict[int, str] = {}
+        wanted = {c.cut_index for c in sb.cuts}
+        for cut_index, fut in futures.items():
+            if cut_index not in wanted:
+                continue
+            try:
+                ip, image, error = fut.result()
+            except Exception as e:
+                ip, image, error = None, None, str(e)
+            if ip is not None:
+                image_prompts.append(ip)
+            if image is not None:
+                generated.append(image)
+            else:
+                print(f"[{state.job_id}] Cut {cut_index} failed: {error}", flush=True)
+                failed[cut_index] = error
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    state.prompts = sorted(image_prompts, key=lambda p: p.cut_index)
+    update_job(state.job_id, prompts=state.prompts)
+    if not generated and failed:
+        raise RuntimeError(f"All cuts failed to render: {failed}")
+    state.images = sorted(generated, key=lambda img: img.cut_index)
+    update_job(state.job_id, images=state.images, failed_cuts=failed or None)
     _set_progress(state, 75)
     return state
 
@@ -197,7 +535,7 @@ def qa_images(state: OrchestrationState) -> OrchestrationState:
     #     img_bytes = None
     #     s3_key = img.meta.get("s3_key")
     #     if s3_key:
-    #          s3 = boto3.client("s3")
+    #          s3 = _s3()
     #          try:
     #             obj = s3.get_object(Bucket=S3_BUCKET, Key=s3_key)
     #             img_bytes = obj["Body"].read()
@@ -246,7 +584,8 @@ def retry_failed(state: OrchestrationState) -> OrchestrationState:
             reason=r.reason,
             fix_hint=r.fix_hint
         )
-        new_prompt = invoke_text_model(revise_prompt, temperature=0.25).strip()
+        new_prompt = invoke_text_model(revise_prompt, temperature=0.25, use_cache=False,
+                                       max_tokens=text_token_budget("revise_prompt")).strip()
         print(f"New Prompt: {new_prompt}")
         # state 반영
         for p in state.prompts:
@@ -255,19 +594,22 @@ def retry_failed(state: OrchestrationState) -> OrchestrationState:
 
         # 이미지 재생성
         # layout="single" (default), ref_image=None (for now)
-        s3 = boto3.client("s3")
+        s3 = _s3()
         # Fix: Use s3_key from meta, not the full URL
         ref_key = state.images[0].meta.get("s3_key")
         if not ref_key:
             print(f"Warning: No s3_key found for reference image {state.images[0].cut_index}")
             continue
 
-        try:
-            obj = s3.get_object(Bucket=S3_BUCKET, Key=ref_key)
-            ref_bytes = obj["Body"].read()
-        except Exception as e:
-             print(f"Retry error loading ref image: {e}")
-             ref_bytes = None
+        ref_bytes = PANEL_BLOBS.get(state.job_id, ref_key)
+        if ref_bytes is None:
+            try:
+                obj = s3.get_object(Bucket=S3_BUCKET, Key=ref_key)
+                ref_bytes = obj["Body"].read()
+            except Exception as e:
+                 print(f"Retry error loading ref image: {e}")
+                 RENDER_CACHE.evict_key(ref_key)
+                 ref_bytes = None
 
         if ref_bytes:
              out = invoke_image_model_to_s3(
@@ -283,6 +625,8 @@ def retry_failed(state: OrchestrationState) -> OrchestrationState:
                 job_id=state.job_id, 
                 cut_index=r.cut_index
              )
+        if out.img_bytes:
+            PANEL_BLOBS.put(state.job_id, out.s3_key, out.img_bytes)
         for img in state.images:
             if img.cut_index == r.cut_index:
                 img.image_url = out.url
@@ -317,20 +661,34 @@ def done(state: OrchestrationState) -> OrchestrationState:
     return state
 
 
-def build_graph():
+def build_graph(checkpointer=None):
     g = StateGraph(OrchestrationState)
 
-    g.add_node("plan_storyboard", plan_storyboard)
-    g.add_node("build_prompts", build_prompts)
-    g.add_node("generate_images", generate_images)
+    streaming = PLANNER_STREAMING and IMAGE_GEN_MODE != "sequential"
+    if PLANNER_STREAMING and not streaming:
+        print("WARNING: PLANNER_STREAMING needs parallel rendering; IMAGE_GEN_MODE=sequential ignores it", flush=True)
+    if streaming:
+        g.add_node("stream_plan_and_render", stream_plan_and_render)
+        g.set_entry_point("stream_plan_and_render")
+        g.add_edge("stream_plan_and_render", "qa_images")
+    elif PLANNER_MODE == "single":
+        g.add_node("plan_with_prompts", plan_with_prompts)
+        g.set_entry_point("plan_with_prompts")
+        g.add_edge("plan_with_prompts", "generate_images")
+    else:
+        g.add_node("plan_storyboard", plan_storyboard)
+        g.add_node("build_prompts", build_prompts)
+        g.set_entry_point("plan_storyboard")
+        g.add_edge("plan_storyboard", "build_prompts")
+        g.add_edge("build_prompts", "generate_images")
+
+    if not streaming:
+        g.add_node("generate_images", generate_images)
+        g.add_edge("generate_images", "qa_images")
     g.add_node("qa_images", qa_images)
     g.add_node("retry_failed", retry_failed)
     g.add_node("done", done)
 
-    g.set_entry_point("plan_storyboard")
-    g.add_edge("plan_storyboard", "build_prompts")
-    g.add_edge("build_prompts", "generate_images")
-    g.add_edge("generate_images", "qa_images")
     g.add_edge("qa_images", "retry_failed")
 
     g.add_conditional_edges(
@@ -343,7 +701,7 @@ def build_graph():
     )
     g.add_edge("done", END)
 
-    return g.compile()
+    return g.compile(checkpointer=checkpointer)
 
 
 def _extract_json(text: str) -> str:
@@ -358,11 +716,63 @@ def _extract_json(text: str) -> str:
     return text[start:end + 1]
 
 
+def _extract_json_array(text: str) -> str:
+    """
+    _extract_json 과 같은 방식으로 첫 '['부터 마지막 ']'까지 잘라냅니다.
+    """
+    start = text.find("[")
+    end = text.rfind("]")
+    if start == -1 or end == -1 or end <= start:
+        return "[]"
+    return text[start:end + 1]
+
+
 GRAPH = build_graph()
+_CHECKPOINTED_GRAPH = None
+
 
+def _checkpointed_graph():
+    """GRAPH compiled with the job checkpointer, or None when checkpointing is off."""
+    global _CHECKPOINTED_GRAPH
+    if _CHECKPOINTED_GRAPH is None:
+        saver = CHECKPOINTS.saver
+        if saver is None:
+            return None
+        _CHECKPOINTED_GRAPH = build_graph(checkpointer=saver)
+    return _CHECKPOINTED_GRAPH
 
-def run_job(state: OrchestrationState) -> OrchestrationState:
-    return GRAPH.invoke(state)
 
-async def run_job_async(state: OrchestrationState) -> OrchestrationState:
-    return await GRAPH.ainvoke(state)
+def run_job(state: OrchestrationState):
+    """
+    Runs the graph with thread_id = job_id. If the job already has checkpoints
+    (its previous run failed or was interrupted), continues after the last
+    completed node instead of starting over; cuts rendered by the failed run
+    come back from the render cache.
+    """
+    graph = _checkpointed_graph()
+    if graph is None:
+        return GRAPH.invoke(state)
+
+    config = thread_config(state.job_id)
+    snapshot = graph.get_state(config)
+    if snapshot.values:
+        if snapshot.next:
+            CHECKPOINTS.resumed += 1
+            print(f"[{state.job_id}] Resuming graph at {list(snapshot.next)}", flush=True)
+            return graph.invoke(None, config)
+        # The graph finished before; only the steps after it (saving, composing) failed
+        CHECKPOINTS.reused_final_state += 1
+        print(f"[{state.job_id}] Reusing finished graph state", flush=True)
+        return snapshot.values
+    return graph.invoke(state, config)
+
+async def run_job_async(state: OrchestrationState, profile_image: Optional[bytes] = None):
+    # Nodes are blocking (Bedrock/S3 calls); run the whole graph on the generation
+    # pool so a burst of jobs can't starve the API's default threadpool.
+    loop = asyncio.get_running_loop()
+    if profile_image:
+        _PROFILE_IMAGES[state.job_id] = profile_image
+    try:
+        return await loop.run_in_executor(GRAPH_EXECUTOR, run_job, state)
+    finally:
+        _PROFILE_IMAGES.pop(state.job_id, None)
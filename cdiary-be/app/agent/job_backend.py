@@ -0,0 +1,506 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import os
+import socket
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from app.database import AsyncSessionLocal
+from app.models.models import GenerationJob
+from .store import JOB_REGISTRY, TERMINAL_STATUSES
+
+
+# "local": in-process asyncio queue (single API process, jobs lost on restart)
+# "postgres": generation_jobs table, shared by every API replica and consumer
+JOB_BACKEND_KIND = os.getenv("JOB_BACKEND", "local").lower()
+# A claimed job is reclaimable this long after its consumer stopped heartbeating
+JOB_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+# update_job() is called many times per job; status rows are written behind at this interval
+JOB_STATUS_FLUSH_SECONDS = float(os.getenv("JOB_STATUS_FLUSH_SECONDS", "0.5"))
+# updated_at is the writing transaction's start time, so a row can commit after
+# a poll already moved past it; changed_since re-reads this much (on top of the
+# flush interval) behind its cursor
+JOB_CHANGE_OVERLAP_SECONDS = float(os.getenv("JOB_CHANGE_OVERLAP_SECONDS", "5"))
+
+
+@dataclass
+class ClaimedJob:
+    job_id: str
+    user_id: str
+    artifact_id: Optional[str]
+    payload: Dict[str, Any]
+    attempt: int
+    enqueued_at: Optional[datetime.datetime] = None
+
+
+class DuplicateJob(Exception):
+    """enqueue() lost a race: the same submission is already queued (see coalesce.py)."""
+
+    def __init__(self, job_id: str, artifact_id: Optional[str]):
+        super().__init__(job_id)
+        self.job_id = job_id
+        self.artifact_id = artifact_id
+
+
+def _status_str(value: Any) -> Optional[str]:
+    return getattr(value, "value", value)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class LocalJobBackend:
+    """
+    Stand-in for development and single-process deployments: an asyncio queue
+    consumed by the embedded consumer. Nothing is persisted; GET /api/jobs/{id}
+    answers from the in-process registry only.
+    """
+
+    durable = False
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self.enqueued = 0
+        self.claimed = 0
+
+    def _q(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def enqueue(self, job_id: str, user_id: str, artifact_id: Optional[str], payload: Dict[str, Any],
+                      idempotency_key: Optional[str] = None, dedupe_key: Optional[str] = None) -> None:
+        await self._q().put(ClaimedJob(job_id, user_id, artifact_id or None, payload, attempt=1, enqueued_at=_now()))
+        self.enqueued += 1
+
+    async def requeue(self, job_id: str, user_id: str, artifact_id: Optional[str], payload: Dict[str, Any]) -> bool:
+        """Queues a failed job again under the same id (resume, see graph.run_job)."""
+        await self._q().put(ClaimedJob(job_id, user_id, artifact_id or None, payload, attempt=1, enqueued_at=_now()))
+        self.enqueued += 1
+        return True
+
+    async def claim(self, worker_id: str) -> Optional[ClaimedJob]:
+        try:
+            job = await asyncio.wait_for(self._q().get(), timeout=JOB_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            return None
+        self.claimed += 1
+        return job
+
+    async def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        return True
+
+    async def counts(self, user_id: str) -> Tuple[int, int]:
+        """(jobs waiting for a worker, the user's unfinished jobs)"""
+        active = sum(1 for r in JOB_REGISTRY.for_user(user_id) if r.status not in TERMINAL_STATUSES)
+        return self._q().qsize(), active
+
+    async def depth(self) -> int:
+        return self._q().qsize()
+
+    async def artifact_busy(self, user_id: str, artifact_id: str) -> bool:
+        """Whether an unfinished job is (re)generating this artifact."""
+        return _registry_busy(user_id, artifact_id)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        pass
+
+    def record(self, job_id: str, job: Dict[str, Any]) -> None:
+        pass
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def find(self, user_id: str, idempotency_key: Optional[str], dedupe_key: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def changed_since(self, user_ids: List[str], since: Optional[datetime.datetime]):
+        return [], since
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "local",
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "claimed": self.claimed,
+        }
+
+
+class PostgresJobBackend:
+    """
+    generation_jobs as a work queue.
+
+    - claim(): oldest claimable row, FOR UPDATE SKIP LOCKED, so concurrent
+      consumers never get the same job. A row is claimable when it isn't
+      terminal and its lease (locked_until) is empty or expired, i.e. it was
+      never started or its consumer crashed / was redeployed mid-run.
+    - heartbeat(): extends the lease while the job runs.
+    - Status/progress from update_job() are buffered by record() and written
+      behind every JOB_STATUS_FLUSH_SECONDS, so any replica can serve
+      GET /api/jobs/{id} without one UPDATE per progress tick.
+    """
+
+    durable = True
+
+    def __init__(self):
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.claimed = 0
+        self.reclaimed = 0
+        self.gave_up = 0
+        self.flushed_rows = 0
+
+    async def enqueue(self, job_id: str, user_id: str, artifact_id: Optional[str], payload: Dict[str, Any],
+                      idempotency_key: Optional[str] = None, dedupe_key: Optional[str] = None) -> None:
+        """Raises DuplicateJob when the unique keys show the submission is already queued."""
+        try:
+            await self._insert(job_id, user_id, artifact_id, payload, idempotency_key, dedupe_key)
+        except IntegrityError:
+            found = await self.find(user_id, idempotency_key, dedupe_key) if dedupe_key else None
+            if found is None:
+                raise
+            raise DuplicateJob(found["jobId"], found["artifactId"])
+        self.enqueued += 1
+
+    async def _insert(self, job_id, user_id, artifact_id, payload, idempotency_key, dedupe_key) -> None:
+        async with AsyncSessionLocal() as db:
+            db.add(GenerationJob(
+                id=job_id,
+                user_id=uuid.UUID(user_id),
+                artifact_id=uuid.UUID(artifact_id) if artifact_id else None,
+                status="QUEUED",
+                step="Waiting for a worker...",
+                progress=0.0,
+                payload=payload,
+                idempotency_key=idempotency_key,
+                dedupe_key=dedupe_key,
+                max_attempts=JOB_MAX_ATTEMPTS,
+            ))
+            await db.commit()
+
+    async def requeue(self, job_id: str, user_id: str, artifact_id: Optional[str], payload: Dict[str, Any]) -> bool:
+        """
+        Makes a FAILED job claimable again with a fresh attempt budget. The
+        stored payload is kept. False if the job isn't failed (anymore), e.g.
+        a concurrent resume got there first.
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(GenerationJob)
+                .where((GenerationJob.id == job_id) & (GenerationJob.status == "FAILED"))
+                .values(status="QUEUED", step="Waiting for a worker...", progress=0.0, error=None,
+                        attempts=0, locked_by=None, locked_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if not result.rowcount:
+            return False
+        with self._lock:
+            # A FAILED snapshot still waiting to be written must not undo this
+            self._pending.pop(job_id, None)
+        self.enqueued += 1
+        return True
+
+    async def claim(self, worker_id: str) -> Optional[ClaimedJob]:
+        now = _now()
+        async with AsyncSessionLocal() as db:
+            await self._fail_exhausted(db, now)
+
+            candidate = (
+                select(GenerationJob.id)
+                .where(GenerationJob.status.notin_(TERMINAL_STATUSES))
+                .where(or_(GenerationJob.locked_until.is_(None), GenerationJob.locked_until < now))
+                .where(GenerationJob.attempts < GenerationJob.max_attempts)
+                .order_by(GenerationJob.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            row = (await db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == candidate)
+                .values(
+                    locked_by=worker_id,
+                    locked_until=now + datetime.timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS),
+                    attempts=GenerationJob.attempts + 1,
+                )
+                .returning(
+                    GenerationJob.id, GenerationJob.user_id, GenerationJob.artifact_id,
+                    GenerationJob.payload, GenerationJob.attempts, GenerationJob.created_at,
+                )
+                .execution_options(synchronize_session=False)
+            )).first()
+            await db.commit()
+
+        if row is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+            return None
+
+        job_id, user_id, artifact_id, payload, attempts, created_at = row
+        self.claimed += 1
+        if attempts > 1:
+            self.reclaimed += 1
+            print(f"[{job_id}] Reclaimed after expired lease (attempt {attempts}/{JOB_MAX_ATTEMPTS})", flush=True)
+        return ClaimedJob(str(job_id), str(user_id), str(artifact_id) if artifact_id else None, payload, attempts, created_at)
+
+    async def _fail_exhausted(self, db, now: datetime.datetime) -> None:
+        # Jobs whose consumer died on every attempt would otherwise stay "running" forever
+        result = await db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.status.notin_(TERMINAL_STATUSES))
+            .where(GenerationJob.attempts >= GenerationJob.max_attempts)
+            .where(and_(GenerationJob.locked_until.isnot(None), GenerationJob.locked_until < now))
+            .values(status="FAILED", error="Job was interrupted too many times", locked_by=None, locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        self.gave_up += result.rowcount or 0
+
+    async def counts(self, user_id: str) -> Tuple[int, int]:
+        """(jobs waiting for a worker across all replicas, the user's unfinished jobs)"""
+        unfinished = GenerationJob.status.notin_(TERMINAL_STATUSES)
+        async with AsyncSessionLocal() as db:
+            queued = await db.scalar(
+                select(func.count()).select_from(GenerationJob)
+                .where(unfinished & GenerationJob.locked_by.is_(None))
+            )
+            active = await db.scalar(
+                select(func.count()).select_from(GenerationJob)
+                .where(unfinished & (GenerationJob.user_id == uuid.UUID(user_id)))
+            )
+        return int(queued or 0), int(active or 0)
+
+    async def artifact_busy(self, user_id: str, artifact_id: str) -> bool:
+        """Same as the local backend, including jobs queued or run by other processes."""
+        if _registry_busy(user_id, artifact_id):
+            return True
+        async with AsyncSessionLocal() as db:
+            found = await db.scalar(
+                select(GenerationJob.id)
+                .where((GenerationJob.user_id == uuid.UUID(user_id)) & (GenerationJob.artifact_id == uuid.UUID(artifact_id)))
+                .where(GenerationJob.status.notin_(TERMINAL_STATUSES))
+                .limit(1)
+            )
+        return found is not None
+
+    async def depth(self) -> int:
+        async with AsyncSessionLocal() as db:
+            queued = await db.scalar(
+                select(func.count()).select_from(GenerationJob)
+                .where(GenerationJob.status.notin_(TERMINAL_STATUSES) & GenerationJob.locked_by.is_(None))
+            )
+        return int(queued or 0)
+
+    async def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extends the lease; False if another consumer has taken the job over."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(GenerationJob)
+                .where((GenerationJob.id == job_id) & (GenerationJob.locked_by == worker_id))
+                .values(locked_until=_now() + datetime.timedelta(seconds=JOB_VISIBILITY_TIMEOUT_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return bool(result.rowcount)
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        """
+        Writes the job's latest status together with dropping the lease, so a
+        finished job is never seen as claimable. A job released in a non-terminal
+        state (consumer shutting down) is picked up again right away.
+
+        The status comes from JOB_REGISTRY, not from the write-behind buffer:
+        a flush may have taken the final snapshot already and not committed it.
+        """
+        with self._lock:
+            self._pending.pop(job_id, None)
+        record = JOB_REGISTRY.get(job_id)
+        snapshot = _status_values(record.to_dict()) if record is not None else {}
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(GenerationJob)
+                .where((GenerationJob.id == job_id) & (GenerationJob.locked_by == worker_id))
+                .values(locked_by=None, locked_until=None, **snapshot)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    def record(self, job_id: str, job: Dict[str, Any]) -> None:
+        """Called from update_job (any thread); only the latest snapshot per job is kept."""
+        values = _status_values(job)
+        with self._lock:
+            self._pending[job_id] = values
+
+    async def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                for job_id, values in pending.items():
+                    # A late flush must not undo the terminal status release() wrote
+                    await db.execute(
+                        update(GenerationJob)
+                        .where((GenerationJob.id == job_id) & GenerationJob.status.notin_(TERMINAL_STATUSES))
+                        .values(**values)
+                        .execution_options(synchronize_session=False)
+                    )
+                await db.commit()
+            self.flushed_rows += len(pending)
+        except Exception as e:
+            print(f"WARNING: Failed to persist job status for {len(pending)} job(s): {e}", flush=True)
+            with self._lock:
+                # Keep newer snapshots recorded meanwhile
+                for job_id, values in pending.items():
+                    self._pending.setdefault(job_id, values)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_STATUS_FLUSH_SECONDS)
+            await self.flush()
+
+    async def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        async with AsyncSessionLocal() as db:
+            row = await db.get(GenerationJob, job_id)
+        return _row_to_job(row) if row is not None else None
+
+    async def find(self, user_id: str, idempotency_key: Optional[str], dedupe_key: str) -> Optional[Dict[str, Any]]:
+        """
+        The job created with this Idempotency-Key (any status), else the
+        unfinished job for the same submission (dedupe key).
+        """
+        uid = uuid.UUID(user_id)
+        async with AsyncSessionLocal() as db:
+            row = None
+            if idempotency_key:
+                row = (await db.execute(
+                    select(GenerationJob)
+                    .where((GenerationJob.user_id == uid) & (GenerationJob.idempotency_key == idempotency_key))
+                )).scalars().first()
+            if row is None:
+                row = (await db.execute(
+                    select(GenerationJob)
+                    .where((GenerationJob.user_id == uid) & (GenerationJob.dedupe_key == dedupe_key))
+                    .where(GenerationJob.status.notin_(TERMINAL_STATUSES))
+                    .order_by(GenerationJob.created_at.desc())
+                    .limit(1)
+                )).scalars().first()
+        if row is None:
+            return None
+        return {**_row_to_job(row), "idempotencyKey": row.idempotency_key, "dedupeKey": row.dedupe_key}
+
+    async def changed_since(
+        self, user_ids: List[str], since: Optional[datetime.datetime]
+    ) -> Tuple[List[Dict[str, Any]], Optional[datetime.datetime]]:
+        """
+        Jobs of `user_ids` updated at or after `since` minus the overlap
+        window (first call: unfinished jobs only), plus the cursor for the next
+        call. Rows seen twice are harmless, callers only publish actual differences.
+        """
+        stmt = select(GenerationJob).where(GenerationJob.user_id.in_([uuid.UUID(u) for u in user_ids]))
+        if since is None:
+            stmt = stmt.where(GenerationJob.status.notin_(TERMINAL_STATUSES))
+        else:
+            overlap = datetime.timedelta(seconds=JOB_STATUS_FLUSH_SECONDS + JOB_CHANGE_OVERLAP_SECONDS)
+            stmt = stmt.where(GenerationJob.updated_at >= since - overlap)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).scalars().all()
+        if rows:
+            since = max([r.updated_at for r in rows] + ([since] if since else []))
+        elif since is None:
+            since = _now()
+        return [_row_to_job(r) for r in rows], since
+
+    def start(self) -> None:
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "backend": "postgres",
+            "visibility_timeout_seconds": JOB_VISIBILITY_TIMEOUT_SECONDS,
+            "max_attempts": JOB_MAX_ATTEMPTS,
+            "enqueued": self.enqueued,
+            "claimed": self.claimed,
+            "reclaimed": self.reclaimed,
+            "gave_up": self.gave_up,
+            "pending_status_writes": pending,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+def _registry_busy(user_id: str, artifact_id: str) -> bool:
+    return any(
+        r.artifact_id == artifact_id and r.status not in TERMINAL_STATUSES
+        for r in JOB_REGISTRY.for_user(user_id)
+    )
+
+
+def _status_values(job: Dict[str, Any]) -> Dict[str, Any]:
+    values = {
+        "status": _status_str(job.get("status")),
+        "step": job.get("step"),
+        "progress": float(job.get("progress") or 0.0),
+        "error": job.get("error"),
+        "failed_cuts": job.get("failedCuts"),
+    }
+    artifact_id = job.get("artifactId")
+    if artifact_id:
+        values["artifact_id"] = uuid.UUID(str(artifact_id))
+    return values
+
+
+def _row_to_job(row: GenerationJob) -> Dict[str, Any]:
+    return {
+        "jobId": row.id,
+        "userId": str(row.user_id),
+        "status": row.status,
+        "step": row.step or "",
+        "progress": row.progress or 0.0,
+        "artifactId": str(row.artifact_id) if row.artifact_id else None,
+        "error": row.error,
+        "failedCuts": row.failed_cuts,
+    }
+
+
+def _make_backend():
+    if JOB_BACKEND_KIND == "postgres":
+        return PostgresJobBackend()
+    if JOB_BACKEND_KIND != "local":
+        print(f"WARNING: Unknown JOB_BACKEND={JOB_BACKEND_KIND!r}, using local", flush=True)
+    return LocalJobBackend()
+
+
+def make_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+JOB_BACKEND = _make_backend()
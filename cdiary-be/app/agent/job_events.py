@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set
+
+
+# Recent events kept for Last-Event-ID replay (all users)
+JOB_EVENT_BUFFER = int(os.getenv("JOB_EVENT_BUFFER", "2048"))
+# Per-connection backlog before the client is resynced with a snapshot
+JOB_STREAM_QUEUE_SIZE = int(os.getenv("JOB_STREAM_QUEUE_SIZE", "256"))
+
+# Fields pushed to clients; storyboard/prompts/images payloads stay server-side
+STREAM_FIELDS = ("jobId", "userId", "status", "step", "progress", "artifactId", "error", "failedCuts")
+
+
+@dataclass
+class JobEvent:
+    seq: int
+    user_id: str
+    job_id: str
+    changes: Dict[str, Any]
+
+
+@dataclass(eq=False)
+class Subscription:
+    user_id: str
+    queue: asyncio.Queue
+    loop: asyncio.AbstractEventLoop
+    lagged: bool = False
+    replay: List[JobEvent] = field(default_factory=list)
+    # False when the client has to start from a snapshot
+    resumed: bool = False
+
+
+class JobEventBus:
+    """
+    Fan-out of job changes to SSE subscribers.
+
+    publish() may be called from any thread (graph nodes run in executor
+    threads); events get a sequence number under a lock and are handed to
+    each subscriber's loop with call_soon_threadsafe. Ids carry a per-process
+    epoch so ids from before a restart are never mistaken for resumable ones.
+    """
+
+    def __init__(self, buffer_size: int, queue_size: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._seq = 0
+        self._buffer: Deque[JobEvent] = deque(maxlen=buffer_size)
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.resyncs = 0
+        self.replays = 0
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def _parse_id(self, last_event_id: Optional[str]) -> Optional[int]:
+        if not last_event_id:
+            return None
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def publish(self, user_id: Optional[str], job_id: str, changes: Dict[str, Any]) -> None:
+        if not user_id or not changes:
+            return
+        with self._lock:
+            self._seq += 1
+            event = JobEvent(self._seq, str(user_id), job_id, changes)
+            self._buffer.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers.get(event.user_id, ()))
+        for sub in subscribers:
+            sub.loop.call_soon_threadsafe(self._deliver, sub, event)
+
+    @staticmethod
+    def _deliver(sub: Subscription, event: JobEvent) -> None:
+        if sub.lagged:
+            return
+        try:
+            sub.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: drop its backlog, it gets a fresh snapshot instead
+            sub.lagged = True
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> Subscription:
+        sub = Subscription(str(user_id), asyncio.Queue(maxsize=self.queue_size), asyncio.get_running_loop())
+        last_seq = self._parse_id(last_event_id)
+        with self._lock:
+            self._subscribers.setdefault(sub.user_id, set()).add(sub)
+            oldest = self._buffer[0].seq if self._buffer else self._seq + 1
+            # Resumable only if nothing after last_seq has been dropped from the buffer
+            if last_seq is not None and last_seq <= self._seq and oldest <= last_seq + 1:
+                sub.replay = [e for e in self._buffer if e.seq > last_seq and e.user_id == sub.user_id]
+                sub.resumed = True
+                self.replays += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.user_id]
+
+    def resync(self, sub: Subscription) -> None:
+        """Called by the stream after sending a snapshot to a lagged subscriber."""
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.lagged = False
+        self.resyncs += 1
+
+    def subscribed_users(self) -> List[str]:
+        with self._lock:
+            return list(self._subscribers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "users": len(self._subscribers),
+                "buffered_events": len(self._buffer),
+                "published": self.published,
+                "replays": self.replays,
+                "resyncs": self.resyncs,
+            }
+
+
+JOB_EVENTS = JobEventBus(JOB_EVENT_BUFFER, JOB_STREAM_QUEUE_SIZE)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+import re
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, literal, or_, text
+from sqlalchemy.future import select
+
+from app.models.models import Diary
+
+
+# Weight of the lexical score when blending with vector similarity (mode=hybrid)
+SEARCH_LEXICAL_WEIGHT = float(os.getenv("SEARCH_LEXICAL_WEIGHT", "0.3"))
+SNIPPET_WIDTH = int(os.getenv("SEARCH_SNIPPET_WIDTH", "60"))
+
+_state: Dict[str, Any] = {"trigram": False}
+
+
+async def ensure_lexical_schema(conn) -> bool:
+    """
+    Startup hook: trigram GIN index on diaries.content (Postgres + pg_trgm).
+    Trigrams work on characters rather than words, so Hangul text is matched
+    without a Korean tokenizer, and the index serves both ILIKE '%q%' and
+    word-similarity (<%) lookups.
+    """
+    if conn.dialect.name != "postgresql":
+        return False
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        async with conn.begin_nested():
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_diaries_content_trgm "
+                "ON diaries USING gin (content gin_trgm_ops)"
+            ))
+    except Exception as e:
+        print(f"WARNING: pg_trgm unavailable, lexical search uses LIKE scans: {e}", flush=True)
+        return False
+    _state["trigram"] = True
+    return True
+
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def lexical_search(db, user_id: str, query: str, limit: int) -> List[Tuple[Diary, float]]:
+    """
+    Diaries matching `query` (substring or fuzzy word match), best first.
+    Scores are in [0, 1] so they can be blended with cosine similarity.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    uid = uuid.UUID(user_id)
+    pattern = f"%{_escape_like(query)}%"
+
+    if _state["trigram"]:
+        score = func.word_similarity(query, Diary.content)
+        stmt = (
+            select(Diary, score.label("score"))
+            .where(Diary.user_id == uid)
+            .where(or_(
+                Diary.content.ilike(pattern, escape="\\"),
+                literal(query).op("<%")(Diary.content),
+            ))
+            .order_by(score.desc(), Diary.diary_date.desc())
+            .limit(limit)
+        )
+        rows = (await db.execute(stmt)).all()
+        # An exact substring hit always beats a fuzzy one
+        q_lower = query.lower()
+        return [
+            (d, max(float(s or 0.0), 1.0 if q_lower in d.content.lower() else 0.0))
+            for d, s in rows
+        ]
+
+    # SQLite / no pg_trgm: substring scan, scored by term coverage
+    stmt = select(Diary).where((Diary.user_id == uid) & Diary.content.contains(query)).order_by(Diary.diary_date.desc())
+    diaries = (await db.execute(stmt)).scalars().all()
+    scored = [(d, _coverage_score(d.content, query)) for d in diaries]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:limit]
+
+
+def _coverage_score(content: str, query: str) -> float:
+    terms = [t for t in re.split(r"\s+", query.lower()) if t]
+    if not terms:
+        return 0.0
+    content = content.lower()
+    return sum(1 for t in terms if t in content) / len(terms)
+
+
+def make_snippet(content: str, query: str, width: int = SNIPPET_WIDTH) -> str:
+    """
+    Excerpt of `content` around the first occurrence of the query (or of any of
+    its terms), with the match roughly centered. Falls back to the beginning.
+    """
+    if not content:
+        return ""
+    lower = content.lower()
+    pos = -1
+    for term in [query.strip()] + re.split(r"\s+", query.strip()):
+        if term:
+            pos = lower.find(term.lower())
+            if pos != -1:
+                break
+
+    if pos == -1:
+        return content[:width * 2] + ("..." if len(content) > width * 2 else "")
+
+    start = max(0, pos - width)
+    end = min(len(content), pos + width)
+    return ("..." if start > 0 else "") + content[start:end] + ("..." if end < len(content) else "")
+
+
+def blend_scores(
+    vector_hits: List[Tuple[str, float]],
+    lexical_hits: List[Tuple[str, float]],
+    lexical_weight: Optional[float] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Linear blend over the union of both result lists: (1-w)*vector + w*lexical.
+    """
+    w = SEARCH_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    vec = dict(vector_hits)
+    lex = dict(lexical_hits)
+    blended = {
+        d_id: (1 - w) * vec.get(d_id, 0.0) + w * lex.get(d_id, 0.0)
+        for d_id in set(vec) | set(lex)
+    }
+    return sorted(blended.items(), key=lambda x: x[1], reverse=True)
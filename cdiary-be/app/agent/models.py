@@ -34,6 +34,8 @@ class DiaryEntryRequest(BaseModel):
     diaryDate: Optional[date] = None
     protagonistName: Optional[str] = "Me"
     options: GenerationOptions
+    # False: fresh sample ("Regenerate"), i.e. a new seed and no text/render cache hits
+    useCache: bool = True
 # -------------------------------------------
 
 
@@ -101,10 +103,11 @@ class OrchestrationState(BaseModel):
     # observability
     trace_id: str
     
-    # context
-    profile_image: Optional[bytes] = None
+    # context (the profile reference image is passed to run_job_async instead:
+    # megabytes of PNG would be written to every checkpoint)
     profile_prompt: Optional[str] = None
     seed: Optional[int] = None
+    use_cache: bool = True
 
 DiaryEntryRequest.model_rebuild()
 OrchestrationState.model_rebuild()
@@ -83,6 +83,51 @@ CRITICAL: Do not repeat the same camera angle for all cuts. Ensure at least one
 Ensure all content in the JSON (summary, scene, etc.) is written in English.
 """
 
+# --- Storyboard + Image Prompts in one call (PLANNER_MODE=single) ---
+PLAN_WITH_PROMPTS_TEMPLATE = """
+You are a professional 'Diary to Comic Storyboard' editor and image prompt writer.
+Create a {num_cuts}-cut comic storyboard from the diary below, and for each cut write the image generation prompt.
+Output MUST be in JSON format only.
+
+Required Schema:
+{{
+"character_appearance": "Extremely concise description of the main character (hair, gender, key outfit). (max 10 words)",
+"cuts": [
+    {{
+    "cut_index": 1,
+    "summary": "Short summary of the scene",
+    "emotion": "Dominant emotion",
+    "scene": "Visual scene description including the background and environment",
+    "dialogue": "Character dialogue (or null if none)",
+    "camera": "Camera angle/shot type (MANDATORY: Wide Shot, Full Shot, Medium Shot, or Close-up. Use variety!)",
+    "image_prompt": "Single-line image generation prompt for this cut"
+    }}
+]
+}}
+
+Character Profile (STRICTLY FOLLOW THIS):
+\"\"\"{profile_prompt}\"\"\"
+
+Diary:
+\"\"\"{diary}\"\"\"
+
+Style guide for every image_prompt:
+- {style_guide}
+
+STRICT RULES for image_prompt:
+1. START the prompt with the camera/framing instruction (e.g., "Wide shot of...", "Full body shot of...").
+2. Describe the entire composition, emphasizing the ENVIRONMENT and background settings as described in the scene.
+3. Place the character within the scene naturally. Do NOT center the character's face/upper body unless a Close-up is explicitly requested.
+4. If "Wide Shot" or "Full Shot" is requested, the character should be smaller in the frame, showing the surroundings.
+5. Focus on the dynamic visual scene, character action, and movement.
+6. Do not include dialogue, speech bubbles, or specific text/captions in the prompt.
+7. Just refer to them as "the character".
+
+CRITICAL: You MUST return exactly {num_cuts} objects in the 'cuts' array. DO NOT generate more than {num_cuts} panels.
+CRITICAL: Do not repeat the same camera angle for all cuts. Ensure at least one cut is a 'Wide Shot' or 'Full Shot' to show the character's surroundings clearly.
+Ensure all content in the JSON (summary, scene, image_prompt, etc.) is written in English.
+"""
+
 # --- Individual Image Prompt Generation (from graph.py) ---
 BUILD_IMAGE_PROMPT_TEMPLATE = """
 Write an image generation prompt for a daily picture panel.
@@ -113,6 +158,33 @@ STRICT RULES:
 7. Just refer to them as "the character".
 """
 
+# --- Batched Image Prompt Generation (all cuts in one call) ---
+BUILD_IMAGE_PROMPTS_BATCH_TEMPLATE = """
+Write one image generation prompt for EACH cut of a daily picture strip.
+You must strictly follow the style guide below:
+- {style_guide}
+
+Main character (same in every cut): {character_appearance}
+
+Cuts (JSON):
+{cuts_json}
+
+STRICT RULES (apply to every prompt):
+1. START the prompt with the camera/framing instruction (e.g., "Wide shot of...", "Full body shot of...").
+2. Describe the entire composition, emphasizing the ENVIRONMENT and background settings as described in the scene.
+3. Place the character within the scene naturally. Do NOT center the character's face/upper body unless a Close-up is explicitly requested.
+4. If "Wide Shot" or "Full Shot" is requested, the character should be smaller in the frame, showing the surroundings.
+5. Focus on the dynamic visual scene, character action, and movement.
+6. Do not include dialogue, speech bubbles, or specific text/captions in the prompt.
+7. Just refer to them as "the character".
+8. Each prompt is a single line of English text.
+
+Output MUST be a JSON array only, one object per cut, in the same order:
+[
+    {{"cut_index": 1, "prompt": "..."}}
+]
+"""
+
 # --- Prompt Revision (from graph.py) ---
 REVISE_IMAGE_PROMPT_TEMPLATE = """
 You are an Image Prompt Rewriter.
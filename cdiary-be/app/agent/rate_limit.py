@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError
+
+
+T = TypeVar("T")
+
+# Per-model limits: "model_id=requests_per_second:max_concurrency,...".
+# Models not listed use BEDROCK_DEFAULT_LIMIT.
+BEDROCK_LIMITS = os.getenv(
+    "BEDROCK_LIMITS",
+    "amazon.nova-lite-v1:0=10:16,amazon.nova-canvas-v1:0=2:6,amazon.titan-embed-text-v2:0=20:16",
+)
+BEDROCK_DEFAULT_LIMIT = os.getenv("BEDROCK_DEFAULT_LIMIT", "5:8")
+BEDROCK_MAX_RETRIES = int(os.getenv("BEDROCK_MAX_RETRIES", "5"))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.getenv("BEDROCK_BACKOFF_BASE_SECONDS", "0.5"))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.getenv("BEDROCK_BACKOFF_MAX_SECONDS", "20"))
+# At most one multiplicative decrease per window, so one wave of throttles
+# from the same burst doesn't collapse the limit to the minimum
+AIMD_DECREASE_COOLDOWN_SECONDS = float(os.getenv("BEDROCK_AIMD_COOLDOWN_SECONDS", "2"))
+AIMD_DECREASE_FACTOR = 0.5
+
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+THROTTLE_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException"}
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, int]]:
+    """'model=rps:concurrency,...' -> {model: (rps, concurrency)}"""
+    limits: Dict[str, Tuple[float, int]] = {}
+    for part in spec.split(","):
+        model, _, value = part.strip().rpartition("=")
+        if not model:
+            continue
+        limits[model] = _parse_limit(value)
+    return limits
+
+
+def _parse_limit(value: str) -> Tuple[float, int]:
+    rps, _, concurrency = value.partition(":")
+    return float(rps), int(concurrency or 1)
+
+
+def error_code(exc: BaseException) -> Optional[str]:
+    if isinstance(exc, ClientError):
+        code = exc.response.get("Error", {}).get("Code")
+        # Errors inside a response stream come as e.g. "throttlingException"
+        return code[:1].upper() + code[1:] if code else code
+    if isinstance(exc, BotoConnectionError):
+        return "ConnectionError"
+    return None
+
+
+class ModelLimiter:
+    """
+    Admission for one Bedrock model, shared by every thread in the process:
+
+    - token bucket: at most `rate` calls/second, bursts up to `burst`
+    - AIMD concurrency: in-flight calls are capped by `limit`, which grows by
+      ~1 per `limit` successes and halves on a throttle, between 1 and
+      `max_concurrency`
+    """
+
+    def __init__(self, model_id: str, rate: float, max_concurrency: int):
+        self.model_id = model_id
+        self.rate = max(rate, 0.01)
+        self.burst = max(1.0, rate)
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire(self) -> None:
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.in_flight < int(self.limit) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.in_flight += 1
+                    break
+                # Wake up when the next token is due (or earlier, when a call finishes)
+                timeout = (1 - self._tokens) / self.rate if self._tokens < 1 else None
+                self._cond.wait(timeout)
+            waited = time.monotonic() - started
+            self.calls += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttles += 1
+                if now - self._last_decrease >= AIMD_DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(1.0, self.limit * AIMD_DECREASE_FACTOR)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate_per_second": self.rate,
+                "tokens": round(self._tokens, 2),
+                "concurrency_limit": round(self.limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "failures": self.failures,
+                "avg_wait_seconds": round(self.wait_seconds_total / self.calls, 4) if self.calls else 0.0,
+                "max_wait_seconds": round(self.wait_seconds_max, 4),
+            }
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+class BedrockLimiters:
+    def __init__(self, limits: Dict[str, Tuple[float, int]], default: Tuple[float, int]):
+        self._limits = limits
+        self._default = default
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_id: str) -> ModelLimiter:
+        limiter = self._limiters.get(model_id)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(model_id)
+                if limiter is None:
+                    rate, concurrency = self._limits.get(model_id, self._default)
+                    limiter = ModelLimiter(model_id, rate, concurrency)
+                    self._limiters[model_id] = limiter
+        return limiter
+
+    def _acquire_and_run(self, model_id: str, fn: Callable[[], T]) -> Tuple[ModelLimiter, T]:
+        """
+        Runs fn() under the model's limiter, retrying throttles / transient
+        service errors with jittered backoff. On success the caller still holds
+        the in-flight slot and must release it.
+        """
+        limiter = self.get(model_id)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                code = error_code(e)
+                limiter.release(throttled=code in THROTTLE_ERROR_CODES)
+                retryable = code in RETRYABLE_ERROR_CODES or code == "ConnectionError"
+                if not retryable or attempt >= BEDROCK_MAX_RETRIES:
+                    limiter.failures += 1
+                    raise
+                delay = backoff_seconds(attempt)
+                attempt += 1
+                limiter.retries += 1
+                print(f"Bedrock {model_id} {code}, retry {attempt}/{BEDROCK_MAX_RETRIES} in {delay:.2f}s", flush=True)
+                time.sleep(delay)
+                continue
+            return limiter, result
+
+    def call(self, model_id: str, fn: Callable[[], T]) -> T:
+        """Runs fn() (a blocking invoke_model call) under the model's limiter, with retries."""
+        limiter, result = self._acquire_and_run(model_id, fn)
+        limiter.release()
+        return result
+
+    def stream(self, model_id: str, open_stream: Callable[[], Iterable[T]]) -> Iterator[T]:
+        """
+        For invoke_model_with_response_stream: open_stream() is retried like
+        call(), and the in-flight slot stays taken until the stream has been
+        consumed (or abandoned). Errors in the middle of a stream are not
+        retried, since part of it has already been handed out.
+        """
+        limiter, events = self._acquire_and_run(model_id, open_stream)
+        throttled = False
+        try:
+            for event in events:
+                yield event
+        except Exception as e:
+            throttled = error_code(e) in THROTTLE_ERROR_CODES
+            limiter.failures += 1
+            raise
+        finally:
+            limiter.release(throttled=throttled)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {model_id: limiter.stats() for model_id, limiter in limiters.items()}
+
+
+BEDROCK_LIMITERS = BedrockLimiters(parse_limits(BEDROCK_LIMITS), _parse_limit(BEDROCK_DEFAULT_LIMIT))
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from botocore.exceptions import ClientError
+
+from app.utils.cache import TTLCache
+
+
+RENDER_CACHE_ENABLED = os.getenv("RENDER_CACHE_ENABLED", "true").lower() == "true"
+RENDER_CACHE_INDEX_SIZE = int(os.getenv("RENDER_CACHE_INDEX_SIZE", "4096"))
+# How long we trust an index entry before re-checking the object with HEAD
+RENDER_CACHE_VERIFY_SECONDS = int(os.getenv("RENDER_CACHE_VERIFY_SECONDS", "3600"))
+# Expiration (days after upload) of the bucket lifecycle rule on
+# {S3_PREFIX}/renders/; 0 = objects never expire. Index entries are never
+# trusted past an object's expiry, and objects close to it count as misses.
+RENDER_CACHE_EXPIRATION_DAYS = int(os.getenv("RENDER_CACHE_EXPIRATION_DAYS", "0"))
+# Install / update that lifecycle rule at startup (needs s3:PutLifecycleConfiguration)
+RENDER_CACHE_MANAGE_LIFECYCLE = os.getenv("RENDER_CACHE_MANAGE_LIFECYCLE", "false").lower() == "true"
+
+_LIFECYCLE_RULE_ID = "cdiary-render-cache"
+
+
+def render_digest(model_id: str, body: Dict[str, Any]) -> str:
+    """
+    Content address of a render request: sha256 over the model id and the
+    canonical request body (text, negativeText, seed, cfgScale, size, ...).
+    """
+    canonical = json.dumps({"modelId": model_id, "body": body}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Maps a render digest to an object already stored in S3.
+
+    Objects live at `{prefix}/renders/{digest}.png`, so the store itself is the
+    source of truth and works across restarts and replicas. The in-memory index
+    only saves HEAD requests; entries expire after RENDER_CACHE_VERIFY_SECONDS
+    (or the object's lifecycle expiry, if sooner) and are dropped when the
+    object turns out to be gone (HEAD 404, failed download).
+    """
+
+    def __init__(self, prefix: str, index_size: int, verify_seconds: int, expiration_days: int = 0):
+        self.prefix = prefix
+        self.verify_seconds = verify_seconds
+        self.expiration_days = expiration_days
+        self.index = TTLCache(max_entries=index_size, ttl_seconds=verify_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_bedrock_calls = 0
+        self.saved_uploads = 0
+        self.stale_evictions = 0
+
+    def key_for(self, digest: str) -> str:
+        return f"{self.prefix}/renders/{digest}.png"
+
+    def digest_of(self, s3_key: str) -> Optional[str]:
+        """Inverse of key_for; None for keys outside the render prefix."""
+        head = f"{self.prefix}/renders/"
+        if s3_key.startswith(head) and s3_key.endswith(".png"):
+            return s3_key[len(head):-len(".png")]
+        return None
+
+    def lookup(self, s3_client, bucket: str, digest: str) -> Optional[str]:
+        s3_key = self.index.get(digest)
+        if s3_key is None:
+            s3_key = self.key_for(digest)
+            last_modified = self._head(s3_client, bucket, s3_key)
+            trust_seconds = self._trust_seconds(last_modified) if last_modified else 0.0
+            if trust_seconds is not None and trust_seconds <= 0:
+                # Gone, or about to be expired by the lifecycle rule: render again
+                self.evict(digest)
+                with self._lock:
+                    self.misses += 1
+                return None
+            self.index.set(digest, s3_key, ttl_seconds=trust_seconds)
+
+        with self._lock:
+            self.hits += 1
+            self.saved_bedrock_calls += 1
+            self.saved_uploads += 1
+        return s3_key
+
+    def record(self, digest: str, s3_key: str) -> None:
+        self.index.set(digest, s3_key, ttl_seconds=self._trust_seconds(_utcnow()))
+
+    def evict(self, digest: str) -> None:
+        """Forget a digest whose object turned out to be gone."""
+        if self.index.pop(digest) is not None:
+            with self._lock:
+                self.stale_evictions += 1
+
+    def evict_key(self, s3_key: Optional[str]) -> None:
+        """Same, by object key (e.g. after a failed download); other keys are ignored."""
+        digest = self.digest_of(s3_key) if s3_key else None
+        if digest:
+            self.evict(digest)
+
+    def _trust_seconds(self, last_modified: datetime.datetime) -> Optional[float]:
+        """Index TTL for an object uploaded at last_modified (None: the default)."""
+        if not self.expiration_days:
+            return None
+        expires_at = last_modified + datetime.timedelta(days=self.expiration_days)
+        remaining = (expires_at - _utcnow()).total_seconds()
+        return min(self.verify_seconds, remaining) if self.verify_seconds else remaining
+
+    def _head(self, s3_client, bucket: str, s3_key: str) -> Optional[datetime.datetime]:
+        try:
+            return s3_client.head_object(Bucket=bucket, Key=s3_key)["LastModified"]
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"):
+                # Never rendered, or expired by the bucket lifecycle rule
+                return None
+            # 403 is what S3 returns for missing keys without s3:ListBucket
+            print(f"WARNING: render cache HEAD {s3_key} failed ({code}), treating as miss", flush=True)
+            return None
+
+    def ensure_lifecycle(self, s3_client, bucket: str) -> bool:
+        """
+        Installs (or updates) the expiration rule on the render prefix, keeping
+        the bucket's other lifecycle rules. Startup hook, see RENDER_CACHE_MANAGE_LIFECYCLE.
+        """
+        if not self.expiration_days:
+            return False
+        try:
+            rules = s3_client.get_bucket_lifecycle_configuration(Bucket=bucket).get("Rules", [])
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchLifecycleConfiguration":
+                print(f"WARNING: Could not read lifecycle rules of {bucket}: {e}", flush=True)
+                return False
+            rules = []
+        rule = {
+            "ID": _LIFECYCLE_RULE_ID,
+            "Filter": {"Prefix": f"{self.prefix}/renders/"},
+            "Status": "Enabled",
+            "Expiration": {"Days": self.expiration_days},
+        }
+        if rule in rules:
+            return True
+        rules = [r for r in rules if r.get("ID") != _LIFECYCLE_RULE_ID] + [rule]
+        try:
+            s3_client.put_bucket_lifecycle_configuration(Bucket=bucket, LifecycleConfiguration={"Rules": rules})
+        except ClientError as e:
+            print(f"WARNING: Could not set the render cache lifecycle rule: {e}", flush=True)
+            return False
+        print(f"Render cache objects expire after {self.expiration_days} days", flush=True)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RENDER_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "expiration_days": self.expiration_days,
+                "saved_bedrock_calls": self.saved_bedrock_calls,
+                "saved_uploads": self.saved_uploads,
+                "stale_evictions": self.stale_evictions,
+                "index": self.index.stats(),
+            }
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import os
+import threading
+import unicodedata
+from typing import Any, Dict, Hashable, List, Optional
+
+from app.utils.cache import TTLCache
+from .bedrock import get_embedding
+
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", str(24 * 3600)))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "2048"))
+# Results contain presigned URLs, keep this well below S3_PRESIGN_SAFETY_MARGIN_SECONDS
+SEARCH_RESULT_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_RESULT_CACHE_TTL_SECONDS", "120"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+# Query text -> embedding, shared by all users (the text alone determines the vector)
+QUERY_EMBEDDINGS = TTLCache(max_entries=QUERY_EMBEDDING_CACHE_SIZE, ttl_seconds=QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+
+
+def get_query_embedding(query: str) -> List[float]:
+    """
+    get_embedding for search queries, cached by normalized text.
+    Blocking like get_embedding; call it via asyncio.to_thread.
+    """
+    text = normalize_query(query)
+    emb = QUERY_EMBEDDINGS.get(text)
+    if emb is None:
+        emb = get_embedding(text)
+        if emb:
+            QUERY_EMBEDDINGS.set(text, emb)
+    return emb
+
+
+class SearchResultCache:
+    """
+    Per-user search responses keyed on (user, endpoint, normalized query, filters).
+
+    Each user has a generation number that is part of the key; invalidate_user()
+    bumps it, so everything cached for that user becomes unreachable at once and
+    ages out of the LRU.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def _key(self, user_id: str, endpoint: str, query: str, filters: Dict[str, Any]) -> Hashable:
+        gen = self._generations.get(str(user_id), 0)
+        return (str(user_id), gen, endpoint, normalize_query(query).lower(), tuple(sorted(filters.items())))
+
+    def get(self, user_id: str, endpoint: str, query: str, **filters) -> Optional[Any]:
+        return self.cache.get(self._key(user_id, endpoint, query, filters))
+
+    def set(self, user_id: str, endpoint: str, query: str, value: Any, **filters) -> None:
+        self.cache.set(self._key(user_id, endpoint, query, filters), value)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            key = str(user_id)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.cache.stats(), "invalidations": self.invalidations}
+
+
+SEARCH_RESULTS = SearchResultCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL_SECONDS)
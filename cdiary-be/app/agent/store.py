@@ -1,27 +1,189 @@
 from __future__ import annotations
-from typing import Dict, Optional
-from threading import Lock
-from .models import JobStatus
 
-_jobs: Dict[str, JobStatus] = {}
-_lock = Lock()
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
 
+# Finished jobs stay visible (polling, SSE snapshots) this long
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "900"))
+# Hard cap on records; the oldest finished jobs go first. Records have a fixed
+# set of small fields, so this bounds memory (a few hundred bytes each).
+JOB_REGISTRY_MAX_JOBS = int(os.getenv("JOB_REGISTRY_MAX_JOBS", "10000"))
 
-def create_job(job: JobStatus) -> None:
-    with _lock:
-        _jobs[job.job_id] = job
+TERMINAL_STATUSES = ("DONE", "SUCCEEDED", "FAILED")
 
+# Record attribute -> key in the API / SSE representation
+_FIELDS = {
+    "job_id": "jobId",
+    "user_id": "userId",
+    "status": "status",
+    "step": "step",
+    "progress": "progress",
+    "artifact_id": "artifactId",
+    "error": "error",
+    "failed_cuts": "failedCuts",
+}
+_ATTRS = {v: k for k, v in _FIELDS.items()}
 
-def get_job(job_id: str) -> Optional[JobStatus]:
-    with _lock:
-        return _jobs.get(job_id)
 
+@dataclass(slots=True)
+class JobRecord:
+    job_id: str
+    user_id: Optional[str]
+    status: str
+    step: str = ""
+    progress: float = 0.0
+    artifact_id: Optional[str] = None
+    error: Optional[str] = None
+    # Cuts that could not be rendered (the strip is composed without them)
+    failed_cuts: Optional[List[int]] = None
+    # True once this process has updated the job itself (vs. mirrored from the durable backend)
+    local: bool = False
+    finished_at: Optional[float] = None
 
-def update_job(job_id: str, **kwargs) -> None:
-    with _lock:
-        job = _jobs.get(job_id)
-        if not job:
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, attr) for attr, key in _FIELDS.items()}
+
+
+def _status_str(value: Any) -> Any:
+    return getattr(value, "value", value)
+
+
+class JobRegistry:
+    """
+    In-process job state: fixed-field records by job id, plus a user -> job ids
+    index so per-user reads don't scan every job. Only the fields clients see
+    are kept; storyboard/prompts/images passed to update_job are not stored.
+
+    Finished jobs are evicted JOB_RETENTION_SECONDS after they finish, and
+    oldest-finished-first when the registry exceeds max_jobs. Running jobs are
+    never evicted.
+    """
+
+    def __init__(self, max_jobs: int, retention_seconds: int):
+        self.max_jobs = max_jobs
+        self.retention_seconds = retention_seconds
+        self._jobs: Dict[str, JobRecord] = {}
+        self._by_user: Dict[str, Dict[str, None]] = {}  # insertion-ordered sets
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted_ttl = 0
+        self.evicted_cap = 0
+
+    def create(self, job_id: str, user_id: Optional[str], status: Any, step: str = "",
+               artifact_id: Optional[str] = None) -> JobRecord:
+        record = JobRecord(job_id=job_id, user_id=user_id, status=_status_str(status), step=step,
+                           artifact_id=artifact_id or None)
+        with self._lock:
+            self._remove(job_id)
+            self._jobs[job_id] = record
+            if user_id:
+                self._by_user.setdefault(user_id, {})[job_id] = None
+            if record.status in TERMINAL_STATUSES:
+                # e.g. a finished job read back from the durable backend
+                record.finished_at = time.monotonic()
+                self._finished[job_id] = record.finished_at
+            self._sweep()
+        return record
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        return self._jobs.get(job_id)
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._jobs
+
+    def update(self, job_id: str, fields: Dict[str, Any], local: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Applies API-keyed fields (status, step, progress, artifactId, error,
+        userId); unknown keys are ignored. Returns the fields that actually
+        changed, or None if the job isn't registered.
+        """
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is None:
+                return None
+            changes: Dict[str, Any] = {}
+            for key, value in fields.items():
+                attr = _ATTRS.get(key)
+                if attr is None or attr == "job_id":
+                    continue
+                if attr == "status":
+                    value = _status_str(value)
+                if getattr(record, attr) != value:
+                    changes[key] = value
+                    setattr(record, attr, value)
+            if local:
+                record.local = True
+            if "userId" in changes and record.user_id:
+                self._by_user.setdefault(record.user_id, {})[job_id] = None
+            if "status" in changes:
+                if record.status in TERMINAL_STATUSES:
+                    record.finished_at = time.monotonic()
+                    self._finished[job_id] = record.finished_at
+                    self._finished.move_to_end(job_id)
+                else:
+                    record.finished_at = None
+                    self._finished.pop(job_id, None)
+            return changes
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            self._remove(job_id)
+
+    def for_user(self, user_id: str) -> List[JobRecord]:
+        with self._lock:
+            self._sweep()
+            ids = self._by_user.get(user_id, {})
+            return [self._jobs[j] for j in ids if j in self._jobs]
+
+    def all(self) -> List[JobRecord]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _remove(self, job_id: str) -> None:
+        record = self._jobs.pop(job_id, None)
+        if record is None:
             return
-        # Pydantic v2 `model_copy(update=...)`
-        updated = job.model_copy(update=kwargs)
-        _jobs[job_id] = updated
+        self._finished.pop(job_id, None)
+        if record.user_id:
+            ids = self._by_user.get(record.user_id)
+            if ids is not None:
+                ids.pop(job_id, None)
+                if not ids:
+                    del self._by_user[record.user_id]
+
+    def _sweep(self) -> None:
+        # _finished is ordered by finish time, so this only touches evicted entries
+        cutoff = time.monotonic() - self.retention_seconds
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if finished_at > cutoff:
+                break
+            self._remove(job_id)
+            self.evicted_ttl += 1
+        while len(self._jobs) > self.max_jobs and self._finished:
+            job_id = next(iter(self._finished))
+            self._remove(job_id)
+            self.evicted_cap += 1
+
+    def sweep(self) -> None:
+        with self._lock:
+            self._sweep()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "finished": len(self._finished),
+                "users": len(self._by_user),
+                "max_jobs": self.max_jobs,
+                "retention_seconds": self.retention_seconds,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_cap": self.evicted_cap,
+            }
+
+
+JOB_REGISTRY = JobRegistry(JOB_REGISTRY_MAX_JOBS, JOB_RETENTION_SECONDS)
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.cache import TTLCache
+
+
+TEXT_CACHE_ENABLED = os.getenv("TEXT_CACHE_ENABLED", "true").lower() == "true"
+TEXT_CACHE_TTL_SECONDS = int(os.getenv("TEXT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+TEXT_CACHE_MEMORY_ENTRIES = int(os.getenv("TEXT_CACHE_MEMORY_ENTRIES", "512"))
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", ".cache/text")
+TEXT_CACHE_DISK_MAX_MB = int(os.getenv("TEXT_CACHE_DISK_MAX_MB", "256"))
+
+
+def make_key(model_id: str, body: Dict[str, Any]) -> str:
+    """
+    Key over the model id and the full request body (rendered prompt,
+    temperature, maxTokens, ...). sort_keys makes it stable across dict order.
+    """
+    canonical = json.dumps({"modelId": model_id, "body": body}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class TextResponseCache:
+    """
+    Two-tier cache for text model completions:
+    - memory: LRU (TTLCache)
+    - disk: one JSON file per key under TEXT_CACHE_DIR, evicted by TTL and total size
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, memory_entries: int, disk_max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_bytes = disk_max_bytes
+        self.memory = TTLCache(max_entries=memory_entries, ttl_seconds=ttl_seconds)
+        self._disk_lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None  # computed lazily
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.disk_evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        text = self.memory.get(key)
+        if text is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return text
+
+        text = self._disk_get(key)
+        if text is not None:
+            self.memory.set(key, text)
+            self.hits += 1
+            self.disk_hits += 1
+            return text
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, text: str) -> None:
+        self.memory.set(key, text)
+        self._disk_set(key, text)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            self._remove(path)
+            return None
+        return entry.get("text")
+
+    def _disk_set(self, key: str, text: str) -> None:
+        path = self._path(key)
+        data = json.dumps({"created_at": time.time(), "text": text}, ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"WARNING: text cache write failed: {e}", flush=True)
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_size()
+            else:
+                self._disk_bytes += len(data.encode("utf-8"))
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _scan_size(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _evict_disk(self) -> None:
+        # Drop expired entries first, then oldest until we're back under 90% of the cap
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl_seconds:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        self._disk_bytes = total
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+            self.disk_evictions += 1
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": TEXT_CACHE_ENABLED,
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "disk_bytes": self._disk_bytes,
+            "disk_evictions": self.disk_evictions,
+            "memory": self.memory.stats(),
+        }
+
+
+TEXT_CACHE = TextResponseCache(
+    directory=TEXT_CACHE_DIR,
+    ttl_seconds=TEXT_CACHE_TTL_SECONDS,
+    memory_entries=TEXT_CACHE_MEMORY_ENTRIES,
+    disk_max_bytes=TEXT_CACHE_DISK_MAX_MB * 1024 * 1024,
+)
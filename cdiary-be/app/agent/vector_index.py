@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+from sqlalchemy.future import select
+
+from app.models.models import DiaryChunk, DiaryChunkEmbedding
+
+
+VECTOR_INDEX_BUDGET_MB = int(os.getenv("VECTOR_INDEX_BUDGET_MB", "128"))
+
+# (chunk_id, diary_id, vector)
+EmbeddingRow = Tuple[str, str, List[float]]
+
+
+class UserVectorIndex:
+    """
+    One user's chunk embeddings as a contiguous, L2-normalized float32 matrix,
+    plus the row -> diary mapping. Search is a single matrix-vector product.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._diary_codes = np.zeros(0, dtype=np.int32)
+        self._diary_ids: List[str] = []            # code -> diary id
+        self._diary_code: Dict[str, int] = {}      # diary id -> code
+        self._chunk_ids: set = set()
+
+    @property
+    def rows(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._matrix.nbytes + self._diary_codes.nbytes
+
+    def add(self, rows: Iterable[EmbeddingRow]) -> int:
+        fresh = [r for r in rows if r[0] not in self._chunk_ids and len(r[2]) == self.dim]
+        if not fresh:
+            return 0
+
+        vecs = np.asarray([r[2] for r in fresh], dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vecs /= norms
+
+        codes = np.empty(len(fresh), dtype=np.int32)
+        for i, (chunk_id, diary_id, _) in enumerate(fresh):
+            code = self._diary_code.get(diary_id)
+            if code is None:
+                code = len(self._diary_ids)
+                self._diary_ids.append(diary_id)
+                self._diary_code[diary_id] = code
+            codes[i] = code
+            self._chunk_ids.add(chunk_id)
+
+        # Grow geometrically so incremental adds stay amortized O(1) per row
+        needed = self._size + len(fresh)
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2, 16)
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            diary_codes = np.zeros(capacity, dtype=np.int32)
+            diary_codes[:self._size] = self._diary_codes[:self._size]
+            self._matrix, self._diary_codes = matrix, diary_codes
+
+        self._matrix[self._size:needed] = vecs
+        self._diary_codes[self._size:needed] = codes
+        self._size = needed
+        return len(fresh)
+
+    def remove_diary(self, diary_id: str) -> None:
+        code = self._diary_code.get(diary_id)
+        if code is None:
+            return
+        keep = self._diary_codes[:self._size] != code
+        self._matrix = self._matrix[:self._size][keep].copy()
+        self._diary_codes = self._diary_codes[:self._size][keep].copy()
+        self._size = self._matrix.shape[0]
+        # The code stays reserved (no rows point to it any more); chunk ids of
+        # the removed diary are unknown here, which is fine since they're gone.
+
+    def search(self, query: List[float], k: int, threshold: float) -> List[Tuple[str, float]]:
+        """
+        Top-k diaries by their best-matching chunk (cosine similarity > threshold).
+        """
+        if self._size == 0 or len(query) != self.dim:
+            return []
+
+        q = np.asarray(query, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+        scores = self._matrix[:self._size] @ (q / q_norm)
+
+        best = np.full(len(self._diary_ids), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self._diary_codes[:self._size], scores)
+
+        candidates = np.flatnonzero(best > threshold)
+        if candidates.size > k:
+            top = np.argpartition(best[candidates], -k)[-k:]
+            candidates = candidates[top]
+        order = candidates[np.argsort(best[candidates])[::-1]]
+        return [(self._diary_ids[i], float(best[i])) for i in order]
+
+
+class VectorIndexRegistry:
+    """
+    Lazily built per-user indexes, kept under a shared memory budget (LRU).
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._indexes: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+        self._building: Dict[str, List[EmbeddingRow]] = {}
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+
+    async def get_or_build(self, db, user_id: str) -> UserVectorIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                self.hits += 1
+                return index
+
+        lock = self._build_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is not None:
+                    return index
+                # Embeddings completed while we read from the DB are buffered here
+                self._building[user_id] = []
+            try:
+                rows = await _load_rows(db, user_id)
+            except Exception:
+                with self._lock:
+                    self._building.pop(user_id, None)
+                raise
+
+            with self._lock:
+                rows.extend(self._building.pop(user_id, []))
+                index = _build_index(rows)
+                self._indexes[user_id] = index
+                self.builds += 1
+                self._enforce_budget()
+            return index
+
+    def add_embeddings(self, user_id: str, rows: List[EmbeddingRow]) -> None:
+        """Incremental update; no-op for users without a loaded index."""
+        with self._lock:
+            if user_id in self._building:
+                self._building[user_id].extend(rows)
+                return
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            if index.dim == 0:
+                index = _build_index(rows)
+                self._indexes[user_id] = index
+            else:
+                index.add(rows)
+            self._enforce_budget()
+
+    def remove_diary(self, user_id: str, diary_id: str) -> None:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.remove_diary(diary_id)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def _enforce_budget(self) -> None:
+        total = sum(i.nbytes for i in self._indexes.values())
+        # Always keep the most recently used index, even if it alone exceeds the budget
+        while total > self.budget_bytes and len(self._indexes) > 1:
+            _, evicted = self._indexes.popitem(last=False)
+            total -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._indexes),
+                "rows": sum(i.rows for i in self._indexes.values()),
+                "bytes": sum(i.nbytes for i in self._indexes.values()),
+                "budget_bytes": self.budget_bytes,
+                "builds": self.builds,
+                "hits": self.hits,
+                "evictions": self.evictions,
+            }
+
+
+def _build_index(rows: List[EmbeddingRow]) -> UserVectorIndex:
+    if not rows:
+        return UserVectorIndex(dim=0)
+    # Use the most common dimensionality (older rows may come from another model config)
+    dims: Dict[int, int] = {}
+    for _, _, vec in rows:
+        dims[len(vec)] = dims.get(len(vec), 0) + 1
+    index = UserVectorIndex(dim=max(dims, key=dims.get))
+    index.add(rows)
+    return index
+
+
+async def _load_rows(db, user_id: str) -> List[EmbeddingRow]:
+    stmt = select(
+        DiaryChunk.id, DiaryChunk.diary_id, DiaryChunkEmbedding.embedding_vector
+    ).join(
+        DiaryChunkEmbedding, DiaryChunk.id == DiaryChunkEmbedding.chunk_id
+    ).where(DiaryChunk.user_id == uuid.UUID(user_id))
+    result = await db.execute(stmt)
+    return [(str(chunk_id), str(diary_id), vec) for chunk_id, diary_id, vec in result.all() if vec]
+
+
+VECTOR_INDEX = VectorIndexRegistry(VECTOR_INDEX_BUDGET_MB * 1024 * 1024)
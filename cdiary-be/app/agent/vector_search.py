@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from .bedrock import EMBEDDING_DIMENSIONS
+
+
+# "auto": use pgvector when the extension is available, else the in-memory index
+# "pgvector": same as auto but logs loudly when unavailable
+# "memory": never use pgvector
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "auto").lower()
+# Chunks fetched per requested diary (a diary has one chunk per panel)
+PGVECTOR_CHUNK_OVERSAMPLE = int(os.getenv("PGVECTOR_CHUNK_OVERSAMPLE", "4"))
+
+_state: Dict[str, Any] = {"enabled": False, "reason": "not initialized", "iterative_scan": False}
+
+
+def pgvector_enabled() -> bool:
+    return _state["enabled"]
+
+
+def pgvector_iterative_scan() -> bool:
+    """pgvector >= 0.8 keeps scanning the HNSW graph until the user filter has enough rows."""
+    return _state["iterative_scan"]
+
+
+def backend_info() -> Dict[str, Any]:
+    return {"backend": "pgvector" if _state["enabled"] else "memory", "dimensions": EMBEDDING_DIMENSIONS, **_state}
+
+
+async def _try(conn, sql: str, **params) -> bool:
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text(sql), params)
+        return True
+    except Exception as e:
+        print(f"DEBUG: pgvector setup statement failed: {e}", flush=True)
+        return False
+
+
+async def ensure_pgvector_schema(conn) -> bool:
+    """
+    Startup hook: makes diary_chunk_embeddings searchable in Postgres.
+    Adds a `vector(EMBEDDING_DIMENSIONS)` column and the user_id filter column
+    next to the JSON copy the ORM writes, creates the HNSW cosine index and
+    backfills rows embedded before this existed.
+    """
+    if VECTOR_SEARCH_BACKEND == "memory":
+        _state.update(enabled=False, reason="disabled by VECTOR_SEARCH_BACKEND")
+        return False
+    if conn.dialect.name != "postgresql":
+        _state.update(enabled=False, reason=f"dialect {conn.dialect.name}")
+        return False
+
+    await _try(conn, "CREATE EXTENSION IF NOT EXISTS vector")
+    has_ext = (await conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'"))).first()
+    if not has_ext:
+        _state.update(enabled=False, reason="vector extension not installed")
+        print("WARNING: pgvector not available, using in-memory vector index", flush=True)
+        return False
+
+    dims = EMBEDDING_DIMENSIONS
+    await _try(conn, f"ALTER TABLE diary_chunk_embeddings ADD COLUMN IF NOT EXISTS embedding vector({dims})")
+    await _try(conn, "ALTER TABLE diary_chunk_embeddings ADD COLUMN IF NOT EXISTS user_id UUID")
+
+    # An `embedding` column created with another size (e.g. the old 1536 DDL) can't be used
+    typmod = (await conn.execute(text(
+        "SELECT atttypmod FROM pg_attribute "
+        "WHERE attrelid = 'diary_chunk_embeddings'::regclass AND attname = 'embedding'"
+    ))).scalar()
+    if typmod != dims:
+        _state.update(enabled=False, reason=f"embedding column is vector({typmod}), expected vector({dims})")
+        print(f"WARNING: {_state['reason']}; using in-memory vector index", flush=True)
+        return False
+
+    version = (await conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))).scalar()
+    _state["iterative_scan"] = _version_tuple(version) >= (0, 8)
+
+    await _try(conn, "CREATE INDEX IF NOT EXISTS idx_embeddings_vector ON diary_chunk_embeddings USING hnsw (embedding vector_cosine_ops)")
+    await _try(conn, "CREATE INDEX IF NOT EXISTS idx_embeddings_user ON diary_chunk_embeddings(user_id)")
+
+    # Backfill rows that only have the JSON copy
+    await _try(conn, _SYNC_SQL + " AND e.embedding IS NULL", dims=dims)
+
+    _state.update(enabled=True, reason="ok")
+    print(f"pgvector enabled (vector({dims}), HNSW cosine, version {version})", flush=True)
+    return True
+
+
+def _version_tuple(version: Any) -> Tuple[int, ...]:
+    try:
+        return tuple(int(part) for part in str(version).split(".")[:2])
+    except ValueError:
+        return (0,)
+
+
+# JSON arrays print as '[0.1, 0.2, ...]', which is also a valid vector literal
+_SYNC_SQL = (
+    "UPDATE diary_chunk_embeddings e "
+    "SET embedding = CAST(e.embedding_vector::text AS vector), user_id = c.user_id "
+    "FROM diary_chunks c "
+    "WHERE c.id = e.chunk_id AND json_array_length(e.embedding_vector::json) = :dims"
+)
+
+
+async def sync_vectors(db, chunk_ids: List[uuid.UUID]) -> None:
+    """
+    Fills the vector column for freshly inserted embeddings (same session/transaction).
+    """
+    if not pgvector_enabled() or not chunk_ids:
+        return
+    await db.execute(
+        text(_SYNC_SQL + " AND e.chunk_id = ANY(CAST(:ids AS uuid[]))"),
+        {"dims": EMBEDDING_DIMENSIONS, "ids": [str(c) for c in chunk_ids]},
+    )
+
+
+async def pgvector_search(db, user_id: str, query: List[float], k: int, threshold: float) -> Optional[List[Tuple[str, float]]]:
+    """
+    Top-k diaries by best chunk cosine similarity, computed in Postgres:
+    ORDER BY embedding <=> :q LIMIT n, filtered to the user.
+    Returns [(diary_id, score)] like UserVectorIndex.search, or None when,
+    without iterative scans, the scan came back with fewer than n rows: the
+    user filter may then have dropped rows the approximate scan never
+    returned, and callers fall back to the in-memory index.
+    """
+    n_chunks = max(k * PGVECTOR_CHUNK_OVERSAMPLE, 40)
+    # The HNSW scan returns at most ef_search candidates before the user filter applies
+    await db.execute(text(f"SET LOCAL hnsw.ef_search = {min(n_chunks, 1000)}"))
+    if pgvector_iterative_scan():
+        # ...unless it may keep scanning until LIMIT rows pass the filter; the
+        # relaxed order is fine since scores are re-sorted per diary below
+        await db.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+
+    q = json.dumps([float(x) for x in query])
+    rows = (await db.execute(
+        text(
+            "SELECT c.diary_id, 1 - (e.embedding <=> CAST(CAST(:q AS text) AS vector)) AS score "
+            "FROM diary_chunk_embeddings e "
+            "JOIN diary_chunks c ON c.id = e.chunk_id "
+            "WHERE e.user_id = CAST(:uid AS uuid) AND e.embedding IS NOT NULL "
+            "ORDER BY e.embedding <=> CAST(CAST(:q AS text) AS vector) "
+            "LIMIT :n"
+        ),
+        {"q": q, "uid": str(uuid.UUID(user_id)), "n": n_chunks},
+    )).all()
+    if len(rows) < n_chunks and not pgvector_iterative_scan():
+        return None
+
+    best: Dict[str, float] = {}
+    for diary_id, score in rows:
+        d_id = str(diary_id)
+        if score > threshold and score > best.get(d_id, -1.0):
+            best[d_id] = float(score)
+    return sorted(best.items(), key=lambda x: x[1], reverse=True)[:k]
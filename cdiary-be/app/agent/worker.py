@@ -1,10 +1,10 @@
 from __future__ import annotations
 import uuid
+import random
 import datetime
 import asyncio
-import boto3
 import traceback
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy.future import select
 from sqlalchemy import delete
 
@@ -12,10 +12,18 @@ from app.database import AsyncSessionLocal
 from app.models.models import User, Diary, DiaryChunk
 from app.routers.jobs import update_job, JobStatus
 
-from .graph import run_job_async
+from .graph import run_job_async, build_cut_prompt, DEFAULT_SEED
+from .checkpoint import CHECKPOINTS
 from .models import OrchestrationState, DiaryEntryRequest
-from .bedrock import S3_BUCKET, upload_bytes_to_s3
-from app.utils.image import combine_images_vertically # Will create this utility
+from .bedrock import S3_BUCKET, RENDER_CACHE, upload_bytes_to_s3, invoke_image_model_to_s3, _s3
+from .blob_store import PANEL_BLOBS
+from .embeddings import process_pending_embeddings, backfill_diary_embeddings, run_in_background
+from .search_cache import SEARCH_RESULTS
+from .vector_index import VECTOR_INDEX
+from app.utils.image import (
+    combine_images_vertically, make_derivatives, derivative_format,
+    parse_derivative_specs, STRIP_DERIVATIVES, PANEL_DERIVATIVES,
+)
 
 # Re-export execute_job for cleaner imports if needed, but here we define the main logic
 
@@ -38,6 +46,8 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
                 
                 if existing_diary:
                     db_diary = existing_diary
+                    if db_diary.content != request.diaryText:
+                        db_diary.content_embedding = None
                     db_diary.content = request.diaryText
                     db_diary.mood = request.mood
                     db_diary.style_preset = request.stylePreset
@@ -58,6 +68,9 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
                 await db.commit()
                 await db.refresh(db_diary)
                 diary_id = str(db_diary.id)
+                if existing_diary:
+                    # The cleared chunks' vectors must not keep matching searches
+                    VECTOR_INDEX.remove_diary(user_id, diary_id)
                 
             # Associate job with artifact immediately
             update_job(job_id, artifact_id=diary_id)
@@ -66,6 +79,7 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
         # 2. Fetch User Profile (if available) for consistency
         profile_ref_bytes = None
         profile_prompt = None
+        profile_seed = None
         async with AsyncSessionLocal() as db:
             try:
                 stmt_user = select(User).where(User.id == user_id)
@@ -76,7 +90,7 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
                     profile_prompt = user_obj.profile_prompt
                     profile_seed = user_obj.seed
                     if user_obj.profile_image_s3_key:
-                        s3 = boto3.client("s3")
+                        s3 = _s3()
                         if S3_BUCKET:
                              obj = s3.get_object(Bucket=S3_BUCKET, Key=user_obj.profile_image_s3_key)
                              profile_ref_bytes = obj["Body"].read()
@@ -111,14 +125,17 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
             style_guide=style_guide,
             max_retries=2,
             trace_id=trace_id,
-            profile_image=profile_ref_bytes,
             profile_prompt=profile_prompt,
-            seed=profile_seed
+            # "Regenerate" asks for a different picture, not the cached one
+            seed=profile_seed if request.useCache else random.randint(0, _MAX_SEED),
+            use_cache=request.useCache
         )
 
         # 4. Run the Graph (Agent)
         # The graph updates job progress/status internally via update_job
-        final_state = await run_job_async(initial_state)
+        # The profile image is loaded again on every run (also a resumed one)
+        # and kept out of the checkpointed state
+        final_state = await run_job_async(initial_state, profile_image=profile_ref_bytes)
         
         # Determine if final_state is a dict (LangGraph behavior) and convert back to object
         if isinstance(final_state, dict):
@@ -140,9 +157,11 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
             if not db_diary:
                 # Should not happen unless deleted
                 print(f"CRITICAL: Diary {diary_id} disappeared during generation")
+                update_job(job_id, JobStatus.FAILED, "Diary was deleted", 100, error="Diary disappeared during generation")
                 return
 
-            # Save Chunks
+            # Save Chunks (replacing those of an earlier run, e.g. a resumed job)
+            await db.execute(delete(DiaryChunk).where(DiaryChunk.diary_id == db_diary.id))
             panel_images_bytes = []
             
             # Ensure images are sorted by cut_index
@@ -156,24 +175,21 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
                             return c.scene # or summary/dialogue?
                 return ""
 
-            for img in sorted_images:
-                # We need to fetch the image bytes again? 
-                # The graph saved to S3 and returned URLs.
-                # To compose the strip, we need bytes.
-                # Alternatively, we could have carried bytes in state but state size might be large.
-                # Let's fetch from S3 or if we modifying graph to allow returning bytes?
-                # For now, let's download from S3 using the key in meta.
-                
-                img_bytes = None
+            # Panel bytes come from the in-memory handoff; only misses
+            # (render cache hits, restarts) are downloaded, concurrently.
+            panel_bytes_list = await asyncio.gather(*[
+                _load_panel_bytes(job_id, img.meta.get("s3_key")) for img in sorted_images
+            ])
+
+            panel_variants = await asyncio.gather(*[
+                asyncio.to_thread(store_panel_derivatives, user_id, diary_id, img.cut_index, img_bytes)
+                for img, img_bytes in zip(sorted_images, panel_bytes_list)
+            ])
+
+            for img, img_bytes, variants in zip(sorted_images, panel_bytes_list, panel_variants):
                 s3_key = img.meta.get("s3_key")
-                if s3_key:
-                     s3 = boto3.client("s3")
-                     try:
-                        obj = s3.get_object(Bucket=S3_BUCKET, Key=s3_key)
-                        img_bytes = obj["Body"].read()
-                        panel_images_bytes.append(img_bytes)
-                     except Exception as e:
-                         print(f"Failed to download image for composition: {e}")
+                if img_bytes:
+                    panel_images_bytes.append(img_bytes)
                 
                 chunk = DiaryChunk(
                     diary_id=db_diary.id,
@@ -185,33 +201,211 @@ async def execute_job(job_id: str, user_id: str, request: DiaryEntryRequest, art
                     metadata_={
                         "image_s3_key": s3_key,
                         "image_url": img.image_url,
+                        "image_variants": variants or None,
                         "source": img.meta.get("source")
                     }
                 )
                 db.add(chunk)
             
+            # What single-panel regeneration needs to redo one cut without the text model
+            db_diary.generation_plan = generation_plan(final_state)
             await db.commit()
 
-            # Trigger background task for embeddings
-            # Import inline to avoid circular dependency with app.routers.diary
-            from app.routers.diary import process_pending_embeddings
-            asyncio.create_task(process_pending_embeddings(user_id))
+            # New panels/content: cached search results for this user are stale,
+            # and the replaced chunks' vectors go until the new ones are embedded
+            VECTOR_INDEX.remove_diary(user_id, diary_id)
+            SEARCH_RESULTS.invalidate_user(user_id)
 
-            # 6. Compose Strip
-            if panel_images_bytes:
-                final_strip_bytes = combine_images_vertically(panel_images_bytes)
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                final_key = f"diary/{user_id}/{diary_id}/strip_{timestamp}.png"
-                
-                if S3_BUCKET:
-                    upload_bytes_to_s3(S3_BUCKET, final_key, final_strip_bytes, "image/png")
-                    db_diary.image_s3_key = final_key
-                    await db.commit()
+            # Trigger background tasks for embeddings (panel chunks + diary content)
+            run_in_background(process_pending_embeddings(user_id))
+            run_in_background(backfill_diary_embeddings(user_id))
+
+            # 6. Compose Strip (+ list/preview derivatives)
+            if panel_images_bytes and S3_BUCKET:
+                final_key, variants = await asyncio.to_thread(
+                    compose_and_store_strip, user_id, diary_id, panel_images_bytes
+                )
+                db_diary.image_s3_key = final_key
+                db_diary.image_variants = variants or None
+                await db.commit()
             
             # 7. Done
             update_job(job_id, JobStatus.DONE, "Ready!", 100, artifact_id=diary_id)
+            await asyncio.to_thread(CHECKPOINTS.delete, job_id)
             print(f"[{job_id}] Execution complete. Artifact: {diary_id}")
 
     except Exception as e:
         traceback.print_exc()
         update_job(job_id, JobStatus.FAILED, "Execution failed", 0, error=str(e))
+    finally:
+        PANEL_BLOBS.release(job_id)
+
+
+def generation_plan(state: OrchestrationState) -> Dict[str, Any]:
+    return {
+        "storyboard": state.storyboard.model_dump() if state.storyboard else None,
+        "prompts": [p.model_dump() for p in state.prompts],
+        "style_guide": state.style_guide,
+        "seed": state.seed if state.seed is not None else DEFAULT_SEED,
+    }
+
+
+class PanelRegenerationError(Exception):
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Nova Canvas accepts seeds in [0, 858993459]
+_MAX_SEED = 858993459
+
+
+async def regenerate_panel(user_id: str, diary_id: str, cut_index: int,
+                           prompt: Optional[str] = None, seed: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Re-renders one cut of a finished diary from its stored generation plan
+    (optionally with an edited prompt) and recomposes the strip from the other
+    panels already in S3: one image call, no text calls.
+
+    An unchanged prompt is rendered with a new random seed, since the same
+    prompt and seed would come straight back from the render cache.
+    Returns {"cutIndex", "prompt", "seed"}.
+    """
+    if not S3_BUCKET:
+        raise PanelRegenerationError("Image storage is not configured", status_code=503)
+
+    # Read what we need and let the session go before the (slow) image call
+    async with AsyncSessionLocal() as db:
+        db_diary = await db.get(Diary, uuid.UUID(diary_id))
+        if not db_diary:
+            raise PanelRegenerationError("Diary not found", status_code=404)
+        plan = db_diary.generation_plan
+        stmt = select(DiaryChunk.chunk_index, DiaryChunk.metadata_).where(DiaryChunk.diary_id == db_diary.id)
+        panel_keys = {idx: (meta or {}).get("image_s3_key") for idx, meta in (await db.execute(stmt)).all()}
+
+    if not plan:
+        raise PanelRegenerationError("This diary has no stored storyboard; regenerate the whole comic instead")
+    if cut_index not in panel_keys:
+        raise PanelRegenerationError(f"Panel {cut_index} not found", status_code=404)
+
+    stored = {p["cut_index"]: p["prompt"] for p in plan.get("prompts") or []}.get(cut_index)
+    new_prompt = (prompt or "").strip() or stored
+    if not new_prompt:
+        raise PanelRegenerationError(f"No stored prompt for panel {cut_index}; pass one")
+    if seed is None:
+        seed = plan.get("seed", DEFAULT_SEED) if new_prompt != stored else random.randint(0, _MAX_SEED)
+
+    storyboard = plan.get("storyboard") or {}
+    out = await asyncio.to_thread(
+        invoke_image_model_to_s3,
+        cut_prompt=build_cut_prompt(new_prompt, storyboard.get("character_appearance"), plan.get("style_guide") or ""),
+        job_id=f"regen-{diary_id}",
+        cut_index=cut_index,
+        seed=seed,
+    )
+    new_bytes = out.img_bytes or await asyncio.to_thread(_download_s3_bytes, out.s3_key)
+
+    # The other panels as they are now
+    others = sorted(i for i in panel_keys if i != cut_index)
+    other_bytes = await asyncio.gather(*[_download_panel_bytes(panel_keys[i]) for i in others])
+    missing = [i for i, b in zip(others, other_bytes) if not b]
+    if missing:
+        raise PanelRegenerationError(f"Could not load panels {missing} to recompose the strip", status_code=502)
+    by_index = dict(zip(others, other_bytes))
+    by_index[cut_index] = new_bytes
+
+    variants, (final_key, strip_variants) = await asyncio.gather(
+        asyncio.to_thread(store_panel_derivatives, user_id, diary_id, cut_index, new_bytes),
+        asyncio.to_thread(compose_and_store_strip, user_id, diary_id, [by_index[i] for i in sorted(by_index)]),
+    )
+
+    async with AsyncSessionLocal() as db:
+        db_diary = await db.get(Diary, uuid.UUID(diary_id))
+        stmt = select(DiaryChunk).where((DiaryChunk.diary_id == uuid.UUID(diary_id)) & (DiaryChunk.chunk_index == cut_index))
+        target = (await db.execute(stmt)).scalars().first()
+        if not db_diary or target is None:
+            raise PanelRegenerationError("Diary changed during regeneration", status_code=409)
+
+        # JSON columns: assign new objects so the change is detected
+        target.metadata_ = {
+            **(target.metadata_ or {}),
+            "image_s3_key": out.s3_key,
+            "image_url": out.url,
+            "image_variants": variants or None,
+            "source": "bedrock_regen",
+            "seed": seed,
+        }
+        prompts = [p for p in (db_diary.generation_plan or plan).get("prompts") or [] if p["cut_index"] != cut_index]
+        prompts.append({"cut_index": cut_index, "prompt": new_prompt})
+        db_diary.generation_plan = {**(db_diary.generation_plan or plan), "prompts": sorted(prompts, key=lambda p: p["cut_index"])}
+        db_diary.image_s3_key = final_key
+        db_diary.image_variants = strip_variants or None
+        await db.commit()
+
+    # Thumbnails in cached search results point at the old strip
+    SEARCH_RESULTS.invalidate_user(user_id)
+    print(f"Regenerated panel {cut_index} of diary {diary_id} (seed={seed})", flush=True)
+    return {"cutIndex": cut_index, "prompt": new_prompt, "seed": seed}
+
+
+def compose_and_store_strip(user_id: str, diary_id: str, panel_images_bytes: List[bytes]) -> Tuple[str, Dict[str, str]]:
+    """
+    Combines panels into the final PNG strip, uploads it with its derivatives
+    (STRIP_DERIVATIVES) and returns (strip_key, {derivative name: key}).
+    """
+    final_strip_bytes = combine_images_vertically(panel_images_bytes)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_key = f"diary/{user_id}/{diary_id}/strip_{timestamp}"
+    final_key = f"{base_key}.png"
+    upload_bytes_to_s3(S3_BUCKET, final_key, final_strip_bytes, "image/png")
+
+    variants = _upload_derivatives(base_key, final_strip_bytes, parse_derivative_specs(STRIP_DERIVATIVES))
+    return final_key, variants
+
+
+def store_panel_derivatives(user_id: str, diary_id: str, cut_index: int, img_bytes: Optional[bytes]) -> Dict[str, str]:
+    if not img_bytes or not S3_BUCKET:
+        return {}
+    base_key = f"diary/{user_id}/{diary_id}/panel-{cut_index:02d}-{uuid.uuid4().hex[:8]}"
+    return _upload_derivatives(base_key, img_bytes, parse_derivative_specs(PANEL_DERIVATIVES))
+
+
+def _upload_derivatives(base_key: str, image_bytes: bytes, specs) -> Dict[str, str]:
+    _, ext, content_type = derivative_format()
+    variants: Dict[str, str] = {}
+    try:
+        for name, data in make_derivatives(image_bytes, specs).items():
+            key = f"{base_key}_{name}.{ext}"
+            upload_bytes_to_s3(S3_BUCKET, key, data, content_type)
+            variants[name] = key
+    except Exception as e:
+        # Derivatives are an optimization; the original is always there
+        print(f"Failed to create derivatives for {base_key}: {e}", flush=True)
+    return variants
+
+
+def _download_s3_bytes(s3_key: str) -> bytes:
+    obj = _s3().get_object(Bucket=S3_BUCKET, Key=s3_key)
+    return obj["Body"].read()
+
+
+async def _load_panel_bytes(job_id: str, s3_key: Optional[str]) -> Optional[bytes]:
+    if not s3_key:
+        return None
+    img_bytes = PANEL_BLOBS.get(job_id, s3_key)
+    if img_bytes is not None:
+        return img_bytes
+    return await _download_panel_bytes(s3_key)
+
+
+async def _download_panel_bytes(s3_key: Optional[str]) -> Optional[bytes]:
+    # Panels of a saved diary (no job, so nothing in PANEL_BLOBS)
+    if not s3_key:
+        return None
+    try:
+        return await asyncio.to_thread(_download_s3_bytes, s3_key)
+    except Exception as e:
+        print(f"Failed to download image for composition: {e}")
+        # A render cache object that expired under us must not be handed out again
+        RENDER_CACHE.evict_key(s3_key)
+        return None
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, Date, ForeignKey, Text, JSON
+from sqlalchemy import Column, String, Integer, Float, DateTime, Boolean, Date, ForeignKey, Text, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, JSONB, ARRAY, REAL
 from sqlalchemy.orm import relationship, Mapped, mapped_column
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.database import Base
 import uuid
 import datetime
@@ -74,13 +74,16 @@ class Diary(Base):
     
     diary_date = Column(Date, nullable=False)
     content = Column(Text, nullable=False)
-    content_embedding = Column(JSON, nullable=True) # Used for simple vector search
+    # none_as_null: assigning None must store SQL NULL (not JSON 'null') so the backfill finds the row
+    content_embedding = Column(JSON(none_as_null=True), nullable=True) # Used for simple vector search
     image_s3_key = Column(Text)
+    image_variants = Column(JSON, nullable=True) # {"thumb": key, "medium": key, "full": key} derivatives of image_s3_key
     
     # Generation parameters for regeneration
     mood = Column(Text)
     style_preset = Column(String(50))
     generation_options = Column(JSON)
+    generation_plan = Column(JSON, nullable=True) # {"storyboard", "prompts", "style_guide", "seed"} for single-panel regeneration
     
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -88,6 +91,12 @@ class Diary(Base):
     user = relationship("User", back_populates="diaries")
     chunks = relationship("DiaryChunk", back_populates="diary", cascade="all, delete-orphan")
 
+    # Keyset pagination: GET /api/diary/user/{id} (diary_date, id) and GET /api/artifacts (created_at, id)
+    __table_args__ = (
+        Index("idx_diaries_user_date_id", "user_id", diary_date.desc(), id.desc()),
+        Index("idx_diaries_user_created_id", "user_id", created_at.desc(), id.desc()),
+    )
+
 # Note: Vector type is specific to pgvector. For SQLite compatibility, we might need a workaround or omit embedding logic if using SQLite.
 # For now, defining the structure.
 
@@ -120,10 +129,55 @@ class DiaryChunkEmbedding(Base):
 
     id = Column(GUID(), primary_key=True, default=uuid.uuid4)
     chunk_id = Column(GUID(), ForeignKey("diary_chunks.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(GUID(), nullable=True) # Denormalized for the pgvector user filter
     
     # Large embedding vector stored as JSON or ARRAY for flexibility
+    # On Postgres with pgvector, a `vector` column `embedding` is filled from this
+    # (see app/agent/vector_search.py); it is not mapped here to keep SQLite working.
     embedding_vector = Column(JSON, nullable=False) 
     
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     chunk = relationship("DiaryChunk", back_populates="embeddings")
+
+
+class GenerationJob(Base):
+    """
+    Durable copy of a comic generation job (JOB_BACKEND=postgres, see app/agent/job_backend.py).
+    Consumers claim rows with FOR UPDATE SKIP LOCKED and hold them for a lease
+    (locked_until); an expired lease makes the job claimable again.
+    """
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(32), primary_key=True) # jobId (uuid4 hex)
+    user_id = Column(GUID(), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    artifact_id = Column(GUID(), nullable=True)
+
+    status = Column(String(32), nullable=False, default='QUEUED')
+    step = Column(Text)
+    progress = Column(Float, default=0.0)
+    error = Column(Text)
+    failed_cuts = Column(JSON(none_as_null=True)) # cut indexes that failed to render
+
+    payload = Column(JSON, nullable=False) # DiaryEntryRequest
+    idempotency_key = Column(String(128)) # Idempotency-Key header, if the client sent one
+    dedupe_key = Column(String(64)) # diary date + content hash, see app/agent/coalesce.py
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    locked_by = Column(String(64))
+    locked_until = Column(DateTime(timezone=True))
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("idx_generation_jobs_claim", "status", "created_at"),
+        Index("idx_generation_jobs_user", "user_id"),
+        Index("uq_generation_jobs_idempotency", "user_id", "idempotency_key", unique=True),
+        # One unfinished job per identical submission
+        Index(
+            "uq_generation_jobs_inflight", "user_id", "dedupe_key", unique=True,
+            postgresql_where=text("status NOT IN ('DONE', 'SUCCEEDED', 'FAILED')"),
+            sqlite_where=text("status NOT IN ('DONE', 'SUCCEEDED', 'FAILED')"),
+        ),
+    )
@@ -1,19 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 import datetime
+import uuid
 
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from app.models.models import Diary, DiaryChunk
-from app.agent.bedrock import make_access_url, S3_BUCKET
+from app.agent.bedrock import make_access_url, make_access_urls, S3_BUCKET
 from app.auth.security import get_current_user
+from app.utils.image import pick_variant_key
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.agent.vector_index import VECTOR_INDEX
+from app.agent.job_backend import JOB_BACKEND
+from app.agent.worker import regenerate_panel, PanelRegenerationError
 
 router = APIRouter()
 
 class Panel(BaseModel):
     text: str
+    cutIndex: Optional[int] = None
+    prompt: Optional[str] = None
 
 class Storyboard(BaseModel):
     panels: List[Panel]
@@ -21,6 +29,10 @@ class Storyboard(BaseModel):
 class ArtifactUpdateRequest(BaseModel):
     diaryText: str
 
+class PanelRegenerateRequest(BaseModel):
+    prompt: Optional[str] = Field(default=None, max_length=600)
+    seed: Optional[int] = Field(default=None, ge=0, le=858993459)
+
 class ArtifactResponse(BaseModel):
     artifactId: str
     finalStripUrl: str
@@ -33,21 +45,51 @@ class ArtifactResponse(BaseModel):
     mood: Optional[str] = None
     options: Optional[Dict[str, Any]] = None
 
-import math
-from app.agent.bedrock import get_embedding
+import asyncio
+from sqlalchemy import func
+from app.agent.search_cache import SEARCH_RESULTS, get_query_embedding
+from app.agent.embeddings import backfill_diary_embeddings, process_pending_embeddings, run_in_background
+from app.agent.lexical_search import lexical_search
+from app.agent.vector_search import pgvector_enabled, pgvector_search
+
 
-def cosine_similarity(v1: List[float], v2: List[float]) -> float:
-    dot = sum(a*b for a, b in zip(v1, v2))
-    n1 = math.sqrt(sum(a*a for a in v1))
-    n2 = math.sqrt(sum(b*b for b in v2))
-    if n1 == 0 or n2 == 0: return 0.0
-    return dot / (n1 * n2)
+async def search_artifacts(db: AsyncSession, user_id: str, query: str, limit: int) -> List[Diary]:
+    """
+    Diaries best matching `query`, scored by pgvector or the user's in-memory
+    chunk index (as diary search does); only the hits are loaded.
+    """
+    q_emb = await asyncio.to_thread(get_query_embedding, query)
+    if not q_emb:
+        raise ValueError("query embedding failed")
+
+    hits = None
+    if pgvector_enabled():
+        try:
+            hits = await pgvector_search(db, user_id, q_emb, k=limit, threshold=0.25)
+        except Exception as e:
+            print(f"WARNING: pgvector search failed, using in-memory index: {e}", flush=True)
+            await db.rollback()
+    if hits is None:
+        index = await VECTOR_INDEX.get_or_build(db, user_id)
+        # A threshold of 0.25 is usually good for Amazon Titan Text Embeddings
+        hits = index.search(q_emb, k=limit, threshold=0.25)
+    if not hits:
+        return []
+
+    result = await db.execute(
+        select(Diary).where(
+            (Diary.user_id == uuid.UUID(user_id)) & (Diary.id.in_([uuid.UUID(d_id) for d_id, _ in hits]))
+        )
+    )
+    by_id = {str(d.id): d for d in result.scalars().all()}
+    return [by_id[d_id] for d_id, _ in hits if d_id in by_id]
 
-@router.get("/", response_model=Dict[str, List[Any]])
+@router.get("/", response_model=Dict[str, Any])
 async def list_artifacts(
     limit: int = 20, 
     query: Optional[str] = None, 
     user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
@@ -56,69 +98,76 @@ async def list_artifacts(
     if effective_user_id != current_user["id"]:
          raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
 
-    # Simple list of recent diaries
-    stmt = select(Diary).order_by(Diary.created_at.desc())
-    
-    if effective_user_id:
-        stmt = stmt.where(Diary.user_id == effective_user_id)
-        
-    if not query:
+    if query:
+        cached = SEARCH_RESULTS.get(str(effective_user_id), "artifacts", query, limit=limit)
+        if cached is not None:
+            return cached
 
-        stmt = stmt.limit(limit)
-        
-    result = await db.execute(stmt)
-    diaries = result.scalars().all()
-    
+    next_cursor = None
+    pending_embeddings = 0
     if query:
         print(f"DEBUG: Performing vector search for query: {query}", flush=True)
+        uid = str(effective_user_id)
+        pending_embeddings = await db.scalar(
+            select(func.count()).select_from(DiaryChunk).where(
+                (DiaryChunk.user_id == uuid.UUID(uid)) & (DiaryChunk.embedding_status == 'pending')
+            )
+        ) or 0
+        if pending_embeddings:
+            # Never embed on the request path; fill it in the background
+            run_in_background(process_pending_embeddings(uid))
         try:
-            q_emb = get_embedding(query)
-            scored_diaries = []
-            changed = False
-            
-            for d in diaries:
-                # Generate missing embeddings on the fly
-                if not d.content_embedding:
-                    try:
-                        d.content_embedding = get_embedding(d.content)
-                        changed = True
-                    except Exception as e:
-                        print(f"DEBUG: Failed to embed diary {d.id}: {e}", flush=True)
-                        continue
-                
-                if d.content_embedding:
-                    score = cosine_similarity(q_emb, d.content_embedding)
-                    scored_diaries.append((score, d))
-                    
-            if changed:
-                await db.commit()
-                
-            # Sort by similarity score descending
-            scored_diaries.sort(key=lambda x: x[0], reverse=True)
-            
-            # Filter results above an arbitrary semantic similarity threshold or just pick top N
-            # A threshold of 0.25 is usually good for Amazon Titan Text Embeddings
-            diaries = [d for score, d in scored_diaries if score > 0.25][:limit]
+            diaries = await search_artifacts(db, uid, query, limit)
         except Exception as e:
             print(f"DEBUG: Vector search failed, falling back. Error: {e}", flush=True)
-            # Fallback to simple matching if embeddings fail
-            diaries = [d for d in diaries if query.lower() in d.content.lower()][:limit]
-    
+            # Fallback to the lexical (trigram) index if embeddings fail
+            diaries = [d for d, _ in await lexical_search(db, uid, query, limit)]
+            pending_embeddings = 0
+    else:
+        # Simple list of recent diaries, keyset-paginated on (created_at, id)
+        stmt = select(Diary).order_by(Diary.created_at.desc(), Diary.id.desc())
+        if effective_user_id:
+            stmt = stmt.where(Diary.user_id == effective_user_id)
+        if cursor:
+            try:
+                last_created, last_id = decode_cursor(cursor)
+                last_created = datetime.datetime.fromisoformat(last_created)
+                last_id = uuid.UUID(last_id)
+            except ValueError:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+            stmt = stmt.where(
+                (Diary.created_at < last_created) | ((Diary.created_at == last_created) & (Diary.id < last_id))
+            )
+        stmt = stmt.limit(limit + 1)
+
+        result = await db.execute(stmt)
+        diaries = result.scalars().all()
+        if len(diaries) > limit:
+            diaries = diaries[:limit]
+            next_cursor = encode_cursor([diaries[-1].created_at, diaries[-1].id])
+
+    thumb_keys = [pick_variant_key(d.image_variants, d.image_s3_key, "thumb") for d in diaries]
+    urls = make_access_urls(S3_BUCKET, thumb_keys)
+
     items = []
-    for d in diaries:
-        url = ""
-        if d.image_s3_key:
-             url = make_access_url(S3_BUCKET, d.image_s3_key)
-             
+    for d, thumb_key in zip(diaries, thumb_keys):
         items.append({
             "artifactId": str(d.id),
-            "thumbnailUrl": url,
+            "thumbnailUrl": urls.get(thumb_key, "") if thumb_key else "",
             "date": str(d.diary_date),
             "summary": d.content[:50] + "...",
             "stylePreset": "comic"
         })
         
-    return {"items": items}
+    response: Dict[str, Any] = {"items": items, "nextCursor": next_cursor}
+    if query:
+        # Diaries still waiting for their embedding are missing from the ranking
+        response["partial"] = pending_embeddings > 0
+        response["pendingEmbeddings"] = pending_embeddings
+        # Partial rankings change as the backfill completes; don't pin them
+        if not pending_embeddings:
+            SEARCH_RESULTS.set(str(effective_user_id), "artifacts", query, response, limit=limit)
+    return response
 
 @router.get("/{artifact_id}", response_model=ArtifactResponse)
 async def get_artifact(
@@ -144,24 +193,31 @@ async def get_artifact(
     
     # 3. Construct Response
     final_url = ""
-    if diary.image_s3_key:
-        final_url = make_access_url(S3_BUCKET, diary.image_s3_key)
+    final_key = pick_variant_key(diary.image_variants, diary.image_s3_key, "full")
+    if final_key:
+        final_url = make_access_url(S3_BUCKET, final_key)
         
     panel_urls = []
     panels_data = []
+    plan_prompts = {p["cut_index"]: p["prompt"] for p in (diary.generation_plan or {}).get("prompts") or []}
+
+    panel_keys = [
+        pick_variant_key((c.metadata_ or {}).get("image_variants"), (c.metadata_ or {}).get("image_s3_key"), "medium")
+        for c in chunks
+    ]
+    signed = make_access_urls(S3_BUCKET, panel_keys)
     
-    for chunk in chunks:
+    for chunk, key in zip(chunks, panel_keys):
         # Get Image URL from metadata
         meta = chunk.metadata_ or {}
-        key = meta.get("image_s3_key")
         p_url = ""
         if key:
-            p_url = make_access_url(S3_BUCKET, key)
+            p_url = signed[key]
         elif meta.get("image_url"):
              p_url = meta.get("image_url") # Fallback
         
         panel_urls.append(p_url)
-        panels_data.append(Panel(text=chunk.content))
+        panels_data.append(Panel(text=chunk.content, cutIndex=chunk.chunk_index, prompt=plan_prompts.get(chunk.chunk_index)))
         
     return ArtifactResponse(
         artifactId=str(diary.id),
@@ -176,6 +232,36 @@ async def get_artifact(
         options=diary.generation_options
     )
 
+@router.post("/{artifact_id}/panels/{cut_index}/regenerate", response_model=ArtifactResponse)
+async def regenerate_artifact_panel(
+    artifact_id: str,
+    cut_index: int,
+    request: PanelRegenerateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Re-renders one panel (optionally with an edited prompt) from the stored
+    storyboard/prompts and recomposes the strip. Returns the updated artifact.
+    Sessions are short-lived: none is held during the image call.
+    """
+    user_id = current_user["id"]
+    async with AsyncSessionLocal() as db:
+        owner_id = await db.scalar(select(Diary.user_id).where(Diary.id == uuid.UUID(artifact_id)))
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    if str(owner_id) != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to edit this artifact")
+    if await JOB_BACKEND.artifact_busy(user_id, artifact_id):
+        raise HTTPException(status_code=409, detail="This comic is still being generated")
+
+    try:
+        await regenerate_panel(user_id, artifact_id, cut_index, prompt=request.prompt, seed=request.seed)
+    except PanelRegenerationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    async with AsyncSessionLocal() as db:
+        return await get_artifact(artifact_id, db, current_user)
+
 @router.put("/{artifact_id}")
 async def update_artifact(
     artifact_id: str,
@@ -196,11 +282,13 @@ async def update_artifact(
         
     # 2. Update Content
     diary.content = request.diaryText
-    # Force re-embedding on next search if needed, or clear it
+    # Force re-embedding (done in the background, not on the next search)
     diary.content_embedding = None 
     
     await db.commit()
     await db.refresh(diary)
+    SEARCH_RESULTS.invalidate_user(current_user["id"])
+    run_in_background(backfill_diary_embeddings(current_user["id"]))
     
     return {"status": "success", "message": "Artifact updated"}
 
@@ -228,5 +316,7 @@ async def delete_artifact(
     
     await db.delete(diary)
     await db.commit()
+    VECTOR_INDEX.remove_diary(current_user["id"], str(diary.id))
+    SEARCH_RESULTS.invalidate_user(current_user["id"])
     
     return {"status": "success", "message": "Artifact deleted"}
@@ -1,24 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Query, Response, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import delete
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import asyncio
 import datetime
 import uuid
 import io
 import sys
 from PIL import Image
-from app.agent.bedrock import get_embedding
-from app.models.models import DiaryChunk, DiaryChunkEmbedding
-import numpy as np
 from app.database import get_db, AsyncSessionLocal
-from app.agent.bedrock import make_access_url, S3_BUCKET
+from app.agent.bedrock import make_access_urls, S3_BUCKET
 from app.models.models import User, Diary, DiaryChunk
-from app.routers.jobs import create_job
+from app.utils.image import pick_variant_key
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.routers.jobs import create_job, update_job, discard_job, JobStatus
 
-from app.agent.worker import execute_job
-from app.agent.models import DiaryEntryRequest
+from app.agent.job_backend import JOB_BACKEND, DuplicateJob
+from app.agent.coalesce import SUBMISSIONS, IdempotencyConflict, dedupe_key, IDEMPOTENCY_KEY_MAX_LENGTH
+from app.agent.admission import admit, AdmissionRejected
+from app.agent.consumer import JOB_CONSUMER
+from app.agent.embeddings import process_pending_embeddings
+from app.agent.vector_index import VECTOR_INDEX
+from app.agent.vector_search import pgvector_enabled, pgvector_search
+from app.agent.lexical_search import lexical_search, make_snippet, blend_scores
+from app.agent.search_cache import SEARCH_RESULTS, get_query_embedding
+from app.agent.models import DiaryEntryRequest, GenerationOptions
+from app.agent.store import JOB_REGISTRY
 from app.auth.security import get_current_user
 
 router = APIRouter()
@@ -31,6 +41,7 @@ class DiarySummaryResponse(BaseModel):
     date: str
     summary: str
     stylePreset: str
+    snippet: Optional[str] = None
 
 class DiaryCreate(BaseModel):
     user_id: str
@@ -50,64 +61,83 @@ class DiaryResponse(BaseModel):
     created_at: datetime.datetime
 
 # Constants for frontend request
+DEFAULT_PAGE_SIZE = 20
 
 
 # --- Helper Functions ---
 
-async def process_pending_embeddings(user_id: str):
+def _diary_summaries(diaries: List[Diary], query: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    Background task to process pending diary chunk embeddings
+    DiarySummaryResponse items for a list of diaries. Thumbnails use the small
+    derivative when the strip has one and are signed in one batch. With a search
+    query, each item also gets a snippet around the match.
     """
-    async with AsyncSessionLocal() as db:
-        # Fetch chunks with pending status for this user
-        uid = uuid.UUID(user_id) if isinstance(user_id, str) else user_id
-        stmt = select(DiaryChunk).where(
-            (DiaryChunk.user_id == uid) & 
-            (DiaryChunk.embedding_status == 'pending')
-        )
-        result = await db.execute(stmt)
-        chunks = result.scalars().all()
-        
-        if not chunks:
-            return
-
-        for chunk in chunks:
-            try:
-                # Generate embedding
-                embedding_vector = get_embedding(chunk.content)
-                
-                if embedding_vector:
-                    # Save to DiaryChunkEmbedding
-                    db_embedding = DiaryChunkEmbedding(
-                        chunk_id=chunk.id,
-                        embedding_vector=embedding_vector
-                    )
-                    db.add(db_embedding)
-                    
-                    # Update chunk status
-                    chunk.embedding_status = 'completed'
-                    chunk.last_embedded_at = datetime.datetime.now(datetime.timezone.utc)
-                else:
-                    chunk.embedding_status = 'failed'
-                    
-            except Exception as e:
-                print(f"DEBUG: Error processing embedding for chunk {chunk.id}: {e}", flush=True)
-                chunk.embedding_status = 'failed'
-                
-        await db.commit()
+    thumb_keys = [pick_variant_key(d.image_variants, d.image_s3_key, "thumb") for d in diaries]
+    urls = make_access_urls(S3_BUCKET, thumb_keys)
+    return [
+        {
+            "artifactId": str(d.id),
+            "thumbnailUrl": urls.get(key, "") if key else "",
+            "date": str(d.diary_date),
+            "summary": d.content[:50] + "..." if len(d.content) > 50 else d.content,
+            "stylePreset": d.style_preset or "comic",
+            "snippet": make_snippet(d.content, query) if query else None
+        }
+        for d, key in zip(diaries, thumb_keys)
+    ]
 
 # --- Endpoints ---
 
-@router.post("/generate", response_model=Dict[str, str])
+@router.post("/generate", response_model=Dict[str, Any])
 async def generate_diary_comic(
     request: DiaryEntryRequest, 
-    background_tasks: BackgroundTasks,
-    current_user: dict = Depends(get_current_user)
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
 ):
     print(f"DEBUG: Received generation request for user {current_user['id']}", flush=True)
     
-    job_id = uuid.uuid4().hex
     user_id = current_user["id"]
+    payload = jsonable_encoder(request)
+    dedupe = dedupe_key(request.diaryDate or datetime.date.today(), payload)
+
+    # Double taps / client retries get the job that is already in flight
+    try:
+        result, coalesced = await SUBMISSIONS.submit(
+            user_id, idempotency_key, dedupe,
+            lambda: _start_generation(request, payload, user_id, idempotency_key, dedupe),
+        )
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request",
+        )
+
+    if coalesced:
+        print(f"DEBUG: Coalesced generation request onto job {result['jobId']}", flush=True)
+        response.headers["Idempotent-Replayed"] = "true"
+    return {k: v for k, v in result.items() if k != "dedupeKey"}
+
+
+async def _start_generation(
+    request: DiaryEntryRequest,
+    payload: Dict[str, Any],
+    user_id: str,
+    idempotency_key: Optional[str],
+    dedupe: str,
+) -> Dict[str, Any]:
+    job_id = uuid.uuid4().hex
+
+    # Refuse early (before touching the diary) when we can't take more work
+    try:
+        admission = await admit(user_id, JOB_CONSUMER.concurrency, JOB_CONSUMER.avg_job_seconds)
+    except AdmissionRejected as e:
+        print(f"DEBUG: Generation rejected for user {user_id}: {e.reason}", flush=True)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.detail(),
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
     # Fetch/create Diary Record
     try:
@@ -122,6 +152,8 @@ async def generate_diary_comic(
             
             if existing_diary:
                 db_diary = existing_diary
+                if db_diary.content != request.diaryText:
+                    db_diary.content_embedding = None
                 db_diary.content = request.diaryText
                 db_diary.mood = request.mood
                 db_diary.style_preset = request.stylePreset
@@ -146,11 +178,86 @@ async def generate_diary_comic(
         # Fallback if DB fails, though we might want to error out
         artifact_id = ""
 
+    SEARCH_RESULTS.invalidate_user(user_id)
+
     # Create job with artifact_id already set
     create_job(job_id, user_id=user_id, artifact_id=artifact_id)
-    background_tasks.add_task(execute_job, job_id, user_id, request, artifact_id)
+    # Picked up by a JobConsumer (embedded in this process or a dedicated worker)
+    try:
+        await JOB_BACKEND.enqueue(job_id, user_id, artifact_id, payload, idempotency_key, dedupe)
+    except DuplicateJob:
+        # Same submission enqueued by another replica meanwhile; answer with that job
+        discard_job(job_id)
+        raise
+    except Exception as e:
+        print(f"DEBUG: Failed to enqueue job {job_id}: {e}", flush=True)
+        update_job(job_id, JobStatus.FAILED, "Could not queue the job", 0, error=str(e))
+        raise HTTPException(status_code=503, detail="Could not queue the generation job")
     
-    return {"jobId": job_id, "artifactId": artifact_id}
+    return {
+        "jobId": job_id,
+        "artifactId": artifact_id,
+        "queuePosition": admission.queue_position,
+        "estimatedWaitSeconds": admission.estimated_wait_seconds,
+    }
+
+@router.post("/generate/{job_id}/resume", response_model=Dict[str, Any])
+async def resume_generation(job_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Runs a failed generation job again under the same id. The graph continues
+    from its last checkpoint (see app/agent/checkpoint.py), so finished steps
+    such as the storyboard and prompts are not redone.
+    """
+    user_id = current_user["id"]
+    record = JOB_REGISTRY.get(job_id)
+    job = record.to_dict() if record else None
+    if job is None and JOB_BACKEND.durable:
+        job = await JOB_BACKEND.load(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("userId") != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to resume this job")
+    if job.get("status") != JobStatus.FAILED:
+        raise HTTPException(status_code=409, detail="Only failed jobs can be resumed")
+    artifact_id = job.get("artifactId")
+    if not artifact_id:
+        raise HTTPException(status_code=409, detail="Job has no diary to resume")
+
+    async with AsyncSessionLocal() as db:
+        db_diary = await db.get(Diary, uuid.UUID(artifact_id))
+    if not db_diary:
+        raise HTTPException(status_code=404, detail="Diary not found")
+
+    # Same inputs as the original submission (the durable backend keeps its stored payload)
+    request = DiaryEntryRequest(
+        diaryText=db_diary.content,
+        mood=db_diary.mood or "",
+        stylePreset=db_diary.style_preset,
+        diaryDate=db_diary.diary_date,
+        options=GenerationOptions(**(db_diary.generation_options or {})),
+    )
+
+    try:
+        admission = await admit(user_id, JOB_CONSUMER.concurrency, JOB_CONSUMER.avg_job_seconds)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.detail(),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    create_job(job_id, user_id=user_id, artifact_id=artifact_id)
+    if not await JOB_BACKEND.requeue(job_id, user_id, artifact_id, jsonable_encoder(request)):
+        raise HTTPException(status_code=409, detail="Job is already being resumed")
+    print(f"DEBUG: Resuming job {job_id} for user {user_id}", flush=True)
+
+    return {
+        "jobId": job_id,
+        "artifactId": artifact_id,
+        "queuePosition": admission.queue_position,
+        "estimatedWaitSeconds": admission.estimated_wait_seconds,
+    }
+
 
 @router.post("/", response_model=DiaryResponse)
 async def create_diary(
@@ -189,6 +296,8 @@ async def create_diary(
     await db.commit()
     await db.refresh(db_diary)
     
+    SEARCH_RESULTS.invalidate_user(diary_in.user_id)
+
     # Trigger background task for embeddings
     background_tasks.add_task(process_pending_embeddings, diary_in.user_id)
     
@@ -203,130 +312,129 @@ async def create_diary(
 @router.get("/user/{user_id}", response_model=List[DiarySummaryResponse])
 async def get_user_diaries(
     user_id: str, 
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    Without `limit`/`cursor` this returns the full history (legacy clients).
+    With them it returns one page ordered by (diary_date, id) desc; the cursor for
+    the next page is in the X-Next-Cursor header (absent on the last page).
+    """
     if user_id != current_user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized to view these diaries")
-    stmt = select(Diary).where(Diary.user_id == uuid.UUID(user_id)).order_by(Diary.diary_date.desc())
+    stmt = select(Diary).where(Diary.user_id == uuid.UUID(user_id)).order_by(Diary.diary_date.desc(), Diary.id.desc())
+
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor)
+            last_date = datetime.date.fromisoformat(last_date)
+            last_id = uuid.UUID(last_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(
+            (Diary.diary_date < last_date) | ((Diary.diary_date == last_date) & (Diary.id < last_id))
+        )
+
+    page_size = limit or (DEFAULT_PAGE_SIZE if cursor else None)
+    if page_size:
+        stmt = stmt.limit(page_size + 1)
+
     result = await db.execute(stmt)
     diaries = result.scalars().all()
+
+    if page_size and len(diaries) > page_size:
+        diaries = diaries[:page_size]
+        last = diaries[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([last.diary_date, last.id])
     
-    items = []
-    for d in diaries:
-        url = ""
-        if d.image_s3_key:
-            url = make_access_url(S3_BUCKET, d.image_s3_key)
-            
-        items.append({
-            "artifactId": str(d.id),
-            "thumbnailUrl": url,
-            "date": str(d.diary_date),
-            "summary": d.content[:50] + "..." if len(d.content) > 50 else d.content,
-            "stylePreset": d.style_preset or "comic"
-        })
-    return items
+    return _diary_summaries(diaries)
 
 @router.get("/search", response_model=List[DiarySummaryResponse])
 async def search_diaries(
     user_id: str, 
     query: str, 
+    limit: int = 100,
+    mode: str = "vector",
     db: AsyncSession = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
+    """
+    mode: "vector" (semantic, lexical fallback), "lexical" (trigram/substring only)
+    or "hybrid" (both, blended with SEARCH_LEXICAL_WEIGHT).
+    """
     if user_id != current_user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    
 
-    print(f"DEBUG: Semantic search for query '{query}' (user {user_id})", flush=True)
+    # Repeated queries (paging, back navigation) are answered from the per-user cache
+    cached = SEARCH_RESULTS.get(user_id, "diary_search", query, limit=limit, mode=mode)
+    if cached is not None:
+        return cached
+
+    results = await _search_diaries(db, user_id, query, limit, mode)
+    SEARCH_RESULTS.set(user_id, "diary_search", query, results, limit=limit, mode=mode)
+    return results
+
+
+async def _search_diaries(db: AsyncSession, user_id: str, query: str, limit: int, mode: str) -> List[Dict[str, Any]]:
+    print(f"DEBUG: Semantic search for query '{query}' (user {user_id}, mode {mode})", flush=True)
+
+    if mode == "lexical":
+        return await _lexical_results(db, user_id, query, limit)
 
     try:
         # 1. Generate query embedding
-        query_embedding = get_embedding(query)
+        query_embedding = await asyncio.to_thread(get_query_embedding, query)
         if not query_embedding:
-            # Fallback to simple matching if embedding fails
-            print("WARNING: get_embedding failed, falling back to simple search", flush=True)
-            stmt = select(Diary).where((Diary.user_id == uuid.UUID(user_id)) & (Diary.content.contains(query)))
-            result = await db.execute(stmt)
-            diaries = result.scalars().all()
-            print(f"DEBUG: Found {len(diaries)} diaries via simple search", flush=True) 
-            return [
-                {
-                    "artifactId": str(d.id),
-                    "thumbnailUrl": make_access_url(S3_BUCKET, d.image_s3_key) if d.image_s3_key else "",
-                    "date": str(d.diary_date),
-                    "summary": d.content[:50] + "..." if len(d.content) > 50 else d.content,
-                    "stylePreset": d.style_preset or "comic"
-                }
-                for d in diaries
-            ]
-
-        # 2. Fetch all chunks and embeddings for this user
-        stmt = select(DiaryChunk, DiaryChunkEmbedding, Diary).join(
-            DiaryChunkEmbedding, DiaryChunk.id == DiaryChunkEmbedding.chunk_id
-        ).join(
-            Diary, DiaryChunk.diary_id == Diary.id
-        ).where(DiaryChunk.user_id == uuid.UUID(user_id))
-        
-        result = await db.execute(stmt)
-        rows = result.all()
+            # Fallback to lexical matching if embedding fails
+            print("WARNING: get_embedding failed, falling back to lexical search", flush=True)
+            return await _lexical_results(db, user_id, query, limit)
 
-        if not rows:
-            return []
-
-        # 3. Calculate similarity scores
-        def cosine_similarity(v1, v2):
-            return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+        # 2. Score in Postgres (pgvector HNSW) or against the user's in-memory index
+        hits = None
+        if pgvector_enabled():
+            try:
+                # None: the filtered scan came back short; score exactly instead
+                hits = await pgvector_search(db, user_id, query_embedding, k=limit, threshold=0.3)
+            except Exception as e:
+                print(f"WARNING: pgvector search failed, using in-memory index: {e}", flush=True)
+                await db.rollback()
+        if hits is None:
+            index = await VECTOR_INDEX.get_or_build(db, user_id)
+            hits = index.search(query_embedding, k=limit, threshold=0.3)
 
-        diary_results = {} # diary_id -> {score, diary}
+        lexical_by_id: Dict[str, Diary] = {}
+        if mode == "hybrid":
+            lexical = await lexical_search(db, user_id, query, limit)
+            lexical_by_id = {str(d.id): d for d, _ in lexical}
+            hits = blend_scores(hits, [(str(d.id), score) for d, score in lexical])[:limit]
+        if not hits:
+            return []
 
-        query_vec = np.array(query_embedding)
-        for chunk, emb, diary in rows:
-            chunk_vec = np.array(emb.embedding_vector)
-            similarity = cosine_similarity(query_vec, chunk_vec)
-            
-            d_id = str(diary.id)
-            if d_id not in diary_results or similarity > diary_results[d_id]["score"]:
-                diary_results[d_id] = {
-                    "score": similarity,
-                    "diary": diary
-                }
-
-        # 4. Filter and Sort
-        threshold = 0.3
-        sorted_results = sorted(
-            [v for v in diary_results.values() if v["score"] > threshold],
-            key=lambda x: x["score"],
-            reverse=True
-        )
+        # 3. Load the matching diaries, keeping score order
+        by_id = dict(lexical_by_id)
+        missing = [uuid.UUID(d_id) for d_id, _ in hits if d_id not in by_id]
+        if missing:
+            stmt = select(Diary).where(
+                (Diary.user_id == uuid.UUID(user_id)) & (Diary.id.in_(missing))
+            )
+            result = await db.execute(stmt)
+            by_id.update({str(d.id): d for d in result.scalars().all()})
 
-        return [
-            {
-                "artifactId": str(v["diary"].id),
-                "thumbnailUrl": make_access_url(S3_BUCKET, v["diary"].image_s3_key) if v["diary"].image_s3_key else "",
-                "date": str(v["diary"].diary_date),
-                "summary": v["diary"].content[:50] + "..." if len(v["diary"].content) > 50 else v["diary"].content,
-                "stylePreset": v["diary"].style_preset or "comic"
-            }
-            for v in sorted_results
-        ]
+        return _diary_summaries([by_id[d_id] for d_id, _ in hits if d_id in by_id], query=query)
         
     except Exception as e:
         print(f"ERROR in semantic search: {e}", flush=True)
-        # Fallback to simple matching on error
-        stmt = select(Diary).where((Diary.user_id == uuid.UUID(user_id)) & (Diary.content.contains(query)))
-        result = await db.execute(stmt)
-        diaries = result.scalars().all()
-        return [
-            {
-                "artifactId": str(d.id),
-                "thumbnailUrl": make_access_url(S3_BUCKET, d.image_s3_key) if d.image_s3_key else "",
-                "date": str(d.diary_date),
-                "summary": d.content[:50] + "..." if len(d.content) > 50 else d.content,
-                "stylePreset": d.style_preset or "comic"
-            }
-            for d in diaries
-        ]
+        # Fallback to lexical matching on error
+        return await _lexical_results(db, user_id, query, limit)
+
+
+async def _lexical_results(db: AsyncSession, user_id: str, query: str, limit: int) -> List[Dict[str, Any]]:
+    results = await lexical_search(db, user_id, query, limit)
+    print(f"DEBUG: Found {len(results)} diaries via lexical search", flush=True)
+    return _diary_summaries([d for d, _ in results], query=query)
 
 @router.get("/{diary_id}", response_model=DiaryResponse)
 async def get_diary(
@@ -370,5 +478,7 @@ async def delete_diary(
         
     await db.delete(diary)
     await db.commit()
+    VECTOR_INDEX.remove_diary(current_user["id"], str(diary.id))
+    SEARCH_RESULTS.invalidate_user(current_user["id"])
     
     return {"status": "success", "message": "Diary deleted"}
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from pydantic import BaseModel
 from typing import Optional
+import asyncio
 import uuid
 import base64
 import random
@@ -21,7 +22,8 @@ async def generate_image(request: ImageGenerationRequest):
     try:
         # Call Bedrock
         seed = random.randint(0, 1000000)
-        raw, img_bytes = generate_text_to_image(request.prompt, seed=seed)
+        # Blocking (and possibly waiting on the Bedrock rate limiter): keep it off the event loop
+        raw, img_bytes = await asyncio.to_thread(generate_text_to_image, request.prompt, seed=seed)
         b64_img = base64.b64encode(img_bytes).decode("utf-8")
         
         return {
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from enum import Enum
 from fastapi import Depends
 from app.auth.security import get_current_user
+from app.agent.job_backend import JOB_BACKEND
+from app.agent.job_events import JOB_EVENTS, STREAM_FIELDS
+from app.agent.search_cache import SEARCH_RESULTS
+from app.agent.store import JOB_REGISTRY
+from app.agent.vector_index import VECTOR_INDEX
 
 router = APIRouter()
 
 class JobStatus(str, Enum):
+    QUEUED = "QUEUED"
     READING_DIARY = "READING_DIARY"
     BUILDING_STORYBOARD = "BUILDING_STORYBOARD"
     GENERATING_IMAGES = "GENERATING_IMAGES"
@@ -24,12 +30,14 @@ class JobResponse(BaseModel):
     progress: float
     artifactId: Optional[str] = None
     error: Optional[str] = None
+    failedCuts: Optional[List[int]] = None
 
-# In-memory job store
-# Structure: { jobId: { "status": ..., "step": ..., "progress": ..., "artifactId": ..., "error": ... } }
-JOBS: Dict[str, Dict[str, Any]] = {}
+# In-memory job state (jobs created or run by this process) lives in JOB_REGISTRY,
+# see app/agent/store.py. With a durable JOB_BACKEND the status is also
+# persisted, see app/agent/job_backend.py.
 
 import logging
+import os
 import sys
 
 import asyncio
@@ -39,17 +47,72 @@ from fastapi.encoders import jsonable_encoder
 
 # logger = logging.getLogger("uvicorn") # Switching to print for visibility
 
+JOB_STREAM_HEARTBEAT_SECONDS = float(os.getenv("JOB_STREAM_HEARTBEAT_SECONDS", "15"))
+JOB_STREAM_RETRY_MS = int(os.getenv("JOB_STREAM_RETRY_MS", "3000"))
+# Durable backend: how often jobs running in other processes are pulled into the stream
+JOB_STREAM_REMOTE_POLL_SECONDS = float(os.getenv("JOB_STREAM_REMOTE_POLL_SECONDS", "1.0"))
+# After a remote job reaches DONE its consumer still writes the embeddings;
+# the user's vector index / search cache are dropped again after this delay
+JOB_REMOTE_EMBEDDING_SETTLE_SECONDS = float(os.getenv("JOB_REMOTE_EMBEDDING_SETTLE_SECONDS", "30"))
+
+def _stream_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return jsonable_encoder({k: job.get(k) for k in STREAM_FIELDS})
+
+
+def _sse(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _snapshot(user_id: str) -> Tuple[int, str]:
+    seq = JOB_EVENTS.last_seq
+    jobs = {r.job_id: _stream_view(r.to_dict()) for r in JOB_REGISTRY.for_user(user_id)}
+    return seq, _sse("snapshot", jobs, JOB_EVENTS.event_id(seq))
+
+
 @router.get("/stream")
-async def stream_jobs(current_user: dict = Depends(get_current_user)):
-    """Server-Sent Events endpoint to stream active jobs state."""
+async def stream_jobs(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Server-Sent Events endpoint for the user's jobs.
+
+    Sends one `snapshot` event (all jobs) and then a `job` event per change,
+    containing only the changed fields. Every event has an id; a reconnect
+    with Last-Event-ID replays what was missed (or gets a new snapshot if that
+    is no longer possible). Idle connections get a comment heartbeat.
+    """
     user_id = current_user["id"]
+    sub = JOB_EVENTS.subscribe(user_id, request.headers.get("last-event-id"))
+
     async def event_generator():
-        while True:
-            # Filter jobs for current user only
-            current_jobs = {k: v for k, v in JOBS.items() if v.get("userId") == user_id}
-            yield f"data: {json.dumps(jsonable_encoder(current_jobs))}\n\n"
-            await asyncio.sleep(1)
-            
+        try:
+            yield f"retry: {JOB_STREAM_RETRY_MS}\n\n"
+            sent_seq = 0
+            if sub.resumed:
+                for event in sub.replay:
+                    yield _sse("job", {"jobId": event.job_id, **event.changes}, JOB_EVENTS.event_id(event.seq))
+                    sent_seq = event.seq
+            else:
+                sent_seq, chunk = _snapshot(user_id)
+                yield chunk
+
+            while True:
+                if sub.lagged:
+                    JOB_EVENTS.resync(sub)
+                    sent_seq, chunk = _snapshot(user_id)
+                    yield chunk
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=JOB_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event.seq <= sent_seq:
+                    # Already part of the snapshot / replay
+                    continue
+                yield _sse("job", {"jobId": event.job_id, **event.changes}, JOB_EVENTS.event_id(event.seq))
+                sent_seq = event.seq
+        finally:
+            JOB_EVENTS.unsubscribe(sub)
+
     return StreamingResponse(
         event_generator(), 
         media_type="text/event-stream",
@@ -63,13 +126,18 @@ async def stream_jobs(current_user: dict = Depends(get_current_user)):
 
 @router.get("/debug", response_model=Dict[str, Any])
 async def debug_jobs():
-    print(f"DEBUG: Current Jobs: {list(JOBS.keys())} (JOBS ID: {id(JOBS)})", flush=True)
-    return JOBS
+    jobs = JOB_REGISTRY.all()
+    print(f"DEBUG: Current Jobs: {[r.job_id for r in jobs]}", flush=True)
+    return {"jobs": {r.job_id: r.to_dict() for r in jobs}, "registry": JOB_REGISTRY.stats()}
 
 @router.get("/{job_id}", response_model=JobResponse)
 async def get_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
-    print(f"Fetching job status for: {job_id} from JOBS {id(JOBS)}", flush=True)
-    job = JOBS.get(job_id)
+    print(f"Fetching job status for: {job_id}", flush=True)
+    record = JOB_REGISTRY.get(job_id)
+    job = record.to_dict() if record else None
+    if JOB_BACKEND.durable and (job is None or job.get("status") == JobStatus.QUEUED):
+        # The job may be running on another replica / consumer
+        job = await JOB_BACKEND.load(job_id) or job
     if not job:
         # ... existing not found logic ...
         raise HTTPException(status_code=404, detail="Job not found")
@@ -83,13 +151,13 @@ async def get_job_status(job_id: str, current_user: dict = Depends(get_current_u
         step=job.get("step", ""),
         progress=job.get("progress", 0.0),
         artifactId=job.get("artifactId"),
-        error=job.get("error")
+        error=job.get("error"),
+        failedCuts=job.get("failedCuts")
     )
 
 def update_job(job_id: str, status: Optional[JobStatus] = None, step: Optional[str] = None, progress: Optional[float] = None, artifact_id: Optional[str] = None, error: Optional[str] = None, **kwargs):
-    # print(f"DEBUG: Updating job {job_id} in {id(JOBS)}")
-    if job_id not in JOBS:
-        print(f"WARNING: Attempted to update non-existent job {job_id} in JOBS {id(JOBS)}", flush=True)
+    if job_id not in JOB_REGISTRY:
+        print(f"WARNING: Attempted to update non-existent job {job_id}", flush=True)
         return
 
     updates = kwargs.copy()
@@ -104,19 +172,81 @@ def update_job(job_id: str, status: Optional[JobStatus] = None, step: Optional[s
     # Handle alias just in case
     if 'artifact_id' in updates:
         updates['artifactId'] = updates.pop('artifact_id')
+    if 'failed_cuts' in updates:
+        updates['failedCuts'] = updates.pop('failed_cuts')
     
-    # Merge updates
-    JOBS[job_id].update(updates)
+    # Merge updates (payloads like storyboard/prompts/images are not kept)
+    changes = JOB_REGISTRY.update(job_id, updates)
+    if changes is None:
+        # Evicted meanwhile
+        return
+    record = JOB_REGISTRY.get(job_id)
+    if record is None:
+        return
+    JOB_BACKEND.record(job_id, record.to_dict())
+    JOB_EVENTS.publish(record.user_id, job_id, jsonable_encoder(changes))
 
 
 def create_job(job_id: str, user_id: Optional[str] = None, artifact_id: Optional[str] = None):
     print(f"Creating new job: {job_id} for user {user_id}", flush=True)
-    JOBS[job_id] = {
-        "jobId": job_id,
-        "userId": user_id,
-        "status": JobStatus.READING_DIARY,
-        "step": "Starting...",
-        "progress": 0.0,
-        "artifactId": artifact_id,
-        "error": None
-    }
+    record = JOB_REGISTRY.create(job_id, user_id, JobStatus.QUEUED, "Waiting for a worker...", artifact_id)
+    JOB_EVENTS.publish(user_id, job_id, _stream_view(record.to_dict()))
+
+
+def discard_job(job_id: str) -> None:
+    """Drops a job that never ran (e.g. coalesced into another one) and tells stream clients."""
+    record = JOB_REGISTRY.get(job_id)
+    if record is None:
+        return
+    JOB_REGISTRY.discard(job_id)
+    JOB_EVENTS.publish(record.user_id, job_id, {"removed": True})
+
+
+def apply_remote_job(remote: Dict[str, Any]) -> None:
+    """
+    Merges a job row read from the durable backend (job running in another
+    process) into JOB_REGISTRY and publishes what changed to stream subscribers.
+    """
+    job_id = remote["jobId"]
+    record = JOB_REGISTRY.get(job_id)
+    finished_before = record is not None and record.status == JobStatus.DONE
+    if record is None:
+        record = JOB_REGISTRY.create(job_id, remote.get("userId"), remote["status"])
+    elif record.local:
+        # Updated by this process; the persisted row lags behind
+        return
+    changes = JOB_REGISTRY.update(job_id, remote, local=False)
+    if changes:
+        JOB_EVENTS.publish(record.user_id, job_id, jsonable_encoder(changes))
+    if not finished_before and record.status == JobStatus.DONE and record.user_id:
+        # The diary was saved by another process: drop this process' cached
+        # search state now, and again once that process' embedding tasks are through
+        _invalidate_user_search(record.user_id)
+        asyncio.get_running_loop().call_later(
+            JOB_REMOTE_EMBEDDING_SETTLE_SECONDS, _invalidate_user_search, record.user_id
+        )
+
+
+def _invalidate_user_search(user_id: str) -> None:
+    VECTOR_INDEX.invalidate_user(user_id)
+    SEARCH_RESULTS.invalidate_user(user_id)
+
+
+async def sync_remote_jobs() -> None:
+    """
+    Background loop (durable backend only): one query per interval for all
+    users that currently have a stream open, regardless of connection count.
+    """
+    since = None
+    while True:
+        await asyncio.sleep(JOB_STREAM_REMOTE_POLL_SECONDS)
+        users = JOB_EVENTS.subscribed_users()
+        if not users:
+            continue
+        try:
+            rows, since = await JOB_BACKEND.changed_since(users, since)
+        except Exception as e:
+            print(f"WARNING: Remote job sync failed: {e}", flush=True)
+            continue
+        for row in rows:
+            apply_remote_job(row)
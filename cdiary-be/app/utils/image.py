@@ -1,6 +1,16 @@
 import io
-from PIL import Image
-from typing import List
+import os
+from PIL import Image, features
+from typing import Dict, List, Optional, Tuple
+
+# Derivatives written next to every composed strip: "name:max_width" pairs,
+# 0 keeps the original width (a compact full-size copy).
+STRIP_DERIVATIVES = os.getenv("STRIP_DERIVATIVES", "thumb:320,medium:720,full:0")
+PANEL_DERIVATIVES = os.getenv("PANEL_DERIVATIVES", "medium:512")
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "WEBP").upper()
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+
+_CONTENT_TYPES = {"WEBP": "image/webp", "AVIF": "image/avif", "JPEG": "image/jpeg", "PNG": "image/png"}
 
 def combine_images_vertically(image_bytes_list: List[bytes]) -> bytes:
     images = [Image.open(io.BytesIO(b)) for b in image_bytes_list]
@@ -21,3 +31,68 @@ def combine_images_vertically(image_bytes_list: List[bytes]) -> bytes:
     output = io.BytesIO()
     combined.save(output, format='PNG')
     return output.getvalue()
+
+
+def parse_derivative_specs(spec: str) -> List[Tuple[str, int]]:
+    """ "thumb:320,full:0" -> [("thumb", 320), ("full", 0)] """
+    specs = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, width = part.partition(":")
+        specs.append((name.strip(), int(width or 0)))
+    return specs
+
+
+def derivative_format() -> Tuple[str, str, str]:
+    """
+    Returns (PIL format, file extension, content type), falling back to WEBP
+    (and then PNG) when this Pillow build can't encode the configured format.
+    """
+    fmt = DERIVATIVE_FORMAT
+    if fmt in ("WEBP", "AVIF") and not features.check(fmt.lower()):
+        fmt = "WEBP" if features.check("webp") else "PNG"
+    return fmt, fmt.lower(), _CONTENT_TYPES.get(fmt, "application/octet-stream")
+
+
+def make_derivatives(image_bytes: bytes, specs: List[Tuple[str, int]]) -> Dict[str, bytes]:
+    """
+    Resizes (never upscales) and re-encodes an image once per spec.
+    Returns {name: encoded bytes} in the format from derivative_format().
+    """
+    if not image_bytes or not specs:
+        return {}
+
+    fmt, _, _ = derivative_format()
+    source = Image.open(io.BytesIO(image_bytes))
+    source.load()
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGB")
+
+    out: Dict[str, bytes] = {}
+    for name, max_width in specs:
+        img = source
+        if max_width and source.width > max_width:
+            height = round(source.height * max_width / source.width)
+            img = source.resize((max_width, height), Image.LANCZOS)
+
+        buf = io.BytesIO()
+        if fmt == "PNG":
+            img.save(buf, format=fmt, optimize=True)
+        elif fmt == "WEBP":
+            img.save(buf, format=fmt, quality=DERIVATIVE_QUALITY, method=4)
+        else:
+            img.save(buf, format=fmt, quality=DERIVATIVE_QUALITY)
+        out[name] = buf.getvalue()
+    return out
+
+
+def pick_variant_key(variants: Optional[Dict[str, str]], fallback_key: Optional[str], *names: str) -> Optional[str]:
+    """
+    First derivative key found among `names`, else the original object key.
+    """
+    for name in names:
+        if variants and variants.get(name):
+            return variants[name]
+    return fallback_key
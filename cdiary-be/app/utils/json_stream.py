@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+
+class StreamingArrayParser:
+    """
+    Incremental parser for a streamed JSON object of the shape
+
+        {"<header fields>": ..., "<array_key>": [{...}, {...}, ...], ...}
+
+    feed() takes the next piece of text and returns the array items completed
+    by it, so work on item 1 can start while the model is still writing item 2.
+    Only strings, escapes and bracket depth are tracked; anything before the
+    first '{' (e.g. a ```json fence) is skipped. Items that don't parse are
+    dropped here; the caller parses the full text at the end as usual.
+
+    `header` holds the fields that came before the array (None until the array
+    starts), e.g. character_appearance ahead of "cuts".
+    """
+
+    def __init__(self, array_key: str):
+        self.text = ""
+        self.header: Optional[Dict[str, Any]] = None
+        self.items = 0
+        self._key = re.compile(r'"%s"\s*:\s*$' % re.escape(array_key))
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._root_start: Optional[int] = None
+        self._in_array = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        text = self.text
+        completed: List[Dict[str, Any]] = []
+
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._root_start is None:
+                if ch == "{":
+                    self._root_start = i
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                if ch == "[" and self._depth == 1 and self.header is None:
+                    match = self._key.search(text, self._root_start, i)
+                    if match:
+                        self._in_array = True
+                        self.header = _parse_header(text[self._root_start:match.start()])
+                elif ch == "{" and self._in_array and self._depth == 2:
+                    self._item_start = i
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if ch == "}" and self._item_start is not None and self._depth == 2:
+                    try:
+                        item = json.loads(text[self._item_start:i + 1])
+                    except ValueError:
+                        item = None
+                    if isinstance(item, dict):
+                        completed.append(item)
+                        self.items += 1
+                    self._item_start = None
+                elif ch == "]" and self._in_array and self._depth == 1:
+                    self._in_array = False
+
+        self._pos = len(text)
+        return completed
+
+
+def _parse_header(prefix: str) -> Dict[str, Any]:
+    # '{"a": 1, "b": "x",' -> {"a": 1, "b": "x"}
+    body = prefix.rstrip().rstrip(",")
+    try:
+        value = json.loads(body + "}")
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
@@ -0,0 +1,34 @@
+import base64
+import datetime
+import json
+from typing import Any, List
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Opaque keyset cursor: urlsafe base64 of the JSON-encoded sort key of the last row.
+    Dates/datetimes are stored as ISO strings.
+    """
+    def _default(v):
+        if isinstance(v, (datetime.date, datetime.datetime)):
+            return v.isoformat()
+        return str(v)
+
+    raw = json.dumps(values, default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Inverse of encode_cursor; raises ValueError for anything malformed. Our
+    cursors only ever hold strings, so forged ones like [1, 2] are rejected
+    here instead of failing later in fromisoformat()/UUID() with a TypeError.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError("Invalid cursor")
+    return values
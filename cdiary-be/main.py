@@ -1,26 +1,48 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import text
+import asyncio
 import sys
 import uvicorn
 from app.routers import diary, artifacts, image, auth, users, jobs
-from app.database import engine, Base
+from app.agent.clients import client_stats
+from app.agent.bootstrap import init_process
+from app.agent.text_cache import TEXT_CACHE
+from app.agent.bedrock import RENDER_CACHE, PRESIGN_CACHE
+from app.agent.blob_store import PANEL_BLOBS
+from app.agent.vector_index import VECTOR_INDEX
+from app.agent.vector_search import backend_info
+from app.agent.search_cache import QUERY_EMBEDDINGS, SEARCH_RESULTS
+from app.agent.job_backend import JOB_BACKEND
+from app.agent.consumer import JOB_CONSUMER, JOB_CONSUMER_EMBEDDED
+from app.agent.job_events import JOB_EVENTS
+from app.agent.store import JOB_REGISTRY
+from app.agent.admission import ADMISSION_STATS
+from app.agent.rate_limit import BEDROCK_LIMITERS
+from app.agent.coalesce import SUBMISSIONS
+from app.agent.checkpoint import CHECKPOINTS
 
 app = FastAPI()
 
 # Database Initialization (for development with SQLite)
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        
-        # Safely add content_embedding column if it doesn't exist for vector search
-        try:
-            await conn.execute(text("ALTER TABLE diaries ADD COLUMN content_embedding JSON"))
-            print("Added content_embedding column to diaries table.", flush=True)
-        except Exception:
-            # Column likely already exists
-            pass
+    # Schema migrations, pgvector/trigram setup, AWS clients, checkpointer
+    await init_process()
+
+    # Generation jobs: the local backend is only consumed in-process
+    if JOB_CONSUMER_EMBEDDED or not JOB_BACKEND.durable:
+        JOB_CONSUMER.start()
+    else:
+        JOB_BACKEND.start()
+    if JOB_BACKEND.durable:
+        # Progress of jobs run by other processes, for /api/jobs/stream
+        asyncio.create_task(jobs.sync_remote_jobs())
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Running jobs give their lease back so another consumer resumes them
+    await JOB_CONSUMER.stop()
+    CHECKPOINTS.close()
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -36,6 +58,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Register Routers
@@ -54,5 +77,31 @@ def read_root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    try:
+        queue_depth = await JOB_BACKEND.depth()
+    except Exception as e:
+        print(f"WARNING: Could not read job queue depth: {e}", flush=True)
+        queue_depth = None
+    return {
+        "aws_clients": client_stats(),
+        "bedrock_limiters": BEDROCK_LIMITERS.stats(),
+        "text_cache": TEXT_CACHE.stats(),
+        "render_cache": RENDER_CACHE.stats(),
+        "panel_blobs": PANEL_BLOBS.stats(),
+        "presigned_urls": PRESIGN_CACHE.stats(),
+        "vector_index": VECTOR_INDEX.stats(),
+        "vector_search": backend_info(),
+        "query_embedding_cache": QUERY_EMBEDDINGS.stats(),
+        "search_result_cache": SEARCH_RESULTS.stats(),
+        "jobs": JOB_CONSUMER.stats(),
+        "generation_queue": {"depth": queue_depth, **ADMISSION_STATS.as_dict()},
+        "generation_submissions": SUBMISSIONS.stats(),
+        "job_events": JOB_EVENTS.stats(),
+        "job_registry": JOB_REGISTRY.stats(),
+        "graph_checkpoints": CHECKPOINTS.stats(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, port=5050)
@@ -4,14 +4,24 @@ export const API_BASE_URL = import.meta.env.VITE_API_BASE_URL;
 
 export const api = {
   async generateDiary(data: DiaryEntryRequest): Promise<{ jobId: string, artifactId: string }> {
-    const response = await fetch(`${API_BASE_URL}/diary/generate`, {
+    // Same key on the retry below, so the server answers with the job it may already have started
+    const idempotencyKey = crypto.randomUUID();
+    const send = () => fetch(`${API_BASE_URL}/diary/generate`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'Authorization': `Bearer ${localStorage.getItem('token')}`
+        'Authorization': `Bearer ${localStorage.getItem('token')}`,
+        'Idempotency-Key': idempotencyKey
       },
       body: JSON.stringify(data),
     });
+    let response: Response;
+    try {
+      response = await send();
+    } catch (err) {
+      // Network error: the request may or may not have reached the server
+      response = await send();
+    }
     if (!response.ok) throw new Error('Failed to start generation');
     return response.json();
   },
@@ -82,6 +92,18 @@ export const api = {
     return response.json();
   },
 
+  async resumeJob(jobId: string): Promise<{ jobId: string, artifactId: string }> {
+    // Continues a failed job from its last checkpoint
+    const response = await fetch(`${API_BASE_URL}/diary/generate/${jobId}/resume`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${localStorage.getItem('token')}`
+      }
+    });
+    if (!response.ok) throw new Error('Failed to resume job');
+    return response.json();
+  },
+
   async getArtifacts(limit: number = 20, query?: string, userId?: string): Promise<{ items: ArtifactSummary[] }> {
     if (!userId) {
       // Fallback or error if userId is missing, but usually HomeScreen has it
@@ -127,10 +149,18 @@ export const api = {
     return response.json();
   },
 
-  async regenerate(data: any): Promise<{ jobId: string }> {
-    // Placeholder for regeneration API
-    console.log("Regenerate not implemented in backend fully yet", data);
-    return { jobId: "mock-job-id" };
+  async regeneratePanel(artifactId: string, cutIndex: number, prompt?: string): Promise<ArtifactResponse> {
+    // Re-renders one panel from the stored storyboard and recomposes the strip
+    const response = await fetch(`${API_BASE_URL}/artifacts/${artifactId}/panels/${cutIndex}/regenerate`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${localStorage.getItem('token')}`
+      },
+      body: JSON.stringify({ prompt: prompt || null })
+    });
+    if (!response.ok) throw new Error('Failed to regenerate panel');
+    return response.json();
   },
 
   async updateUser(userId: string, data: any): Promise<any> {
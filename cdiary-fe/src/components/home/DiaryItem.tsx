@@ -2,6 +2,7 @@ import React from 'react';
 import { Trash2 } from 'lucide-react';
 import { ArtifactSummary } from '../../types';
 import { Card } from '../common/Card';
+import { api } from '../../api/client';
 
 interface DiaryItemProps {
   art: ArtifactSummary;
@@ -29,7 +30,18 @@ export const DiaryItem: React.FC<DiaryItemProps> = React.memo(({ art, activeJob,
             return (
               <div className="flex flex-col items-center justify-center bg-gray-50 dark:bg-gray-800 w-full h-full p-2">
                 {activeJob.status === "FAILED" ? (
-                  <span className="text-[10px] text-red-500 font-bold text-center px-1">Error</span>
+                  <>
+                    <span className="text-[10px] text-red-500 font-bold text-center px-1">Error</span>
+                    <button
+                      className="text-[9px] text-primary underline mt-1"
+                      onClick={(e) => {
+                        e.stopPropagation();
+                        api.resumeJob(activeJob.jobId).catch(err => console.error("Resume failed", err));
+                      }}
+                    >
+                      Retry
+                    </button>
+                  </>
                 ) : (
                   <>
                     <div className="w-full bg-gray-200 dark:bg-gray-600 rounded-full h-1.5 mb-1 overflow-hidden">
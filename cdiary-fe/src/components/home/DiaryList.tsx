@@ -20,25 +20,46 @@ export const DiaryList: React.FC<DiaryListProps> = ({ artifacts, onDelete, onJob
     const sseUrl = `${API_BASE_URL}/jobs/stream${token ? `?token=${token}` : ''}`;
     const sse = new EventSource(sseUrl);
 
-    sse.onmessage = (event) => {
+    const notifyDone = (jobs: Record<string, any>) => {
+      const newlyDoneJobs = Object.entries(jobs).filter(([id, job]) =>
+        job.status === "DONE" && !completedJobIds.current.has(id)
+      );
+
+      if (newlyDoneJobs.length > 0) {
+        console.log("Newly Done Jobs detected:", newlyDoneJobs.map(([id]) => id));
+        newlyDoneJobs.forEach(([id]) => completedJobIds.current.add(id));
+        onJobDone(false);
+      }
+    };
+
+    // Full state of the user's jobs (on connect, or when the server can't resume)
+    sse.addEventListener("snapshot", (event) => {
       try {
-        const jobsData = JSON.parse(event.data) as Record<string, any>;
-        console.log("SSE Received Jobs Data:", jobsData);
+        const jobsData = JSON.parse((event as MessageEvent).data) as Record<string, any>;
         setActiveJobs(jobsData);
+        notifyDone(jobsData);
+      } catch (err) {
+        console.error("Failed to parse SSE snapshot", err);
+      }
+    });
 
-        const newlyDoneJobs = Object.entries(jobsData).filter(([id, job]) =>
-          job.status === "DONE" && !completedJobIds.current.has(id)
-        );
-
-        if (newlyDoneJobs.length > 0) {
-          console.log("Newly Done Jobs detected:", newlyDoneJobs.map(([id]) => id));
-          newlyDoneJobs.forEach(([id]) => completedJobIds.current.add(id));
-          onJobDone(false);
+    // Changed fields of a single job
+    sse.addEventListener("job", (event) => {
+      try {
+        const delta = JSON.parse((event as MessageEvent).data) as Record<string, any>;
+        if (delta.removed) {
+          setActiveJobs(prev => {
+            const { [delta.jobId]: _removed, ...rest } = prev;
+            return rest;
+          });
+          return;
         }
+        setActiveJobs(prev => ({ ...prev, [delta.jobId]: { ...prev[delta.jobId], ...delta } }));
+        notifyDone({ [delta.jobId]: delta });
       } catch (err) {
-        console.error("Failed to parse SSE data", err);
+        console.error("Failed to parse SSE job event", err);
       }
-    };
+    });
 
     return () => sse.close();
   }, [onJobDone]);
@@ -94,6 +94,11 @@ const translations: TranslationDict = {
   "save_share": { ko: "저장 및 공유", en: "Save & Share" },
   "saved_at": { ko: "저장되었습니다!", en: "Saved!" },
   "regen_start_failed": { ko: "재생성 시작에 실패했습니다.", en: "Failed to start regeneration." },
+  "panels": { ko: "컷별로 다시 그리기", en: "Redraw a Panel" },
+  "panel_label": { ko: "컷", en: "Panel" },
+  "panel_prompt_hint": { ko: "그림 설명을 고쳐서 다시 그릴 수 있어요.", en: "Edit the description to redraw this panel." },
+  "regen_panel": { ko: "이 컷 다시 그리기", en: "Redraw Panel" },
+  "regen_panel_failed": { ko: "컷 재생성에 실패했습니다.", en: "Failed to redraw the panel." },
   "creating_comic": { ko: "그림을 그리는 중...", en: "Drawing your picture..." },
   "please_wait": { ko: "잠시만 기다려 주세요.", en: "Please wait..." },
 
@@ -8,7 +8,7 @@ import { api } from '../api/client';
 import { useAlert } from '../context/AlertContext';
 import { useLanguage } from '../context/LanguageContext';
 import { ArtifactResponse } from '../types';
-import { Edit2, Check, X } from 'lucide-react';
+import { Edit2, Check, X, RefreshCw } from 'lucide-react';
 
 export const ResultScreen: React.FC = () => {
   const { artifactId } = useParams<{ artifactId: string }>();
@@ -20,6 +20,8 @@ export const ResultScreen: React.FC = () => {
   const [isEditing, setIsEditing] = useState(false);
   const [editedText, setEditedText] = useState('');
   const [isUpdating, setIsUpdating] = useState(false);
+  const [panelPrompts, setPanelPrompts] = useState<Record<number, string>>({});
+  const [regeneratingPanel, setRegeneratingPanel] = useState<number | null>(null);
 
   const fetchArtifact = async () => {
     if (artifactId) {
@@ -70,7 +72,8 @@ export const ResultScreen: React.FC = () => {
         mood: artifact.mood || 'normal',
         stylePreset: artifact.stylePreset as any,
         diaryDate: artifact.diaryDate as any,
-        options: artifact.options || { moreFunny: false, focusEmotion: false, lessText: false }
+        options: artifact.options || { moreFunny: false, focusEmotion: false, lessText: false },
+        useCache: false
       });
       navigate('/home');
     } catch (error) {
@@ -81,6 +84,31 @@ export const ResultScreen: React.FC = () => {
     }
   };
 
+  const handleRegeneratePanel = async (cutIndex: number, storedPrompt?: string) => {
+    if (!artifactId) return;
+    const edited = panelPrompts[cutIndex];
+    setRegeneratingPanel(cutIndex);
+    try {
+      // Unchanged prompt: the server redraws it with a new seed
+      const updated = await api.regeneratePanel(
+        artifactId,
+        cutIndex,
+        edited !== undefined && edited.trim() && edited !== storedPrompt ? edited.trim() : undefined
+      );
+      setArtifact(updated);
+      setPanelPrompts(prev => {
+        const next = { ...prev };
+        delete next[cutIndex];
+        return next;
+      });
+    } catch (error) {
+      console.error(error);
+      showAlert(t('regen_panel_failed'));
+    } finally {
+      setRegeneratingPanel(null);
+    }
+  };
+
   const handleUpdate = async () => {
     if (!artifactId || !editedText.trim()) return;
     setIsUpdating(true);
@@ -122,6 +150,45 @@ export const ResultScreen: React.FC = () => {
           </div>
         </Card>
 
+        {/* Per-panel regeneration (stored storyboard + prompts) */}
+        {artifact.finalStripUrl && artifact.storyboard?.panels?.some(p => p.cutIndex !== undefined && p.prompt) && (
+          <Card className="p-4 mb-4">
+            <h3 className="font-bold text-gray-900 dark:text-gray-100 mb-1">{t('panels')}</h3>
+            <p className="text-xs text-gray-500 mb-3">{t('panel_prompt_hint')}</p>
+            <div className="flex flex-col gap-4">
+              {artifact.storyboard.panels.map((panel, i) => {
+                if (panel.cutIndex === undefined || !panel.prompt) return null;
+                const cutIndex = panel.cutIndex;
+                return (
+                  <div key={cutIndex} className="flex gap-3">
+                    {artifact.panelUrls[i] && (
+                      <img src={artifact.panelUrls[i]} alt={`${t('panel_label')} ${cutIndex}`} className="w-20 h-20 object-cover rounded-md flex-shrink-0" />
+                    )}
+                    <div className="flex-1 flex flex-col gap-2">
+                      <span className="text-xs font-semibold text-gray-600 dark:text-gray-400">{t('panel_label')} {cutIndex}</span>
+                      <textarea
+                        value={panelPrompts[cutIndex] ?? panel.prompt}
+                        onChange={(e) => setPanelPrompts(prev => ({ ...prev, [cutIndex]: e.target.value }))}
+                        disabled={regeneratingPanel !== null}
+                        className="w-full p-2 border border-gray-200 rounded-md text-xs min-h-[60px] focus:ring-1 focus:ring-primary focus:border-primary outline-none"
+                      />
+                      <Button
+                        variant="secondary"
+                        onClick={() => handleRegeneratePanel(cutIndex, panel.prompt)}
+                        isLoading={regeneratingPanel === cutIndex}
+                        disabled={regeneratingPanel !== null}
+                      >
+                        <RefreshCw size={14} className="inline mr-1" />
+                        {t('regen_panel')}
+                      </Button>
+                    </div>
+                  </div>
+                );
+              })}
+            </div>
+          </Card>
+        )}
+
         {/* Diary Content */}
         {artifact.diaryText !== undefined && (
           <Card className="p-4 mb-4 relative">
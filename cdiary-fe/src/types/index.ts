@@ -18,9 +18,12 @@ export interface DiaryEntryRequest {
   diaryDate?: string;
   protagonistName?: string;
   options: GenerationOptions;
+  // false: new seed, skip the server's text/render caches (a different picture)
+  useCache?: boolean;
 }
 
 export enum JobStatus {
+  QUEUED = "QUEUED",
   READING_DIARY = "READING_DIARY",
   BUILDING_STORYBOARD = "BUILDING_STORYBOARD",
   GENERATING_IMAGES = "GENERATING_IMAGES",
@@ -36,11 +39,14 @@ export interface JobResponse {
   progress: number;
   artifactId?: string;
   error?: string;
+  // Cuts that failed to render; the strip was composed without them
+  failedCuts?: number[];
 }
 
 export interface Panel {
   text: string;
-  // Add other panel properties as needed
+  cutIndex?: number;
+  prompt?: string;
 }
 
 export interface Storyboard {